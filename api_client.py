@@ -0,0 +1,148 @@
+# Shared HTTP client for the Streamlit frontend
+# Keeps one pooled requests.Session for the whole app, caches GET results with
+# short TTLs (revalidated with the API's ETags once they expire) and lets a
+# view fetch its independent calls in parallel.
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Initialize API endpoint (docker-compose passes API_URL)
+API_URL = os.environ.get("API_URL", "http://localhost:5000/api")
+
+# Seconds a cached GET result is served without asking the API again
+DEFAULT_TTL = 10
+TTLS = {
+    "/users": 60,
+    "/settings/model": 30,
+}
+
+# Upper bound on concurrent requests issued by fetch_all
+MAX_PARALLEL_REQUESTS = 8
+
+_session = None
+_session_lock = threading.Lock()
+
+# path -> (expires_at, etag, data)
+_cache = {}
+_cache_lock = threading.Lock()
+
+_executor = ThreadPoolExecutor(max_workers=MAX_PARALLEL_REQUESTS)
+
+
+def get_session():
+    """Return the process-wide pooled session"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=MAX_PARALLEL_REQUESTS)
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+        return _session
+
+
+def _ttl_for(path):
+    for prefix, ttl in TTLS.items():
+        if path.startswith(prefix):
+            return ttl
+    return DEFAULT_TTL
+
+
+def get(path, ttl=None):
+    """GET an API path (e.g. '/users') and return the decoded JSON
+
+    Fresh cache entries are returned without a request; stale ones are
+    revalidated with If-None-Match so an unchanged resource costs a 304.
+    API errors come back as their JSON body ({"error": ...}); error pages
+    that are not JSON raise requests.HTTPError.
+    """
+    ttl = _ttl_for(path) if ttl is None else ttl
+    now = time.monotonic()
+    with _cache_lock:
+        entry = _cache.get(path)
+    if entry is not None and entry[0] > now:
+        return entry[2]
+
+    headers = {}
+    if entry is not None and entry[1]:
+        headers["If-None-Match"] = entry[1]
+
+    response = get_session().get(f"{API_URL}{path}", headers=headers)
+    if response.status_code == 304 and entry is not None:
+        data = entry[2]
+        etag = entry[1]
+    else:
+        if not response.ok and "json" not in response.headers.get("Content-Type", ""):
+            # e.g. an HTML 500 page or a proxy error, there is nothing to decode
+            response.raise_for_status()
+        data = response.json()
+        etag = response.headers.get("ETag")
+
+    if response.status_code in (200, 304):
+        with _cache_lock:
+            _cache[path] = (time.monotonic() + ttl, etag, data)
+    return data
+
+
+def post(path, json=None, invalidate=()):
+    """POST to an API path and drop cached entries starting with any of the given prefixes"""
+    response = get_session().post(f"{API_URL}{path}", json=json)
+    invalidate_cache(*invalidate)
+    return response
+
+
+def invalidate_cache(*prefixes):
+    """Forget cached GET results; with no prefixes the whole cache is cleared"""
+    with _cache_lock:
+        if not prefixes:
+            _cache.clear()
+            return
+        for path in list(_cache):
+            if path.startswith(prefixes):
+                del _cache[path]
+
+
+def fetch_all(calls, optional=()):
+    """Run several GETs in parallel
+
+    Args:
+        calls (dict): name -> API path
+        optional (iterable): names whose failure is tolerated (their result is None)
+
+    Returns:
+        dict: name -> decoded JSON, so the total wait is the slowest call
+    """
+    futures = {name: _executor.submit(get, path) for name, path in calls.items()}
+    results = {}
+    for name, future in futures.items():
+        try:
+            results[name] = future.result()
+        except Exception:
+            if name not in optional:
+                raise
+            results[name] = None
+    return results
+
+
+def get_dashboard(user_id, include=("progress", "recommendations", "model"), count=3):
+    """Fetch a user's dashboard (progress, recommendations, model) in a single request"""
+    return get(f"/user/{user_id}/dashboard?include={','.join(include)}&count={count}")
+
+
+def mark_as_read(user_id, content_id):
+    """Record a read and invalidate everything derived from that user's history"""
+    return post(
+        f"/user/{user_id}/read/{content_id}",
+        invalidate=(f"/user/{user_id}/", f"/recommend/{user_id}?")
+    )
+
+
+def set_model(model_name):
+    """Switch the semantic model; cached model info and recommendations become stale"""
+    return post("/settings/model", json={"model": model_name},
+                invalidate=("/settings/model", "/recommend/", "/user/"))
@@ -1,6 +1,12 @@
 from flask import Flask, request, jsonify
 from recommendation_engine import recommend_content, analyze_reading_history
 from text_analyzer import analyze_text_complexity, extract_topics
+from graded_lexicon import score_vocabulary
+from response_cache import cached_get
+from inference_limiter import InferenceOverloaded
+import response_cache
+import write_behind
+import profiling
 import database
 
 # Import the simplified analyzer instead of the full semantic analyzer
@@ -16,18 +22,55 @@ except ImportError as e:
 
 app = Flask(__name__)
 
+# Opt-in cProfile hooks, nothing is registered unless profiling is configured
+profiling.install(app)
+
+if write_behind.ENABLED:
+    # Commit events left in the logs of a previous run and start the group-commit thread
+    write_behind.start()
+
+@app.errorhandler(InferenceOverloaded)
+def inference_overloaded(error):
+    """Shed load quickly instead of queueing more model calls"""
+    response = jsonify({
+        "error": "Recommendation service is busy, please retry shortly",
+        "reason": error.reason,
+        "retry_after": error.retry_after
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
 @app.route('/api/setup', methods=['GET'])
 def setup_database():
     """Initialize the database with sample data"""
     database.create_database()
+    response_cache.clear()
     return jsonify({"message": "Database initialized successfully"})
 
 @app.route('/api/recommend/<int:user_id>', methods=['GET'])
 def get_recommendations(user_id):
     """Get content recommendations for a user"""
     count = request.args.get('count', default=3, type=int)
-    recommendations = recommend_content(user_id, n_recommendations=count)
-    return jsonify(recommendations)
+    deadline_ms = request.args.get('deadline_ms', default=None, type=float)
+    meta = {}
+    recommendations = recommend_content(user_id, n_recommendations=count, meta=meta, deadline_ms=deadline_ms)
+    response = jsonify(recommendations)
+    
+    # Which scorer produced the ranking: 'embedding', or 'keyword' when the model missed the deadline
+    if 'scoring_tier' in meta:
+        response.headers['X-Scoring-Tier'] = meta['scoring_tier']
+    if 'fallback_reason' in meta:
+        response.headers['X-Scoring-Fallback'] = meta['fallback_reason']
+    
+    # Expose the per-stage pipeline timings, e.g. "keyword;dur=0.1;desc=12"
+    stages = meta.get('stages', {})
+    if stages:
+        response.headers['Server-Timing'] = ", ".join(
+            f"{name};dur={stage['ms']:.2f};desc=\"{stage['candidates']} candidates\""
+            for name, stage in stages.items()
+        )
+    return response
 
 @app.route('/api/analyze', methods=['POST'])
 def analyze_text():
@@ -41,26 +84,24 @@ def analyze_text():
     
     return jsonify({
         "analysis": analysis,
-        "topics": topics
+        "topics": topics,
+        "vocabulary_grades": score_vocabulary(data['text'])
     })
 
 @app.route('/api/users', methods=['GET'])
+@cached_get('users')
 def get_users():
     """Get list of all users"""
     users = database.get_users().to_dict('records')
     return jsonify(users)
 
 @app.route('/api/user/<int:user_id>/progress', methods=['GET'])
+@cached_get('content', 'user:{user_id}', 'vocabulary')
 def get_user_progress(user_id):
     """Get reading progress for a user"""
     progress = analyze_reading_history(user_id)
     return jsonify(progress)
 
-@app.route('/api/user/<int:user_id>/read/<int:content_id>', methods=['POST'])
-def mark_as_read(user_id, content_id):
-    """Mark content as read by user"""
-    success = database.update_user_history(user_id, content_id)
-    
 @app.route('/api/settings/model', methods=['POST'])
 def set_semantic_model():
     """Set the semantic model to use for recommendations"""
@@ -74,7 +115,9 @@ def set_semantic_model():
         }), 400
     
     model_name = data['model']
-    if set_model(model_name):
+    success = set_model(model_name)
+    response_cache.bump_local_version('model')
+    if success:
         return jsonify({
             "message": f"Model set to {get_current_model()} successfully",
             "current_model": get_current_model()
@@ -86,6 +129,7 @@ def set_semantic_model():
         }), 500
         
 @app.route('/api/settings/model', methods=['GET'])
+@cached_get('model')
 def get_semantic_model():
     """Get the current semantic model being used for recommendations"""
     from semantic_analyzer import get_current_model
@@ -94,10 +138,66 @@ def get_semantic_model():
         "current_model": get_current_model()
     })
 
+# Parts the dashboard endpoint can return
+DASHBOARD_PARTS = ('progress', 'recommendations', 'model')
+
+@app.route('/api/user/<int:user_id>/dashboard', methods=['GET'])
+@cached_get('content', 'user:{user_id}', 'vocabulary', 'model')
+def get_user_dashboard(user_id):
+    """Get progress, recommendations and model info for a user in one call
+    
+    Query parameters:
+        include: comma-separated subset of progress,recommendations,model (default: all)
+        count: number of recommendations (default: 3)
+        deadline_ms: latency budget for scoring the recommendations
+    """
+    from semantic_analyzer import get_current_model
+    
+    include = request.args.get('include', default=','.join(DASHBOARD_PARTS))
+    parts = [part.strip() for part in include.split(',') if part.strip()]
+    unknown = [part for part in parts if part not in DASHBOARD_PARTS]
+    if unknown:
+        return jsonify({
+            "error": f"Unknown dashboard parts: {', '.join(unknown)}",
+            "available_parts": list(DASHBOARD_PARTS)
+        }), 400
+    count = request.args.get('count', default=3, type=int)
+    deadline_ms = request.args.get('deadline_ms', default=None, type=float)
+    
+    # Load the user once and share it between the parts
+    user = database.get_user_data(user_id)
+    if user is None:
+        return jsonify({"error": "User not found"}), 404
+    
+    dashboard = {"user_id": user_id}
+    if 'progress' in parts:
+        dashboard['progress'] = analyze_reading_history(user_id, user=user)
+    meta = {}
+    if 'recommendations' in parts:
+        dashboard['recommendations'] = recommend_content(user_id, n_recommendations=count, user=user,
+                                                         meta=meta, deadline_ms=deadline_ms)
+        if 'scoring_tier' in meta:
+            dashboard['scoring_tier'] = meta['scoring_tier']
+    if 'model' in parts:
+        dashboard['model'] = {"current_model": get_current_model()}
+    response = jsonify(dashboard)
+    if meta.get('fallback_reason', 'unavailable') != 'unavailable':
+        # A fallback answer must not be cached in place of the full one; without
+        # embedding models there is no fuller answer to wait for
+        response.headers['Cache-Control'] = 'no-store'
+    return response
+
 @app.route('/api/user/<int:user_id>/read/<int:content_id>', methods=['POST'])
 def mark_content_read(user_id, content_id):
     """Mark content as read by user"""
-    success = database.update_user_history(user_id, content_id)
+    # The id sizes the user's read bitmap, so it must be a catalog item
+    if not database.content_exists(content_id):
+        return jsonify({"error": f"Content {content_id} not found"}), 404
+    if write_behind.ENABLED:
+        # Durably logged now, committed with the next group commit
+        success = write_behind.record_read(user_id, content_id)
+    else:
+        success = database.update_user_history(user_id, content_id)
     
     if success:
         return jsonify({"message": f"Content {content_id} marked as read by user {user_id}"})
@@ -126,5 +226,106 @@ def setup_models():
     except Exception as e:
         return jsonify({"error": f"Error loading models: {str(e)}"}), 500
 
+@app.route('/api/system/inference', methods=['GET'])
+def inference_health():
+    """Inference queue depth, rejection counters and the inference service health"""
+    import inference_service
+    import inference_limiter
+    import inference_batcher
+    
+    report = {
+        "limiter": inference_limiter.limiter.summary(),
+        "batchers": inference_batcher.batcher_stats()
+    }
+    if not inference_service.is_enabled():
+        report["service"] = {"enabled": False, "message": "Inference runs inside the API process"}
+        return jsonify(report)
+    try:
+        report["service"] = dict(inference_service.health(), enabled=True, address=inference_service.ADDRESS)
+        return jsonify(report)
+    except inference_service.InferenceError as e:
+        report["service"] = {"enabled": True, "healthy": False, "error": str(e)}
+        return jsonify(report), 503
+
+@app.route('/api/system/writes', methods=['GET'])
+def write_behind_stats():
+    """Write-behind queue depth, group-commit and acknowledgement latency counters"""
+    return jsonify(write_behind.summary())
+
+@app.route('/api/system/memory', methods=['GET'])
+def memory_report():
+    """Process RSS, model parameter memory, the catalog snapshot and cache sizes"""
+    import embedding_store
+    import catalog_index
+    # Only report on the models, importing semantic_analyzer here would load torch
+    semantic_analyzer = sys.modules.get('semantic_analyzer')
+    
+    report = {}
+    try:
+        import psutil
+        process_memory = psutil.Process().memory_info()
+        report["process"] = {"rss_bytes": process_memory.rss, "vms_bytes": process_memory.vms}
+    except ImportError:
+        report["process"] = {"error": "psutil is not installed"}
+    
+    report["models"] = semantic_analyzer.model_memory() if semantic_analyzer is not None else {}
+    torch = sys.modules.get('torch')
+    if torch is not None:
+        report["torch"] = {"threads": torch.get_num_threads()}
+        if torch.cuda.is_available():
+            report["torch"]["cuda_allocated_bytes"] = torch.cuda.memory_allocated()
+    
+    snapshot = embedding_store.attach()
+    report["catalog_snapshot"] = (
+        {"generation": snapshot.generation, "mapped_bytes": snapshot.nbytes(), "model": snapshot.model}
+        if snapshot is not None else None
+    )
+    index = catalog_index._index
+    report["caches"] = {
+        "responses": response_cache.cache_info(),
+        "users": database.user_cache_info(),
+        "catalog_index": (
+            {"items": len(index.ids), "bytes": int(index.content.memory_usage(deep=True).sum())}
+            if index is not None else None
+        )
+    }
+    return jsonify(report)
+
+@app.route('/api/system/models/unload', methods=['POST'])
+def unload_models():
+    """Free a loaded model ({"model": "sbert" | "qwen"}, both when omitted)
+    
+    The model is loaded again by the next request that needs it.
+    """
+    data = request.get_json(silent=True) or {}
+    model_name = data.get('model')
+    if model_name not in (None, 'sbert', 'qwen'):
+        return jsonify({"error": f"Unknown model: {model_name}"}), 400
+    semantic_analyzer = sys.modules.get('semantic_analyzer')
+    if semantic_analyzer is None:
+        return jsonify({"unloaded": [], "freed_parameter_bytes": 0, "models": {}})
+    before = semantic_analyzer.model_memory()
+    unloaded = semantic_analyzer.unload_model(model_name)
+    return jsonify({
+        "unloaded": unloaded,
+        "freed_parameter_bytes": sum(before[name].get('bytes', 0) for name in unloaded),
+        "models": semantic_analyzer.model_memory()
+    })
+
+@app.route('/api/system/profiles', methods=['GET'])
+def profile_summary():
+    """Hottest functions across the saved request profiles
+    
+    Optional filters: ?endpoint=get_recommendations&user_id=3, plus
+    ?limit= (rows) and ?sort=cumulative|tottime
+    """
+    report = profiling.summarize(
+        endpoint=request.args.get('endpoint'),
+        user_id=request.args.get('user_id', type=int),
+        limit=request.args.get('limit', default=25, type=int),
+        sort=request.args.get('sort', default='cumulative')
+    )
+    return jsonify(report)
+
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
\ No newline at end of file
@@ -0,0 +1,140 @@
+# Compare the NLTK and regex tokenizer modes of text_analyzer
+# Reports import/first-call time, per-text latency of the /api/analyze path
+# (analyze_text_complexity + extract_topics) and how closely the regex counts
+# agree with NLTK on the catalog texts.
+#
+# Usage:
+#   python benchmark_tokenizers.py                 # texts from the database catalog
+#   python benchmark_tokenizers.py books.jsonl     # texts from an ingestion file
+
+import os
+import sys
+import time
+import argparse
+import subprocess
+import statistics
+
+MODES = ('nltk', 'regex')
+
+# Run in a fresh interpreter so nothing is already imported or cached
+IMPORT_SNIPPET = (
+    "import time; started = time.perf_counter(); import text_analyzer; "
+    "text_analyzer.simple_tokenize('Warm up.'); text_analyzer.simple_sent_tokenize('Warm up.'); "
+    "print(time.perf_counter() - started)"
+)
+
+
+def load_texts(path=None, limit=None):
+    """Catalog texts from the database or from a CSV/JSONL ingestion file"""
+    if path:
+        from ingest_catalog import iter_records
+        texts = (record.get('text') or '' for record in iter_records(path))
+    else:
+        from database import get_all_content
+        texts = iter(get_all_content()['text'].tolist())
+    texts = [text for text in texts if text]
+    return texts[:limit] if limit else texts
+
+
+def import_time(mode, repeats=3):
+    """Median seconds to import text_analyzer and tokenize once in a new process"""
+    env = dict(os.environ, FREADOM_TOKENIZER=mode)
+    times = []
+    for _ in range(repeats):
+        result = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], env=env,
+                                capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        if result.returncode != 0:
+            return None
+        times.append(float(result.stdout.strip().splitlines()[-1]))
+    return statistics.median(times)
+
+
+def per_text_latency(text_analyzer, texts, repeats=3):
+    """Mean milliseconds per text for tokenizing alone and for the full /api/analyze work"""
+    started = time.perf_counter()
+    for _ in range(repeats):
+        for text in texts:
+            text_analyzer.simple_tokenize(text)
+            text_analyzer.simple_sent_tokenize(text)
+    tokenize_ms = (time.perf_counter() - started) * 1000 / (repeats * len(texts))
+
+    started = time.perf_counter()
+    for _ in range(repeats):
+        for text in texts:
+            text_analyzer.analyze_text_complexity(text)
+            text_analyzer.extract_topics(text)
+    analyze_ms = (time.perf_counter() - started) * 1000 / (repeats * len(texts))
+    return tokenize_ms, analyze_ms
+
+
+def counts(text_analyzer, text):
+    words = text_analyzer.simple_tokenize(text)
+    return {
+        'words': sum(1 for token in words if token.isalpha()),
+        'tokens': len(words),
+        'sentences': len(text_analyzer.simple_sent_tokenize(text)),
+        'topics': text_analyzer.extract_topics(text),
+    }
+
+
+def compare_counts(text_analyzer, texts):
+    """Per-metric agreement of the regex mode with NLTK"""
+    exact = {'words': 0, 'tokens': 0, 'sentences': 0, 'topics': 0}
+    relative_error = {'words': [], 'tokens': [], 'sentences': []}
+    for text in texts:
+        text_analyzer.TOKENIZER = 'nltk'
+        reference = counts(text_analyzer, text)
+        text_analyzer.TOKENIZER = 'regex'
+        candidate = counts(text_analyzer, text)
+        for metric in exact:
+            exact[metric] += reference[metric] == candidate[metric]
+        for metric in relative_error:
+            relative_error[metric].append(abs(reference[metric] - candidate[metric]) / max(reference[metric], 1))
+    return {
+        metric: {
+            'exact_match_pct': 100.0 * exact[metric] / len(texts),
+            'mean_abs_error_pct': 100.0 * statistics.mean(relative_error[metric]) if metric in relative_error else None
+        }
+        for metric in exact
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the NLTK and regex tokenizer modes")
+    parser.add_argument('path', nargs='?', help="CSV/JSONL catalog file (default: the database catalog)")
+    parser.add_argument('--limit', type=int, default=2000, help="maximum number of texts")
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    texts = load_texts(args.path, args.limit)
+    print(f"{len(texts)} texts, {sum(len(text) for text in texts) / max(len(texts), 1):.0f} characters on average\n")
+
+    import text_analyzer
+    available = []
+    for mode in MODES:
+        text_analyzer.TOKENIZER = mode
+        try:
+            text_analyzer.simple_sent_tokenize("Check.")
+            available.append(mode)
+        except Exception as e:
+            # NLTK's LookupError message is framed in lines of asterisks
+            reason = next((line.strip() for line in str(e).splitlines() if line.strip().strip('*')), '')
+            print(f"Skipping {mode} mode: {type(e).__name__}: {reason}")
+
+    print(f"{'mode':<8}{'import + first call (ms)':>26}{'tokenize (ms/text)':>20}{'analyze (ms/text)':>20}")
+    for mode in available:
+        text_analyzer.TOKENIZER = mode
+        seconds = import_time(mode)
+        tokenize_ms, analyze_ms = per_text_latency(text_analyzer, texts, args.repeats)
+        startup = f"{seconds * 1000:.1f}" if seconds is not None else "failed"
+        print(f"{mode:<8}{startup:>26}{tokenize_ms:>20.3f}{analyze_ms:>20.3f}")
+
+    if available == list(MODES):
+        print("\nAgreement of the regex mode with NLTK:")
+        for metric, result in compare_counts(text_analyzer, texts).items():
+            line = f"  {metric:<10} exact match {result['exact_match_pct']:5.1f}%"
+            if result['mean_abs_error_pct'] is not None:
+                line += f", mean abs error {result['mean_abs_error_pct']:.2f}%"
+            print(line)
+    else:
+        print("\nNLTK data is not available, count agreement not checked")
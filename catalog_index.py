@@ -0,0 +1,151 @@
+# In-memory catalog snapshot with a sorted reading-level index, age-range buckets,
+# a popularity ordering and an inverted keyword index. The recommendation
+# pipeline's candidate generators use it to pick items before any semantic
+# scoring happens.
+
+import os
+import threading
+import numpy as np
+
+from database import get_all_content, get_data_versions
+
+# Half-width of the initial reading-level window around the target level
+LEVEL_WINDOW = float(os.environ.get('FREADOM_LEVEL_WINDOW', '1.0'))
+
+# The window is doubled until at least this many unread candidates are found
+MIN_CANDIDATES = int(os.environ.get('FREADOM_MIN_CANDIDATES', '50'))
+
+# Also restrict candidates to items whose age range covers the reader's age
+AGE_FILTER = os.environ.get('FREADOM_AGE_FILTER', '0') == '1'
+
+# Oldest age an open-ended range such as "12+" is assumed to cover
+MAX_AGE = 18
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def parse_age_range(age_range):
+    """Turn an age range such as '6-8' or '12+' into (low, high), None if unparseable"""
+    if not isinstance(age_range, str):
+        return None
+    age_range = age_range.strip()
+    try:
+        if age_range.endswith('+'):
+            return int(age_range[:-1]), MAX_AGE
+        low, high = age_range.split('-')
+        return int(low), int(high)
+    except ValueError:
+        return None
+
+
+class CatalogIndex:
+    """Catalog DataFrame plus the level and age indexes built over its row positions"""
+
+    def __init__(self, content, version):
+        self.content = content.reset_index(drop=True)
+        self.version = version
+        self.ids = self.content['id'].to_numpy(dtype=np.int64)
+
+        # Sorted reading-level index: positions ordered by level for range lookups
+        levels = self.content['reading_level'].to_numpy(dtype=np.float64)
+        self.level_order = np.argsort(levels, kind='stable')
+        self.sorted_levels = levels[self.level_order]
+
+        # Positions ordered by popularity, most popular first
+        self.popularity = self.content['popularity'].to_numpy(dtype=np.float64)
+        self.popularity_order = np.argsort(-self.popularity, kind='stable')
+
+        # Inverted keyword index over topics and title words: keyword -> positions
+        keywords = {}
+        for position, (title, topics) in enumerate(zip(self.content['title'], self.content['topics'])):
+            words = set(str(title).lower().split())
+            if isinstance(topics, list):
+                words.update(topic.lower() for topic in topics)
+            for word in words:
+                keywords.setdefault(word, []).append(position)
+        self.keyword_index = {word: np.array(positions, dtype=np.int64) for word, positions in keywords.items()}
+
+        # age -> sorted positions of the items suitable for that age
+        buckets = {}
+        for position, age_range in enumerate(self.content['age_range']):
+            bounds = parse_age_range(age_range)
+            if bounds is None:
+                continue
+            for age in range(bounds[0], bounds[1] + 1):
+                buckets.setdefault(age, []).append(position)
+        self.age_buckets = {age: np.array(positions, dtype=np.int64) for age, positions in buckets.items()}
+
+    def __len__(self):
+        return len(self.content)
+
+    def level_range(self, low, high):
+        """Positions of items whose reading level lies in [low, high]"""
+        start = np.searchsorted(self.sorted_levels, low, side='left')
+        end = np.searchsorted(self.sorted_levels, high, side='right')
+        return self.level_order[start:end]
+
+    def keyword_matches(self, keywords):
+        """Return (positions, match counts) of items sharing any of the keywords"""
+        hits = [self.keyword_index[word] for word in {k.lower() for k in keywords} if word in self.keyword_index]
+        if not hits:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        positions, counts = np.unique(np.concatenate(hits), return_counts=True)
+        return positions, counts
+
+    def age_mask(self, age):
+        """Boolean mask of items suitable for the given age"""
+        mask = np.zeros(len(self), dtype=bool)
+        positions = self.age_buckets.get(int(age))
+        if positions is not None:
+            mask[positions] = True
+        return mask
+
+    def candidates(self, target_level, allowed_mask, window=None, min_candidates=None, age=None):
+        """Return sorted catalog positions near the target level
+
+        Args:
+            target_level (float): level the recommendations aim for
+            allowed_mask (np.ndarray): boolean mask of eligible items (e.g. unread)
+            window (float): initial half-width of the level window
+            min_candidates (int): widen the window until this many candidates are found
+            age (int): when given, only items whose age range covers it are eligible
+
+        Returns:
+            np.ndarray: catalog row positions, in catalog order
+        """
+        window = LEVEL_WINDOW if window is None else window
+        min_candidates = MIN_CANDIDATES if min_candidates is None else min_candidates
+
+        allowed = np.asarray(allowed_mask, dtype=bool)
+        if age is not None:
+            allowed = allowed & self.age_mask(age)
+        available = int(allowed.sum())
+        if available == 0:
+            return np.empty(0, dtype=np.int64)
+
+        # The widest window ever needed covers the whole level span
+        max_window = max(abs(target_level - self.sorted_levels[0]),
+                         abs(self.sorted_levels[-1] - target_level))
+        needed = min(min_candidates, available)
+        window = max(window, 1e-6)
+        while True:
+            positions = self.level_range(target_level - window, target_level + window)
+            positions = positions[allowed[positions]]
+            if len(positions) >= needed or window >= max_window:
+                break
+            window *= 2
+        return np.sort(positions)
+
+
+def get_catalog_index():
+    """Return the index for the current catalog, rebuilding it when the content version changes"""
+    global _index
+    version = get_data_versions(['content'])['content']
+    index = _index
+    if index is not None and index.version == version:
+        return index
+    with _index_lock:
+        if _index is None or _index.version != version:
+            _index = CatalogIndex(get_all_content(), version)
+        return _index
@@ -1,11 +1,34 @@
 import sqlite3
 import pandas as pd
+import numpy as np
 import json
 import os
+import time
+import zlib
+import threading
+from collections import OrderedDict
 
 # Define the database path using an absolute path
 DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'freadom.db')
 
+# How often (in seconds) a process re-reads the data version table written by other workers
+VERSION_POLL_SECONDS = float(os.environ.get('FREADOM_VERSION_POLL_SECONDS', '0.5'))
+
+# Parsed user records kept per process (0 disables the cache)
+USER_CACHE_SIZE = int(os.environ.get('FREADOM_USER_CACHE_SIZE', '4096'))
+
+# user_id -> ((users version, user:<id> version), record)
+_user_cache = OrderedDict()
+_user_cache_lock = threading.Lock()
+user_cache_stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+# Bumped by every invalidation; a miss only caches its row if no write committed meanwhile
+_user_cache_generation = 0
+
+# Per-process copy of the data_versions table: scope -> (version, updated_at)
+_versions = {}
+_versions_seq = 0
+_versions_polled_at = 0.0
+
 def create_database():
     """Create and initialize the database with sample data"""
     # Check if database already exists
@@ -43,6 +66,10 @@ def create_database():
     )
     ''')
     
+    ensure_version_table(conn)
+    ensure_profile_tables(conn)
+    ensure_content_feature_tables(conn)
+    
     # Sample content data
     sample_content = [
         (1, "The Magic Tree", "Once upon a time, there was a magical tree that could grow any fruit you wished for. A young girl named Lily discovered the tree in her backyard. Every day she would ask for a different fruit, and the tree would provide it. One day, she asked for a golden apple, and to her surprise, the tree produced it. The golden apple had magical powers that allowed Lily to talk to animals.", 
@@ -88,25 +115,122 @@ def create_database():
     # Insert sample data
     c.executemany('INSERT OR REPLACE INTO content VALUES (?,?,?,?,?,?,?,?,?)', sample_content)
     c.executemany('INSERT OR REPLACE INTO users VALUES (?,?,?,?,?,?)', sample_users)
+    bump_data_version(conn, 'users', 'content')
     
     conn.commit()
     conn.close()
+    reset_version_cache()
+    rebuild_reading_profiles()
     
     print("Database created successfully with sample data!")
 
 def get_user_data(user_id):
-    """Get user data from the database"""
+    """Get user data from the database
+    
+    Returns a dict with typed fields (interests and history already parsed)
+    or None. The record also carries `read_bitmap`, the compressed
+    read-history bitmap (None for users whose bitmap has not been built yet).
+    Records are served from a per-process cache that is validated against the
+    'users' and 'user:<id>' data versions, so writes from any worker invalidate it.
+    """
+    user_id = int(user_id)
+    scopes = ['users', f'user:{user_id}']
+    version = tuple(get_data_versions(scopes)[scope] for scope in scopes)
+    
+    with _user_cache_lock:
+        entry = _user_cache.get(user_id)
+        if entry is not None and entry[0] == version:
+            _user_cache.move_to_end(user_id)
+            user_cache_stats['hits'] += 1
+            record = entry[1]
+        else:
+            record = None
+    
+    if record is None:
+        user_cache_stats['misses'] += 1
+        generation = _user_cache_generation
+        record = _load_user(user_id)
+        if record is None:
+            return None
+        if USER_CACHE_SIZE > 0:
+            with _user_cache_lock:
+                if generation != _user_cache_generation:
+                    # A write committed while we were reading, the row may be stale
+                    return _user_copy(user_id, record)
+                _user_cache[user_id] = (version, record)
+                _user_cache.move_to_end(user_id)
+                while len(_user_cache) > USER_CACHE_SIZE:
+                    _user_cache.popitem(last=False)
+    
+    return _user_copy(user_id, record)
+
+def _user_copy(user_id, record):
+    """Private copy of a record with the pending write-behind reads merged in"""
+    # Callers may mutate the lists, never hand out the cached ones
+    user = dict(record, interests=list(record['interests']), history=list(record['history']))
+    _merge_pending_reads(user_id, user)
+    return user
+
+def _load_user(user_id):
+    """Read and parse one user row with its read bitmap"""
     conn = sqlite3.connect(DB_PATH)
-    query = f"SELECT * FROM users WHERE id = {user_id}"
-    user_data = pd.read_sql_query(query, conn)
-    conn.close()
+    try:
+        ensure_profile_tables(conn)
+        row = conn.execute('''
+        SELECT users.id, users.name, users.age, users.reading_level, users.interests, users.history,
+               user_read_bitmaps.bitmap
+        FROM users LEFT JOIN user_read_bitmaps ON user_read_bitmaps.user_id = users.id
+        WHERE users.id = ?
+        ''', (user_id,)).fetchone()
+    finally:
+        conn.close()
     
-    if not user_data.empty:
-        # Parse JSON strings
-        user_data['interests'] = user_data['interests'].apply(json.loads)
-        user_data['history'] = user_data['history'].apply(json.loads)
-        return user_data.iloc[0]
-    return None
+    if row is None:
+        return None
+    user_id, name, age, reading_level, interests, history, bitmap = row
+    return {
+        'id': user_id,
+        'name': name,
+        'age': int(age) if age is not None else None,
+        'reading_level': float(reading_level) if reading_level is not None else None,
+        'interests': json.loads(interests) if interests else [],
+        'history': json.loads(history) if history else [],
+        'read_bitmap': bitmap
+    }
+
+def invalidate_user_cache(*user_ids):
+    """Drop cached user records, all of them when no ids are given
+    
+    Call it after the write has been committed.
+    """
+    global _user_cache_generation
+    with _user_cache_lock:
+        _user_cache_generation += 1
+        if not user_ids:
+            user_cache_stats['invalidations'] += len(_user_cache)
+            _user_cache.clear()
+            return
+        for user_id in user_ids:
+            if _user_cache.pop(int(user_id), None) is not None:
+                user_cache_stats['invalidations'] += 1
+
+def user_cache_info():
+    """Size and hit counters of the user record cache"""
+    with _user_cache_lock:
+        size = len(_user_cache)
+    return dict(user_cache_stats, size=size, max_size=USER_CACHE_SIZE)
+
+def _merge_pending_reads(user_id, user):
+    """Add read events still buffered by write_behind to a freshly loaded user record"""
+    import write_behind
+    if not write_behind.ENABLED:
+        return
+    pending = [cid for cid in dict.fromkeys(write_behind.pending_reads(user_id)) if cid not in user['history']]
+    if pending:
+        user['history'] = user['history'] + pending
+        # The stored bitmap doesn't know about them, callers fall back to the history list
+        user['read_bitmap'] = None
+        user['pending_reads'] = len(pending)
 
 def get_all_content():
     """Get all content from the database"""
@@ -142,23 +266,532 @@ def get_users():
     conn.close()
     return users
 
+def content_exists(content_id):
+    """Whether a content id is in the catalog"""
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        return conn.execute("SELECT 1 FROM content WHERE id = ?", (int(content_id),)).fetchone() is not None
+    finally:
+        conn.close()
+
 def update_user_history(user_id, content_id):
     """Add a content item to user's reading history"""
     user = get_user_data(user_id)
     if user is None:
         return False
     
-    history = user['history']
-    if content_id not in history:
-        history.append(content_id)
+    history = list(user['history'])
+    if content_id in history:
+        # Already recorded, nothing to write
+        return True
         
     conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("UPDATE users SET history = ? WHERE id = ?", 
-              (json.dumps(history), user_id))
+    # History, reading profile and version counter change in one transaction
+    ensure_profile_tables(conn)
+    _append_reads(conn, user_id, history, [content_id])
+    versions = bump_data_version(conn, f'user:{user_id}')
     conn.commit()
     conn.close()
+    # Only after the commit, so a concurrent lookup can't re-cache the old row
+    publish_data_versions(versions)
+    invalidate_user_cache(user_id)
     return True
 
+def _append_reads(conn, user_id, history, content_ids):
+    """Append unread content ids to a user's history and profile
+    
+    The caller bumps the user's data version and commits.
+    `history` is the user's stored history and is extended in place.
+    Returns the number of ids actually appended.
+    """
+    seen = set(history)
+    added = 0
+    for content_id in content_ids:
+        if content_id in seen:
+            continue
+        seen.add(content_id)
+        history.append(content_id)
+        # Only catalog items get a bit, so the bitmap's size stays bounded by the largest catalog id
+        if _apply_read_event(conn, user_id, content_id, len(history) - 1):
+            _set_read_bit(conn, user_id, content_id, history)
+        added += 1
+    if added:
+        conn.execute("UPDATE users SET history = ? WHERE id = ?", (json.dumps(history), user_id))
+    return added
+
+def apply_read_events(events):
+    """Apply many (user_id, content_id) read events in a single transaction
+    
+    Events for unknown users are dropped and ids already in a history are
+    ignored, so replaying the same events twice is harmless.
+    
+    Returns:
+        int: number of events that changed a history
+    """
+    by_user = {}
+    for user_id, content_id in events:
+        by_user.setdefault(int(user_id), []).append(int(content_id))
+    if not by_user:
+        return 0
+    
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        ensure_profile_tables(conn)
+        user_ids = list(by_user)
+        histories = {}
+        for start in range(0, len(user_ids), 500):
+            batch = user_ids[start:start + 500]
+            histories.update(conn.execute(
+                f"SELECT id, history FROM users WHERE id IN ({','.join('?' * len(batch))})", batch
+            ).fetchall())
+        
+        added = 0
+        changed = []
+        for user_id, content_ids in by_user.items():
+            if user_id not in histories:
+                print(f"Dropping read events for unknown user {user_id}")
+                continue
+            history = json.loads(histories[user_id]) if histories[user_id] else []
+            appended = _append_reads(conn, user_id, history, content_ids)
+            if appended:
+                added += appended
+                changed.append(user_id)
+        versions = bump_data_version(conn, *(f'user:{user_id}' for user_id in changed))
+        conn.commit()
+    finally:
+        conn.close()
+    publish_data_versions(versions)
+    invalidate_user_cache(*by_user)
+    return added
+
+# Reading profiles: running aggregates of each user's history, maintained on every
+# read event so progress queries don't have to reload and re-count the whole history
+
+# Tables derived from users.history, rebuilt together
+PROFILE_TABLES = ("reading_profiles", "reading_topic_counts", "reading_events", "user_read_bitmaps")
+
+def ensure_profile_tables(conn):
+    """Create the reading profile tables if this database predates them"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS reading_profiles (
+        user_id INTEGER PRIMARY KEY,
+        books_read INTEGER NOT NULL,
+        level_count INTEGER NOT NULL,
+        level_sum REAL NOT NULL
+    )
+    ''')
+    # first_content_id/first_position reproduce Counter.most_common tie-breaking
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS reading_topic_counts (
+        user_id INTEGER NOT NULL,
+        topic TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        first_content_id INTEGER NOT NULL,
+        first_position INTEGER NOT NULL,
+        PRIMARY KEY (user_id, topic)
+    )
+    ''')
+    conn.execute('''
+    CREATE INDEX IF NOT EXISTS idx_reading_topic_counts_rank
+    ON reading_topic_counts (user_id, count DESC, first_content_id, first_position)
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS reading_events (
+        user_id INTEGER NOT NULL,
+        content_id INTEGER NOT NULL,
+        title TEXT,
+        reading_level REAL,
+        seq INTEGER NOT NULL,
+        PRIMARY KEY (user_id, content_id)
+    )
+    ''')
+    conn.execute('''
+    CREATE INDEX IF NOT EXISTS idx_reading_events_level
+    ON reading_events (user_id, reading_level, seq)
+    ''')
+    # Bit i is set when the user has read content id i (zlib-compressed, little-endian bit order)
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS user_read_bitmaps (
+        user_id INTEGER PRIMARY KEY,
+        bitmap BLOB NOT NULL
+    )
+    ''')
+
+def encode_read_bitmap(content_ids):
+    """Pack a collection of content ids into a compressed bitmap"""
+    content_ids = np.asarray([int(cid) for cid in content_ids if int(cid) >= 0], dtype=np.int64)
+    size = int(content_ids.max()) + 1 if len(content_ids) else 0
+    bits = np.zeros(size, dtype=bool)
+    bits[content_ids] = True
+    return zlib.compress(np.packbits(bits, bitorder='little').tobytes())
+
+def decode_read_bitmap(blob):
+    """Unpack a compressed bitmap into a boolean array indexed by content id"""
+    packed = np.frombuffer(zlib.decompress(blob), dtype=np.uint8)
+    return np.unpackbits(packed, bitorder='little').astype(bool)
+
+def read_mask(blob, content_ids):
+    """Vectorised membership test: which of content_ids are set in the bitmap"""
+    bits = decode_read_bitmap(blob)
+    content_ids = np.asarray(content_ids, dtype=np.int64)
+    in_range = (content_ids >= 0) & (content_ids < len(bits))
+    mask = np.zeros(len(content_ids), dtype=bool)
+    mask[in_range] = bits[content_ids[in_range]]
+    return mask
+
+def _set_read_bit(conn, user_id, content_id, history):
+    """Set one bit in the user's bitmap, building it from the history if missing (caller commits)"""
+    row = conn.execute("SELECT bitmap FROM user_read_bitmaps WHERE user_id = ?", (user_id,)).fetchone()
+    if row is None:
+        blob = encode_read_bitmap(history)
+    else:
+        bits = decode_read_bitmap(row[0])
+        if content_id >= len(bits):
+            bits = np.concatenate([bits, np.zeros(content_id + 1 - len(bits), dtype=bool)])
+        bits[content_id] = True
+        blob = zlib.compress(np.packbits(bits, bitorder='little').tobytes())
+    conn.execute("INSERT OR REPLACE INTO user_read_bitmaps (user_id, bitmap) VALUES (?, ?)", (user_id, blob))
+
+def _apply_read_event(conn, user_id, content_id, seq):
+    """Fold one read event into the user's aggregates (caller commits)
+    
+    Returns False when the item is not in the catalog.
+    """
+    row = conn.execute(
+        "SELECT title, reading_level, topics FROM content WHERE id = ?", (content_id,)
+    ).fetchone()
+    
+    conn.execute('''
+    INSERT INTO reading_profiles (user_id, books_read, level_count, level_sum)
+    VALUES (?, 1, ?, ?)
+    ON CONFLICT(user_id) DO UPDATE SET
+        books_read = books_read + 1,
+        level_count = level_count + excluded.level_count,
+        level_sum = level_sum + excluded.level_sum
+    ''', (user_id, 1 if row else 0, row[1] if row else 0.0))
+    
+    # Items missing from the catalog count as read but carry no level or topics
+    if row is None:
+        return False
+    
+    title, reading_level, topics = row
+    conn.execute(
+        "INSERT OR REPLACE INTO reading_events (user_id, content_id, title, reading_level, seq) VALUES (?, ?, ?, ?, ?)",
+        (user_id, content_id, title, reading_level, seq)
+    )
+    for position, topic in enumerate(json.loads(topics)):
+        conn.execute('''
+        INSERT INTO reading_topic_counts (user_id, topic, count, first_content_id, first_position)
+        VALUES (?, ?, 1, ?, ?)
+        ON CONFLICT(user_id, topic) DO UPDATE SET
+            count = count + 1,
+            first_position = CASE WHEN excluded.first_content_id < first_content_id
+                                  THEN excluded.first_position ELSE first_position END,
+            first_content_id = MIN(first_content_id, excluded.first_content_id)
+        ''', (user_id, topic, content_id, position))
+    return True
+
+def _rebuild_profiles(conn, user_ids=None):
+    """Recompute reading profiles from users.history inside an open transaction"""
+    ensure_profile_tables(conn)
+    if user_ids is None:
+        rows = conn.execute("SELECT id, history FROM users").fetchall()
+        for table in PROFILE_TABLES:
+            conn.execute(f"DELETE FROM {table}")
+    else:
+        user_ids = list(user_ids)
+        placeholders = ",".join("?" * len(user_ids))
+        rows = conn.execute(
+            f"SELECT id, history FROM users WHERE id IN ({placeholders})", user_ids
+        ).fetchall()
+        for table in PROFILE_TABLES:
+            conn.execute(f"DELETE FROM {table} WHERE user_id IN ({placeholders})", user_ids)
+    
+    for user_id, history in rows:
+        history = json.loads(history) if history else []
+        conn.execute(
+            "INSERT INTO reading_profiles (user_id, books_read, level_count, level_sum) VALUES (?, 0, 0, 0)",
+            (user_id,)
+        )
+        # Duplicate ids in legacy histories count as books read but are aggregated once
+        for seq, content_id in enumerate(dict.fromkeys(history)):
+            _apply_read_event(conn, user_id, content_id, seq)
+        conn.execute(
+            "UPDATE reading_profiles SET books_read = ? WHERE user_id = ?", (len(history), user_id)
+        )
+        conn.execute(
+            "INSERT INTO user_read_bitmaps (user_id, bitmap) VALUES (?, ?)",
+            (user_id, encode_read_bitmap(history))
+        )
+    return len(rows)
+
+def rebuild_reading_profiles(user_ids=None):
+    """Rebuild reading profiles from the stored histories to repair any drift
+    
+    Args:
+        user_ids (list): users to rebuild, or None for everyone
+    
+    Returns:
+        int: number of users rebuilt
+    """
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        count = _rebuild_profiles(conn, user_ids)
+        conn.commit()
+    finally:
+        conn.close()
+    # Cached records carry the old bitmaps
+    if user_ids is None:
+        invalidate_user_cache()
+    else:
+        invalidate_user_cache(*user_ids)
+    return count
+
+def get_reading_profile(user_id, history=None):
+    """Return the aggregated reading profile of a user
+    
+    Args:
+        user_id (int): user to look up
+        history (list): the user's current history; when given, a profile whose
+            count disagrees with it is rebuilt before being returned
+    
+    Returns:
+        dict with books_read, average_level (None if no levels), favorite_topics
+        and the level-ordered history, or None if the user has no profile row
+    """
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        ensure_profile_tables(conn)
+        row = conn.execute(
+            "SELECT books_read, level_count, level_sum FROM reading_profiles WHERE user_id = ?",
+            (user_id,)
+        ).fetchone()
+        
+        if history is not None and (row is None or row[0] != len(history)):
+            # Missing or drifted profile (e.g. a database created before profiles existed)
+            _rebuild_profiles(conn, [user_id])
+            conn.commit()
+            invalidate_user_cache(user_id)
+            row = conn.execute(
+                "SELECT books_read, level_count, level_sum FROM reading_profiles WHERE user_id = ?",
+                (user_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        
+        books_read, level_count, level_sum = row
+        top_topics = [topic for (topic,) in conn.execute('''
+            SELECT topic FROM reading_topic_counts WHERE user_id = ?
+            ORDER BY count DESC, first_content_id, first_position
+            LIMIT 5
+        ''', (user_id,))]
+        events = conn.execute('''
+            SELECT content_id, title, reading_level FROM reading_events WHERE user_id = ?
+            ORDER BY reading_level, seq
+        ''', (user_id,)).fetchall()
+    finally:
+        conn.close()
+    
+    return {
+        'books_read': books_read,
+        'average_level': level_sum / level_count if level_count else None,
+        'favorite_topics': top_topics,
+        'history': [
+            {'id': content_id, 'title': title, 'reading_level': reading_level}
+            for content_id, title, reading_level in events
+        ]
+    }
+
+# Per-item features computed by the catalog ingestion pipeline (ingest_catalog.py)
+
+def ensure_content_feature_tables(conn):
+    """Create the ingestion feature tables if this database predates them"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS content_features (
+        content_id INTEGER PRIMARY KEY,
+        vocabulary_difficulty REAL,
+        flesch_reading_ease REAL,
+        flesch_kincaid_grade REAL,
+        word_count INTEGER,
+        sentence_count INTEGER,
+        text_hash TEXT
+    )
+    ''')
+    # float32 vectors stored as raw bytes, one row per item and model
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS content_embeddings (
+        content_id INTEGER NOT NULL,
+        model TEXT NOT NULL,
+        dim INTEGER NOT NULL,
+        embedding BLOB NOT NULL,
+        PRIMARY KEY (content_id, model)
+    )
+    ''')
+    # Per-grade vocabulary histograms from graded_lexicon.py, tagged with the lexicon that produced them
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS content_vocabulary_grades (
+        content_id INTEGER PRIMARY KEY,
+        lexicon TEXT NOT NULL,
+        histogram TEXT NOT NULL,
+        lexical_grade INTEGER NOT NULL,
+        text_hash TEXT NOT NULL
+    )
+    ''')
+
+def get_content_embeddings(model, content_ids=None):
+    """Return (ids, float32 matrix) of the stored embeddings for a model, ordered by id
+    
+    Args:
+        model (str): model the embeddings were computed with
+        content_ids (list): restrict to these ids, or None for all stored items
+    """
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        ensure_content_feature_tables(conn)
+        query = "SELECT content_id, dim, embedding FROM content_embeddings WHERE model = ?"
+        params = [model]
+        if content_ids is not None:
+            content_ids = [int(cid) for cid in content_ids]
+            query += f" AND content_id IN ({','.join('?' * len(content_ids))})"
+            params += content_ids
+        rows = conn.execute(query + " ORDER BY content_id", params).fetchall()
+    finally:
+        conn.close()
+    
+    ids = np.array([row[0] for row in rows], dtype=np.int64)
+    if not rows:
+        return ids, np.empty((0, 0), dtype=np.float32)
+    embeddings = np.stack([np.frombuffer(blob, dtype=np.float32, count=dim) for _, dim, blob in rows])
+    return ids, embeddings
+
+def get_vocabulary_grades(content_ids=None):
+    """Return {content_id: {'lexicon': str, 'histogram': [...], 'lexical_grade': int}} from the last catalog rescore"""
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        ensure_content_feature_tables(conn)
+        query = "SELECT content_id, lexicon, histogram, lexical_grade FROM content_vocabulary_grades"
+        params = []
+        if content_ids is not None:
+            params = [int(cid) for cid in content_ids]
+            query += f" WHERE content_id IN ({','.join('?' * len(params))})"
+        rows = conn.execute(query, params).fetchall()
+    finally:
+        conn.close()
+    return {
+        content_id: {'lexicon': lexicon, 'histogram': json.loads(histogram), 'lexical_grade': lexical_grade}
+        for content_id, lexicon, histogram, lexical_grade in rows
+    }
+
+def ensure_version_table(conn):
+    """Create the data version table if this database predates it"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS data_versions (
+        scope TEXT PRIMARY KEY,
+        version INTEGER NOT NULL,
+        seq INTEGER NOT NULL,
+        updated_at REAL NOT NULL
+    )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_data_versions_seq ON data_versions (seq)")
+
+def bump_data_version(conn, *scopes):
+    """Increment the version counter of each scope inside the caller's transaction
+    
+    Scopes are plain strings such as 'users', 'content' or 'user:<id>'.
+    The caller is responsible for committing, and then passes the result to
+    publish_data_versions so this process sees its own write right away.
+    
+    Returns:
+        dict: scope -> (new version, updated_at)
+    """
+    ensure_version_table(conn)
+    now = time.time()
+    for scope in scopes:
+        conn.execute('''
+        INSERT INTO data_versions (scope, version, seq, updated_at)
+        VALUES (?, 1, (SELECT COALESCE(MAX(seq), 0) + 1 FROM data_versions), ?)
+        ON CONFLICT(scope) DO UPDATE SET
+            version = version + 1,
+            seq = excluded.seq,
+            updated_at = excluded.updated_at
+        ''', (scope, now))
+    scopes = list(dict.fromkeys(scopes))
+    versions = {}
+    for start in range(0, len(scopes), 500):
+        batch = scopes[start:start + 500]
+        versions.update((scope, (version, now)) for scope, version in conn.execute(
+            f"SELECT scope, version FROM data_versions WHERE scope IN ({','.join('?' * len(batch))})", batch
+        ))
+    return versions
+
+def publish_data_versions(versions):
+    """Apply committed bumps from bump_data_version to this process's versions
+    
+    Only call this after the commit: a reader that saw the new version before
+    it would cache the old data under it until the next write.
+    """
+    for scope, (version, updated_at) in versions.items():
+        # Other workers see the bump on their next poll; local bumps may already be ahead of the table
+        current = _versions.get(scope, (0, 0.0))[0]
+        _versions[scope] = (max(version, current + 1), updated_at)
+
+def bump_local_version(*scopes):
+    """Bump scopes in this process only, for changes that are not committed yet
+    
+    The next committed bump (or a poll that finds one) replaces the local value.
+    """
+    now = time.time()
+    for scope in scopes:
+        version = _versions.get(scope, (0, 0.0))[0] + 1
+        _versions[scope] = (version, now)
+
+def reset_version_cache():
+    """Forget the cached data versions so the next lookup reloads them"""
+    global _versions_seq, _versions_polled_at
+    # Versions restart from scratch, records cached under the old ones could match by accident
+    invalidate_user_cache()
+    _versions.clear()
+    _versions_seq = 0
+    _versions_polled_at = 0.0
+
+def _poll_data_versions():
+    """Pull version changes made by other processes since the last poll"""
+    global _versions_seq, _versions_polled_at
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        ensure_version_table(conn)
+        max_seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM data_versions").fetchone()[0]
+        if max_seq < _versions_seq:
+            # The database was recreated, start over
+            invalidate_user_cache()
+            _versions.clear()
+            _versions_seq = 0
+        rows = conn.execute(
+            "SELECT scope, version, seq, updated_at FROM data_versions WHERE seq > ?",
+            (_versions_seq,)
+        ).fetchall()
+    finally:
+        conn.close()
+    
+    for scope, version, seq, updated_at in rows:
+        _versions[scope] = (version, updated_at)
+        _versions_seq = max(_versions_seq, seq)
+    _versions_polled_at = time.monotonic()
+
+def get_data_versions(scopes):
+    """Return {scope: (version, updated_at)} for the requested scopes
+    
+    Unknown scopes report version 0. The table is re-read at most once every
+    VERSION_POLL_SECONDS, so most lookups are dictionary hits.
+    """
+    if time.monotonic() - _versions_polled_at >= VERSION_POLL_SECONDS:
+        _poll_data_versions()
+    return {scope: _versions.get(scope, (0, 0.0)) for scope in scopes}
+
 if __name__ == "__main__":
-    create_database()
\ No newline at end of file
+    import sys
+    # Usage: python database.py [rebuild-profiles]
+    if len(sys.argv) > 1 and sys.argv[1] == "rebuild-profiles":
+        print(f"Rebuilt reading profiles for {rebuild_reading_profiles()} users")
+    else:
+        create_database()
\ No newline at end of file
@@ -0,0 +1,234 @@
+# PCA projection of content and interest embeddings
+# Qwen's mean-pooled hidden states are far wider than ranking a children's
+# catalog needs. This module fits PCA on the catalog's content embeddings and
+# stores the projection in SQLite under the embedding's model key. The PCA is
+# uncentered (the SVD of the raw vectors): rankings use cosine similarity, which
+# subtracting the mean would change. When
+# FREADOM_EMBEDDING_PROJECTION=1, embedding_store publishes the projected
+# content vectors together with the projection itself, and interest embeddings
+# are projected with it at request time, so both sides always match.
+#
+# Usage:
+#   python embedding_projection.py fit --model qwen --variance 0.95
+#   python embedding_projection.py report --model qwen --dims 32 64 128 --variance 0.9 0.99
+
+import os
+import json
+import time
+import sqlite3
+import argparse
+
+import numpy as np
+
+import database
+import embedding_store
+
+# Share of the variance kept by default; FREADOM_PCA_DIMS overrides it with a fixed width
+PCA_VARIANCE = float(os.environ.get('FREADOM_PCA_VARIANCE', '0.95'))
+PCA_DIMS = int(os.environ.get('FREADOM_PCA_DIMS', '0'))
+
+# Catalog items used as queries by the report
+REPORT_QUERIES = 200
+
+# Rows added to the Gram matrix at a time while fitting
+GRAM_BLOCK_ROWS = 8192
+
+
+class Projection:
+    """Orthonormal linear projection x -> x @ components.T"""
+
+    def __init__(self, model, components, explained_variance):
+        self.model = model
+        self.components = np.asarray(components, dtype=np.float32)
+        self.explained_variance = float(explained_variance)
+
+    @property
+    def dims(self):
+        return self.components.shape[0]
+
+    @property
+    def source_dim(self):
+        return self.components.shape[1]
+
+    def transform(self, embeddings):
+        return np.asarray(embeddings, dtype=np.float32) @ self.components.T
+
+
+def fit_projection(embeddings, model, variance=None, dims=None):
+    """Fit PCA keeping `dims` components, or as many as `variance` of the variance needs
+
+    Vectors inside the kept subspace keep their norms and dot products exactly.
+    The components are the eigenvectors of the d x d Gram matrix, accumulated
+    over blocks of rows, so memory does not grow with the catalog.
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    gram = np.zeros((embeddings.shape[1], embeddings.shape[1]), dtype=np.float64)
+    for start in range(0, len(embeddings), GRAM_BLOCK_ROWS):
+        block = embeddings[start:start + GRAM_BLOCK_ROWS].astype(np.float64)
+        gram += block.T @ block
+    eigenvalues, eigenvectors = np.linalg.eigh(gram)
+    # eigh sorts ascending; tiny negative values are rounding noise
+    order = np.argsort(eigenvalues)[::-1]
+    eigenvalues = np.clip(eigenvalues[order], 0, None)
+    components = eigenvectors[:, order].T.astype(np.float32)
+    ratios = eigenvalues / max(eigenvalues.sum(), np.finfo(np.float64).tiny)
+    # Never keep more components than the catalog has items
+    ratios = ratios[:min(embeddings.shape)]
+    if dims:
+        n_components = min(int(dims), len(ratios))
+    else:
+        n_components = min(int(np.searchsorted(np.cumsum(ratios), variance or PCA_VARIANCE)) + 1, len(ratios))
+    return Projection(model, components[:n_components], ratios[:n_components].sum())
+
+
+def ensure_projection_table(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS embedding_projections (
+        model TEXT PRIMARY KEY,
+        source_dim INTEGER NOT NULL,
+        dims INTEGER NOT NULL,
+        explained_variance REAL NOT NULL,
+        components BLOB NOT NULL,
+        fitted_at REAL NOT NULL
+    )
+    ''')
+
+
+def save_projection(projection):
+    conn = sqlite3.connect(database.DB_PATH)
+    try:
+        ensure_projection_table(conn)
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO embedding_projections VALUES (?, ?, ?, ?, ?, ?)",
+                (projection.model, projection.source_dim, projection.dims, projection.explained_variance,
+                 projection.components.tobytes(), time.time())
+            )
+    finally:
+        conn.close()
+
+
+def load_projection(model):
+    """The stored projection for an embedding model key, or None"""
+    conn = sqlite3.connect(database.DB_PATH)
+    try:
+        ensure_projection_table(conn)
+        row = conn.execute(
+            "SELECT source_dim, dims, explained_variance, components FROM embedding_projections WHERE model = ?",
+            (model,)
+        ).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    source_dim, dims, explained_variance, components = row
+    return Projection(
+        model,
+        np.frombuffer(components, dtype=np.float32).reshape(dims, source_dim),
+        explained_variance
+    )
+
+
+def catalog_embeddings(model):
+    """float32 content embeddings stored for a model key, falling back to the published snapshot"""
+    _, embeddings = database.get_content_embeddings(model)
+    if len(embeddings):
+        return embeddings
+    snapshot = embedding_store.attach()
+    if snapshot is not None and embedding_store.snapshot_key(snapshot) == model and 'projection_components' not in snapshot:
+        return embedding_store._reference_embeddings(snapshot)
+    return None
+
+
+def report(embeddings, settings, k=10, queries=REPORT_QUERIES, dtype='float32', seed=0):
+    """Latency, memory and ranking agreement of each projection setting against full width
+
+    Args:
+        settings (list): ('dims', n) or ('variance', fraction) pairs
+        k (int): top-k overlap is measured over this many neighbours
+
+    Every query is a catalog vector ("more like this"); its own row is left
+    out of the rankings.
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    query_rows = rng.choice(len(embeddings), size=min(queries, len(embeddings)), replace=False)
+    k = min(k, len(embeddings) - 1)
+
+    def rank_all(arrays, vectors):
+        started = time.perf_counter()
+        tops = []
+        for row, vector in zip(query_rows, vectors):
+            scores = embedding_store.cosine_scores(vector, arrays['embeddings'],
+                                                   arrays.get('embedding_scales'), arrays['embedding_norms'])
+            scores[row] = -np.inf
+            tops.append(np.argsort(-scores, kind='stable')[:k])
+        return tops, (time.perf_counter() - started) * 1000 / max(len(query_rows), 1)
+
+    full = embedding_store.quantize(embeddings, dtype)
+    full_tops, full_ms = rank_all(full, embeddings[query_rows])
+    rows = [{
+        'setting': 'full',
+        'dims': embeddings.shape[1],
+        'explained_variance': 1.0,
+        'bytes': int(sum(array.nbytes for array in full.values())),
+        'query_ms': round(full_ms, 3),
+        f'top{k}_overlap': 1.0
+    }]
+    for kind, value in settings:
+        started = time.perf_counter()
+        projection = fit_projection(embeddings, 'report', **{kind: value})
+        fit_seconds = time.perf_counter() - started
+        projected = projection.transform(embeddings)
+        arrays = embedding_store.quantize(projected, dtype)
+        # Queries are projected like interest embeddings would be
+        tops, query_ms = rank_all(arrays, projection.transform(embeddings[query_rows]))
+        overlap = np.mean([len(np.intersect1d(a, b)) / max(k, 1) for a, b in zip(full_tops, tops)])
+        rows.append({
+            'setting': f"{kind}={value}",
+            'dims': projection.dims,
+            'explained_variance': round(projection.explained_variance, 4),
+            'bytes': int(sum(array.nbytes for array in arrays.values()) + projection.components.nbytes),
+            'query_ms': round(query_ms, 3),
+            f'top{k}_overlap': round(float(overlap), 4),
+            'fit_seconds': round(fit_seconds, 2)
+        })
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fit and evaluate PCA projections of the content embeddings")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for name in ('fit', 'report'):
+        sub = subparsers.add_parser(name)
+        sub.add_argument('--model', default='sbert',
+                         help="embedding model key, e.g. sbert, qwen or qwen:fulltext-mean")
+    fit = subparsers.choices['fit']
+    fit.add_argument('--variance', type=float, default=None, help=f"share of variance to keep (default {PCA_VARIANCE})")
+    fit.add_argument('--dims', type=int, default=None,
+                     help=f"fixed number of dimensions (default {PCA_DIMS or 'unset'}, FREADOM_PCA_DIMS)")
+    rep = subparsers.choices['report']
+    rep.add_argument('--dims', type=int, nargs='*', default=[32, 64, 128])
+    rep.add_argument('--variance', type=float, nargs='*', default=[0.9, 0.95, 0.99])
+    rep.add_argument('-k', type=int, default=10)
+    rep.add_argument('--dtype', choices=embedding_store.EMBEDDING_DTYPES, default='float32')
+    args = parser.parse_args()
+
+    embeddings = catalog_embeddings(args.model)
+    if embeddings is None or len(embeddings) < 2:
+        parser.error(f"No stored content embeddings for {args.model}; run the ingestion with --embed "
+                     f"or publish a float32 snapshot first")
+
+    if args.command == 'fit':
+        # An explicit flag wins over the environment defaults
+        dims = args.dims if args.dims is not None else (None if args.variance is not None else PCA_DIMS or None)
+        projection = fit_projection(embeddings, args.model, variance=args.variance, dims=dims)
+        save_projection(projection)
+        print(f"Projection for {args.model}: {projection.source_dim} -> {projection.dims} dimensions, "
+              f"{projection.explained_variance:.1%} of the variance")
+        print("Publish with FREADOM_EMBEDDING_PROJECTION=1 to use it")
+    else:
+        settings = [('dims', dims) for dims in args.dims if dims < embeddings.shape[1]]
+        settings += [('variance', variance) for variance in args.variance]
+        rows = report(embeddings, settings, k=args.k, dtype=args.dtype)
+        print(json.dumps(rows, indent=2))
@@ -0,0 +1,403 @@
+# Shared, read-only catalog snapshot for multi-worker deployments
+# The content embedding matrix and the catalog arrays are published once as
+# .npy files and every API worker maps them with np.load(mmap_mode='r'), so the
+# pages live in the OS page cache exactly once no matter how many workers attach.
+
+import os
+import json
+import time
+import shutil
+import numpy as np
+
+# Directory holding the published generations (override with FREADOM_EMBEDDING_STORE)
+STORE_DIR = os.environ.get(
+    'FREADOM_EMBEDDING_STORE',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'embedding_store')
+)
+
+# Number of old generations kept on disk so workers still reading them are not disturbed
+KEEP_GENERATIONS = 2
+
+MANIFEST_NAME = "CURRENT"
+
+# Storage type of published embeddings: 'float32', 'float16' (2x smaller) or
+# 'int8' (4x smaller, one float32 scale per vector)
+EMBEDDING_DTYPE = os.environ.get('FREADOM_EMBEDDING_DTYPE', 'float32')
+
+EMBEDDING_DTYPES = ('float32', 'float16', 'int8')
+
+# Rows converted to float32 at a time by the similarity kernel, bounds its scratch memory
+BLOCK_ROWS = 4096
+
+# Publish embeddings through the PCA projection fitted for the model (embedding_projection.py)
+PROJECT_EMBEDDINGS = os.environ.get('FREADOM_EMBEDDING_PROJECTION', '0') == '1'
+
+# Per-process attachment, refreshed when the manifest changes
+_attached = None
+_attached_stamp = None
+
+
+class CatalogSnapshot:
+    """Read-only view over one published generation of the catalog arrays"""
+
+    def __init__(self, generation, path, metadata, arrays):
+        self.generation = generation
+        self.path = path
+        self.metadata = metadata
+        self.arrays = arrays
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def __contains__(self, name):
+        return name in self.arrays
+
+    @property
+    def model(self):
+        return self.metadata.get('model')
+
+    def rows_for_ids(self, content_ids):
+        """Map content ids to row positions, returns None if any id is missing"""
+        ids = self.arrays['ids']
+        content_ids = np.asarray(content_ids, dtype=np.int64)
+        rows = np.searchsorted(ids, content_ids)
+        rows = np.clip(rows, 0, max(len(ids) - 1, 0))
+        if len(ids) == 0 or not np.array_equal(ids[rows], content_ids):
+            return None
+        return rows
+
+    def nbytes(self):
+        """Total size of the mapped arrays in bytes"""
+        return int(sum(array.nbytes for array in self.arrays.values()))
+
+    def embedding_rows(self, rows):
+        """float32 embeddings of the given row positions, dequantized if stored compressed"""
+        embeddings = np.asarray(self.arrays['embeddings'][rows], dtype=np.float32)
+        if 'embedding_scales' in self.arrays:
+            embeddings *= self.arrays['embedding_scales'][rows][:, None]
+        return embeddings
+
+    def project(self, user_embedding):
+        """Map a model embedding into the space the snapshot's embeddings are stored in"""
+        if 'projection_components' not in self.arrays:
+            return user_embedding
+        return np.asarray(user_embedding, dtype=np.float32) @ self.arrays['projection_components'].T
+
+    def cosine_scores(self, user_embedding):
+        """Cosine similarity of a model embedding against every stored embedding"""
+        return cosine_scores(self.project(user_embedding), self.arrays['embeddings'],
+                             self.arrays.get('embedding_scales'), self.arrays.get('embedding_norms'))
+
+
+def quantize(embeddings, dtype='float32'):
+    """Snapshot arrays for an embedding matrix stored as `dtype`
+
+    Returns:
+        dict: 'embeddings', 'embedding_norms' (norms of the float32 vectors) and,
+        for int8, 'embedding_scales' (one per vector, max |value| / 127)
+    """
+    if dtype not in EMBEDDING_DTYPES:
+        raise ValueError(f"dtype must be one of {EMBEDDING_DTYPES}")
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    arrays = {'embedding_norms': np.linalg.norm(embeddings, axis=1).astype(np.float32)}
+    if dtype == 'int8':
+        scales = np.abs(embeddings).max(axis=1) / 127.0 if len(embeddings) else np.empty(0)
+        scales[scales == 0] = 1.0
+        arrays['embeddings'] = np.round(embeddings / scales[:, None]).astype(np.int8)
+        arrays['embedding_scales'] = scales.astype(np.float32)
+    else:
+        arrays['embeddings'] = embeddings.astype(dtype)
+    return arrays
+
+
+def cosine_scores(user_embedding, embeddings, scales=None, norms=None):
+    """Cosine similarity against a float32, float16 or int8 embedding matrix
+
+    Compressed rows are multiplied in blocks of BLOCK_ROWS converted to float32,
+    never as a whole; per-vector scales and norms are applied to the final
+    dot products only.
+    """
+    user_embedding = np.asarray(user_embedding, dtype=np.float32)
+    if embeddings.dtype == np.float32:
+        dots = np.asarray(embeddings @ user_embedding, dtype=np.float32)
+    else:
+        dots = np.empty(len(embeddings), dtype=np.float32)
+        for start in range(0, len(embeddings), BLOCK_ROWS):
+            dots[start:start + BLOCK_ROWS] = embeddings[start:start + BLOCK_ROWS].astype(np.float32) @ user_embedding
+    if scales is not None:
+        dots *= scales
+    if norms is None:
+        # Snapshots published before norms were stored
+        norms = np.linalg.norm(np.asarray(embeddings, dtype=np.float32), axis=1)
+        if scales is not None:
+            norms *= scales
+    return dots / np.maximum(norms * np.linalg.norm(user_embedding), 1e-12)
+
+
+def recall_check(embeddings, k=10, dtypes=EMBEDDING_DTYPES, queries=200, seed=0):
+    """Compare rankings over compressed copies of a float32 matrix against the original
+
+    Every query is a catalog vector ("more like this"); its own row is left
+    out of the rankings.
+
+    Returns:
+        dict: dtype -> bytes, compression ratio, mean top-k overlap with float32
+        and mean / max absolute score error
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    reference = quantize(embeddings, 'float32')
+    rng = np.random.default_rng(seed)
+    query_rows = rng.choice(len(embeddings), size=min(queries, len(embeddings)), replace=False)
+    k = min(k, len(embeddings) - 1)
+
+    def ranked(arrays, row):
+        scores = cosine_scores(embeddings[row], arrays['embeddings'],
+                               arrays.get('embedding_scales'), arrays['embedding_norms'])
+        scores[row] = -np.inf
+        return scores, np.argsort(-scores, kind='stable')[:k]
+
+    report = {}
+    for dtype in dtypes:
+        arrays = quantize(embeddings, dtype)
+        overlaps, errors = [], []
+        for row in query_rows:
+            exact_scores, exact_top = ranked(reference, row)
+            scores, top = ranked(arrays, row)
+            overlaps.append(len(np.intersect1d(exact_top, top)) / max(k, 1))
+            mask = np.isfinite(exact_scores)
+            errors.append(np.abs(scores[mask] - exact_scores[mask]).max(initial=0.0))
+        size = sum(array.nbytes for array in arrays.values())
+        report[dtype] = {
+            'bytes': int(size),
+            'compression': round(embeddings.nbytes / size, 2) if size else 0.0,
+            f'top{k}_overlap': round(float(np.mean(overlaps)), 4) if overlaps else 1.0,
+            'mean_abs_score_error': round(float(np.mean(errors)), 6) if errors else 0.0,
+            'max_abs_score_error': round(float(np.max(errors)), 6) if errors else 0.0
+        }
+    return report
+
+
+def _manifest_path():
+    return os.path.join(STORE_DIR, MANIFEST_NAME)
+
+
+def _generation_dir(generation):
+    return os.path.join(STORE_DIR, f"gen-{generation:06d}")
+
+
+def _read_manifest():
+    try:
+        with open(_manifest_path(), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def current_generation():
+    """Return the generation number currently published, or 0 if none"""
+    manifest = _read_manifest()
+    return manifest['generation'] if manifest else 0
+
+
+def publish_snapshot(arrays, metadata=None):
+    """Publish a new generation of read-only arrays and swap it in atomically
+
+    Args:
+        arrays (dict): name -> numpy array, must contain a sorted int64 'ids' array
+        metadata (dict): extra JSON-serialisable information (model name, etc.)
+
+    Returns:
+        int: the generation number that was published
+    """
+    os.makedirs(STORE_DIR, exist_ok=True)
+    generation = current_generation() + 1
+
+    # Write everything into a temporary directory first
+    final_dir = _generation_dir(generation)
+    tmp_dir = final_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_dir, f"{name}.npy"), np.ascontiguousarray(array))
+
+    manifest = {
+        'generation': generation,
+        'directory': os.path.basename(final_dir),
+        'arrays': sorted(arrays.keys()),
+        'metadata': metadata or {},
+        'published_at': time.time()
+    }
+    shutil.rmtree(final_dir, ignore_errors=True)
+    os.replace(tmp_dir, final_dir)
+
+    # The manifest swap is the commit point: readers see either the old or the new generation
+    tmp_manifest = _manifest_path() + ".tmp"
+    with open(tmp_manifest, 'w') as f:
+        json.dump(manifest, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_manifest, _manifest_path())
+
+    _remove_old_generations(generation)
+    print(f"Published catalog snapshot generation {generation} to {final_dir}")
+    return generation
+
+
+def _remove_old_generations(generation):
+    """Delete generations older than KEEP_GENERATIONS (open mappings stay valid on POSIX)"""
+    for name in os.listdir(STORE_DIR):
+        if not name.startswith("gen-") or name.endswith(".tmp"):
+            continue
+        try:
+            old_generation = int(name[4:])
+        except ValueError:
+            continue
+        if old_generation <= generation - KEEP_GENERATIONS:
+            shutil.rmtree(os.path.join(STORE_DIR, name), ignore_errors=True)
+
+
+def attach():
+    """Attach to the current generation zero-copy, returns None if nothing is published
+
+    The manifest is stat'ed on every call so a freshly published generation
+    is picked up by all workers without a restart.
+    """
+    global _attached, _attached_stamp
+
+    try:
+        stat = os.stat(_manifest_path())
+    except OSError:
+        _attached, _attached_stamp = None, None
+        return None
+
+    # os.replace gives the manifest a new inode on every publish
+    stamp = (stat.st_ino, stat.st_mtime_ns)
+    if _attached is not None and stamp == _attached_stamp:
+        return _attached
+
+    manifest = _read_manifest()
+    if manifest is None:
+        return _attached
+
+    path = os.path.join(STORE_DIR, manifest['directory'])
+    try:
+        arrays = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r')
+            for name in manifest['arrays']
+        }
+    except OSError as e:
+        print(f"Error attaching catalog snapshot generation {manifest['generation']}: {e}")
+        return _attached
+
+    _attached = CatalogSnapshot(manifest['generation'], path, manifest['metadata'], arrays)
+    _attached_stamp = stamp
+    return _attached
+
+
+def publish_catalog(model_name=None, variant=None, dtype=None, project=None):
+    """Embed the whole catalog with the selected model and publish it as a new generation
+    
+    Args:
+        model_name (str): model to use, defaults to the selected one
+        variant (str): publish stored vectors of another kind instead, e.g.
+            'fulltext-mean' from fulltext_embeddings.py; they must cover the whole catalog
+        dtype (str): storage type of the embeddings, defaults to EMBEDDING_DTYPE
+        project (bool): apply the model's fitted PCA projection, defaults to PROJECT_EMBEDDINGS
+    """
+    from database import get_all_content, get_content_embeddings
+    import semantic_analyzer
+
+    if model_name:
+        semantic_analyzer.set_model(model_name)
+    model = semantic_analyzer.get_current_model()
+
+    catalog = get_all_content().sort_values('id')
+    catalog_ids = catalog['id'].to_numpy(dtype=np.int64)
+    if variant:
+        stored_ids, embeddings = get_content_embeddings(f"{model}:{variant}")
+        if not np.array_equal(stored_ids, catalog_ids):
+            print(f"Stored {variant} embeddings for model {model} do not cover the catalog")
+            return None
+    else:
+        # Reuse the vectors written by the ingestion pipeline when they cover the whole catalog
+        stored_ids, embeddings = get_content_embeddings(model)
+        if not np.array_equal(stored_ids, catalog_ids):
+            content_items = catalog.to_dict('records')
+            embeddings = semantic_analyzer.encode_content(content_items)
+    if embeddings is None:
+        print(f"Could not embed the catalog with model {model}")
+        return None
+
+    key = model if not variant else f"{model}:{variant}"
+    projection = None
+    if project if project is not None else PROJECT_EMBEDDINGS:
+        from embedding_projection import load_projection
+        projection = load_projection(key)
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if projection is None or projection.source_dim != embeddings.shape[1]:
+            print(f"No projection fitted for {key}, publishing full-width embeddings")
+            projection = None
+        else:
+            embeddings = projection.transform(embeddings)
+
+    dtype = dtype or EMBEDDING_DTYPE
+    arrays = {
+        'ids': catalog_ids,
+        'reading_level': catalog['reading_level'].to_numpy(dtype=np.float32),
+        'popularity': catalog['popularity'].to_numpy(dtype=np.float32),
+        **quantize(embeddings, dtype)
+    }
+    metadata = {
+        'model': model,
+        'variant': variant or 'description',
+        'dtype': dtype,
+        'count': len(catalog),
+        'dim': int(arrays['embeddings'].shape[1]) if len(catalog) else 0
+    }
+    if projection is not None:
+        # Shipped with the generation so interest embeddings are always projected the same way
+        arrays['projection_components'] = projection.components
+        metadata['projection'] = {'source_dim': projection.source_dim,
+                                  'explained_variance': projection.explained_variance}
+    return publish_snapshot(arrays, metadata)
+
+
+def snapshot_key(snapshot):
+    """content_embeddings model key of the vectors a snapshot was built from"""
+    variant = snapshot.metadata.get('variant', 'description')
+    return snapshot.model if variant == 'description' else f"{snapshot.model}:{variant}"
+
+
+def _reference_embeddings(snapshot):
+    """float32 vectors of the snapshot's catalog, from the database when it was published compressed"""
+    if snapshot.metadata.get('dtype', 'float32') == 'float32' and 'projection_components' not in snapshot:
+        return np.asarray(snapshot['embeddings'])
+    from database import get_content_embeddings
+    ids, embeddings = get_content_embeddings(snapshot_key(snapshot))
+    if not np.array_equal(ids, snapshot['ids']):
+        return None
+    return embeddings
+
+
+if __name__ == "__main__":
+    import sys
+    # Usage: python embedding_store.py [publish [model [variant]] | recall [k] | info]
+    # (FREADOM_EMBEDDING_DTYPE picks the storage type of a publish)
+    command = sys.argv[1] if len(sys.argv) > 1 else "info"
+    if command == "publish":
+        publish_catalog(sys.argv[2] if len(sys.argv) > 2 else None, sys.argv[3] if len(sys.argv) > 3 else None)
+    elif command == "recall":
+        snapshot = attach()
+        reference = _reference_embeddings(snapshot) if snapshot is not None else None
+        if reference is None:
+            print("Recall check needs a published snapshot with float32 vectors in the snapshot or the database")
+        else:
+            k = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+            print(json.dumps(recall_check(reference, k), indent=2))
+    else:
+        snapshot = attach()
+        if snapshot is None:
+            print(f"No catalog snapshot published in {STORE_DIR}")
+        else:
+            print(f"Generation {snapshot.generation}: {snapshot.metadata}, {snapshot.nbytes()} bytes mapped")
@@ -0,0 +1,263 @@
+# Full-text content embeddings
+# The request-time embeddings only describe an item by "{title}. {topics}". This
+# module embeds the whole story instead: each text is split into chunks that fit
+# the model's input length, the chunks are encoded in batches and pooled (mean
+# or max) into one vector per item. The vectors are stored in content_embeddings
+# under a model key such as "sbert:fulltext-mean", together with a hash of the
+# text, so later runs only embed new or changed items. Items without any text get
+# their description vector ("{title}. {topics}") instead, so the full-text
+# vectors always cover the catalog. The catalog is processed a few items at a
+# time, so memory stays flat however large it is.
+#
+# Usage:
+#   python fulltext_embeddings.py --model sbert --pooling mean --publish
+
+import os
+import re
+import json
+import time
+import hashlib
+import sqlite3
+import argparse
+
+import numpy as np
+
+import database
+import inference_service
+
+# Model tokens per chunk, below the 256 word pieces all-MiniLM-L6-v2 reads
+CHUNK_TOKENS = int(os.environ.get('FREADOM_FULLTEXT_CHUNK_TOKENS', '200'))
+
+# Chunks encoded per forward pass
+ENCODE_BATCH = 64
+
+# Items read, embedded and committed together
+ITEM_BATCH = 32
+
+# Word pieces per word assumed when the model's tokenizer is not available in this process
+PIECES_PER_WORD = 1.3
+
+# Padding on that estimate, so texts with many word pieces per word (names, rare
+# words, numbers) still fit the model's input instead of being truncated
+ESTIMATE_MARGIN = 1.25
+
+POOLING_METHODS = ('mean', 'max')
+
+_WORD_RE = re.compile(r"\S+")
+
+
+def model_key(model, pooling='mean'):
+    """content_embeddings.model value of the full-text vectors of a model"""
+    return f"{model}:fulltext-{pooling}"
+
+
+def ensure_fulltext_table(conn):
+    """Text hashes of the stored full-text vectors, used to skip unchanged items"""
+    database.ensure_content_feature_tables(conn)
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS fulltext_embedding_sources (
+        content_id INTEGER NOT NULL,
+        model TEXT NOT NULL,
+        text_hash TEXT NOT NULL,
+        chunks INTEGER NOT NULL,
+        PRIMARY KEY (content_id, model)
+    )
+    ''')
+
+
+def token_counter(model):
+    """Function counting model tokens in a string, estimated from words without a local tokenizer"""
+    tokenizer = None
+    # With the inference service the model (and its tokenizer) lives in another
+    # process; importing semantic_analyzer would only load torch here
+    if not inference_service.is_enabled():
+        import semantic_analyzer
+        if model == 'qwen':
+            tokenizer = getattr(semantic_analyzer, 'qwen_tokenizer', None)
+        else:
+            tokenizer = getattr(getattr(semantic_analyzer, 'sbert_model', None), 'tokenizer', None)
+    if tokenizer is None:
+        return lambda text: int(len(_WORD_RE.findall(text)) * PIECES_PER_WORD * ESTIMATE_MARGIN + 0.999)
+    return lambda text: len(tokenizer.tokenize(text))
+
+
+def _word_windows(words, count_tokens, max_tokens):
+    """Consecutive windows of words of at most max_tokens tokens each
+
+    Window sizes are estimated from the token count and each window is
+    counted again, since tokens per word vary. A single word over the limit
+    is kept whole.
+    """
+    text = " ".join(words)
+    tokens = count_tokens(text)
+    if tokens <= max_tokens or len(words) <= 1:
+        return [text]
+    per_chunk = max(1, int(len(words) * max_tokens / tokens))
+    windows = []
+    for start in range(0, len(words), per_chunk):
+        windows.extend(_word_windows(words[start:start + per_chunk], count_tokens, max_tokens))
+    return windows
+
+
+def chunk_text(text, count_tokens, max_tokens=CHUNK_TOKENS):
+    """Split a text into chunks of whole sentences of at most max_tokens tokens
+
+    A sentence longer than max_tokens is split between words.
+    """
+    from text_analyzer import simple_sent_tokenize
+
+    chunks, current, current_tokens = [], [], 0
+    for sentence in simple_sent_tokenize(text or ''):
+        tokens = count_tokens(sentence)
+        if tokens > max_tokens:
+            # Flush, then cut the sentence into word windows that fit
+            if current:
+                chunks.append(" ".join(current))
+                current, current_tokens = [], 0
+            chunks.extend(_word_windows(sentence.split(), count_tokens, max_tokens))
+            continue
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append(" ".join(current))
+            current, current_tokens = [], 0
+        current.append(sentence)
+        current_tokens += tokens
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+def encode_chunks(chunks, model):
+    """Encode chunk texts ENCODE_BATCH at a time"""
+    import semantic_analyzer
+    vectors = []
+    for start in range(0, len(chunks), ENCODE_BATCH):
+        batch = chunks[start:start + ENCODE_BATCH]
+        if inference_service.is_enabled():
+            encoded = inference_service.embed(batch, model)
+        else:
+            encoded = semantic_analyzer.encode_texts(batch, model_name=model)
+        if encoded is None:
+            return None
+        vectors.append(np.asarray(encoded, dtype=np.float32))
+    return np.concatenate(vectors) if vectors else np.empty((0, 0), dtype=np.float32)
+
+
+def pool(vectors, pooling='mean'):
+    """Pool the chunk vectors of one item into a single vector"""
+    if pooling == 'max':
+        return vectors.max(axis=0)
+    return vectors.mean(axis=0)
+
+
+def embed_items(items, model, pooling='mean', count_tokens=None):
+    """Full-text vectors of (content_id, text) items, encoding all their chunks in shared batches
+
+    Returns:
+        tuple: (list of (content_id, vector, chunk count), ids of items without any text)
+    """
+    count_tokens = count_tokens or token_counter(model)
+    spans, chunks, empty = [], [], []
+    for content_id, text in items:
+        item_chunks = chunk_text(text, count_tokens)
+        if not item_chunks:
+            empty.append(content_id)
+            continue
+        spans.append((content_id, len(chunks), len(chunks) + len(item_chunks)))
+        chunks.extend(item_chunks)
+    if not chunks:
+        return [], empty
+
+    vectors = encode_chunks(chunks, model)
+    if vectors is None:
+        raise RuntimeError(f"Could not encode with model {model}")
+    return [(content_id, pool(vectors[start:end], pooling), end - start) for content_id, start, end in spans], empty
+
+
+def _description(title, topics):
+    """The text request-time embeddings describe an item with"""
+    topics = json.loads(topics) if topics else []
+    return f"{title}. {' '.join(topics) if isinstance(topics, list) else topics}"
+
+
+def update_fulltext_embeddings(model='sbert', pooling='mean', force=False, item_batch=ITEM_BATCH):
+    """Embed every catalog item whose text changed since its stored full-text vector
+
+    Items without text are stored with their description vector and 0 chunks.
+
+    Returns:
+        dict: counts and timing
+    """
+    if pooling not in POOLING_METHODS:
+        raise ValueError(f"pooling must be one of {POOLING_METHODS}")
+    started = time.perf_counter()
+    key = model_key(model, pooling)
+    if not inference_service.is_enabled():
+        import semantic_analyzer
+        semantic_analyzer.set_model(model)
+    count_tokens = token_counter(model)
+
+    conn = sqlite3.connect(database.DB_PATH)
+    report = {'model': key, 'items': 0, 'embedded': 0, 'chunks': 0, 'empty': 0}
+    try:
+        ensure_fulltext_table(conn)
+        stored = dict(conn.execute(
+            "SELECT content_id, text_hash FROM fulltext_embedding_sources WHERE model = ?", (key,)
+        ).fetchall())
+        cursor = conn.execute("SELECT id, text, title, topics FROM content ORDER BY id")
+        while True:
+            rows = cursor.fetchmany(item_batch)
+            if not rows:
+                break
+            report['items'] += len(rows)
+            descriptions = {content_id: _description(title, topics) for content_id, _, title, topics in rows}
+            # Textless items are hashed by their description, which is what they are embedded from
+            hashes = {
+                content_id: hashlib.sha1(
+                    (text if (text or '').strip() else "description:" + descriptions[content_id]).encode('utf-8')
+                ).hexdigest()
+                for content_id, text, _, _ in rows
+            }
+            changed = [(content_id, text) for content_id, text, _, _ in rows
+                       if force or stored.get(content_id) != hashes[content_id]]
+            if not changed:
+                continue
+
+            embedded, empty = embed_items(changed, model, pooling, count_tokens)
+            if empty:
+                vectors = encode_chunks([descriptions[content_id] for content_id in empty], model)
+                if vectors is None:
+                    raise RuntimeError(f"Could not encode with model {model}")
+                embedded += [(content_id, vector, 0) for content_id, vector in zip(empty, vectors)]
+            with conn:
+                conn.executemany('INSERT OR REPLACE INTO content_embeddings VALUES (?,?,?,?)', [
+                    (content_id, key, int(vector.shape[0]), vector.astype(np.float32).tobytes())
+                    for content_id, vector, _ in embedded
+                ])
+                conn.executemany('INSERT OR REPLACE INTO fulltext_embedding_sources VALUES (?,?,?,?)', [
+                    (content_id, key, hashes[content_id], chunks) for content_id, _, chunks in embedded
+                ])
+            report['embedded'] += len(embedded)
+            report['chunks'] += sum(chunks for _, _, chunks in embedded)
+            report['empty'] += len(empty)
+            if empty:
+                print(f"No text for content ids {empty}, stored their description vectors")
+    finally:
+        conn.close()
+
+    report['seconds'] = round(time.perf_counter() - started, 2)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Embed full content texts as pooled chunk vectors")
+    parser.add_argument('--model', choices=['sbert', 'qwen'], default='sbert')
+    parser.add_argument('--pooling', choices=POOLING_METHODS, default='mean')
+    parser.add_argument('--force', action='store_true', help="re-embed items whose text did not change")
+    parser.add_argument('--publish', action='store_true',
+                        help="publish the full-text vectors as the shared catalog snapshot afterwards")
+    args = parser.parse_args()
+
+    print(json.dumps(update_fulltext_embeddings(args.model, args.pooling, args.force), indent=2))
+    if args.publish:
+        import embedding_store
+        embedding_store.publish_catalog(args.model, variant=f"fulltext-{args.pooling}")
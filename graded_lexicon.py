@@ -0,0 +1,264 @@
+# Graded vocabulary lexicon
+# Maps words to the school grade by which most readers know them, loaded from
+# graded_lexicon.txt. Texts are scored in batches: every token of the batch is
+# mapped to an integer id, each id to a grade, and the per-text grade counts are
+# aggregated with one np.bincount, giving a vocabulary histogram per text.
+#
+# Usage:
+#   python graded_lexicon.py rescore           # re-score the catalog after a lexicon update
+#   python graded_lexicon.py score story.txt   # histogram of a single text
+
+import os
+import sys
+import json
+import time
+import hashlib
+import sqlite3
+import argparse
+import itertools
+import threading
+
+import numpy as np
+
+import database
+from vocabulary_analyzer import tokenize_text
+
+# Lexicon file, one "<grade>: word word ..." line per grade
+LEXICON_PATH = os.environ.get(
+    'FREADOM_LEXICON_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'graded_lexicon.txt')
+)
+
+# Texts scored per batch by the catalog rescore
+RESCORE_BATCH = 2000
+
+# Share of a text's words a reader should know for it to count as being at a grade
+COVERAGE = 0.9
+
+# Inflection rules tried, in order, when a word is not in the lexicon itself
+SUFFIX_RULES = (
+    ('ies', 'y'), ('ied', 'y'), ('ier', 'y'), ('iest', 'y'), ('ily', 'y'),
+    ('es', ''), ('s', ''),
+    ('ed', ''), ('ed', 'e'),
+    ('ing', ''), ('ing', 'e'),
+    ('ly', ''),
+    ('er', ''), ('er', 'e'), ('est', ''), ('est', 'e'),
+)
+
+
+class GradedLexicon:
+    """Word -> grade table with batch histogram scoring"""
+
+    def __init__(self, grades, words, signature):
+        """
+        Args:
+            grades (list): grade labels, easiest first ('K', '1', ...)
+            words (dict): word -> index into grades
+            signature (str): hash of the lexicon contents
+        """
+        self.grades = list(grades)
+        self.words = words
+        self.signature = signature
+        # Histogram bins: one per grade, plus words the lexicon doesn't know
+        self.bins = self.grades + ['unknown']
+        self.unknown = len(self.grades)
+
+    @classmethod
+    def load(cls, path=LEXICON_PATH):
+        grades, words = [], {}
+        with open(path, 'rb') as f:
+            raw = f.read()
+        for line in raw.decode('utf-8').splitlines():
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            label, _, listed = line.partition(':')
+            label = label.strip()
+            if label not in grades:
+                grades.append(label)
+            grade = grades.index(label)
+            for word in listed.lower().split():
+                # A word listed twice keeps its lowest grade
+                if word not in words or words[word] > grade:
+                    words[word] = grade
+        return cls(grades, words, hashlib.sha1(raw).hexdigest()[:16])
+
+    def grade_of(self, word):
+        """Grade index of a word (via its base form for inflections), or None"""
+        grade = self.words.get(word)
+        if grade is not None:
+            return grade
+        for suffix, replacement in SUFFIX_RULES:
+            if not word.endswith(suffix) or len(word) - len(suffix) < 2:
+                continue
+            stem = word[:-len(suffix)]
+            for candidate in (stem + replacement, stem[:-1] if stem[-1] == stem[-2] else None):
+                if candidate and candidate in self.words:
+                    return self.words[candidate]
+        return None
+
+    def histograms(self, texts):
+        """Per-grade word counts for many texts at once
+
+        Returns:
+            np.ndarray: int64 matrix of shape (len(texts), len(self.bins))
+        """
+        token_lists = [tokenize_text(text or '') for text in texts]
+        lengths = np.fromiter((len(tokens) for tokens in token_lists), dtype=np.int64, count=len(token_lists))
+        n_bins = len(self.bins)
+        if not lengths.sum():
+            return np.zeros((len(token_lists), n_bins), dtype=np.int64)
+
+        # Batch-local integer ids: each distinct token is looked up (and stemmed) only once
+        ids = {}
+        token_ids = np.fromiter(
+            (ids.setdefault(token, len(ids)) for token in itertools.chain.from_iterable(token_lists)),
+            dtype=np.int64, count=int(lengths.sum())
+        )
+        grade_by_id = np.fromiter(
+            (self.unknown if grade is None else grade for grade in map(self.grade_of, ids)),
+            dtype=np.int64, count=len(ids)
+        )
+        text_index = np.repeat(np.arange(len(token_lists)), lengths)
+        counts = np.bincount(text_index * n_bins + grade_by_id[token_ids], minlength=len(token_lists) * n_bins)
+        return counts.reshape(len(token_lists), n_bins)
+
+    def lexical_grades(self, histograms, coverage=COVERAGE):
+        """Lowest grade index whose words cover `coverage` of each text
+
+        Unknown words count as harder than the last grade, so a text full of
+        them scores len(self.grades). Empty texts score 0.
+        """
+        histograms = np.atleast_2d(histograms)
+        totals = histograms.sum(axis=1)
+        covered = np.cumsum(histograms, axis=1) >= coverage * totals[:, None]
+        grades = np.argmax(covered, axis=1)
+        grades[totals == 0] = 0
+        return grades
+
+    def score_text(self, text):
+        """Histogram and lexical grade of one text, for the API"""
+        histogram = self.histograms([text])[0]
+        total = int(histogram.sum())
+        lexical = int(self.lexical_grades(histogram)[0])
+        return {
+            'histogram': dict(zip(self.bins, histogram.tolist())),
+            'total_words': total,
+            'known_ratio': float(1 - histogram[self.unknown] / total) if total else 0.0,
+            'lexical_grade': self.bins[lexical]
+        }
+
+
+_lexicon = None
+_lexicon_lock = threading.Lock()
+
+
+def get_lexicon():
+    """The lexicon of this process, loaded on first use"""
+    global _lexicon
+    if _lexicon is None:
+        with _lexicon_lock:
+            if _lexicon is None:
+                _lexicon = GradedLexicon.load()
+    return _lexicon
+
+
+def score_vocabulary(text):
+    """Per-grade vocabulary histogram of a text"""
+    return get_lexicon().score_text(text)
+
+
+def stored_grades(content_ids):
+    """Stored histograms and lexical grades of catalog items, keyed by content id
+
+    Items not yet scored with the current lexicon are left out.
+    """
+    lexicon = get_lexicon()
+    grades = {}
+    for content_id, stored in database.get_vocabulary_grades(content_ids).items():
+        if stored['lexicon'] != lexicon.signature:
+            continue
+        grades[content_id] = {
+            'histogram': dict(zip(lexicon.bins, stored['histogram'])),
+            'lexical_grade': lexicon.bins[stored['lexical_grade']]
+        }
+    return grades
+
+
+def rescore_catalog(force=False, batch_size=RESCORE_BATCH):
+    """Recompute the vocabulary histograms of the catalog
+
+    Only items scored with a different lexicon, or whose text changed, are
+    scored again unless `force` is set.
+
+    Returns:
+        dict: counts and timing
+    """
+    started = time.perf_counter()
+    lexicon = get_lexicon()
+    conn = sqlite3.connect(database.DB_PATH)
+    report = {'items': 0, 'rescored': 0, 'lexicon': lexicon.signature}
+    try:
+        database.ensure_content_feature_tables(conn)
+        scored = {
+            content_id: (signature, text_hash)
+            for content_id, signature, text_hash in conn.execute(
+                "SELECT content_id, lexicon, text_hash FROM content_vocabulary_grades"
+            )
+        }
+        cursor = conn.execute("SELECT id, text FROM content ORDER BY id")
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            report['items'] += len(rows)
+            batch = []
+            for content_id, text in rows:
+                text_hash = hashlib.sha1((text or '').encode('utf-8')).hexdigest()
+                if force or scored.get(content_id) != (lexicon.signature, text_hash):
+                    batch.append((content_id, text, text_hash))
+            if not batch:
+                continue
+
+            histograms = lexicon.histograms([text for _, text, _ in batch])
+            grades = lexicon.lexical_grades(histograms)
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO content_vocabulary_grades VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (content_id, lexicon.signature, json.dumps(histogram), int(grade), text_hash)
+                        for (content_id, _, text_hash), histogram, grade in zip(batch, histograms.tolist(), grades)
+                    ]
+                )
+            report['rescored'] += len(batch)
+
+        if report['rescored']:
+            with conn:
+                versions = database.bump_data_version(conn, 'vocabulary')
+            database.publish_data_versions(versions)
+    finally:
+        conn.close()
+
+    report['seconds'] = round(time.perf_counter() - started, 2)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score vocabulary against the graded lexicon")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    rescore = subparsers.add_parser('rescore', help="re-score the catalog")
+    rescore.add_argument('--force', action='store_true', help="re-score items already scored with this lexicon")
+    rescore.add_argument('--batch-size', type=int, default=RESCORE_BATCH)
+    score = subparsers.add_parser('score', help="score a text file (or stdin)")
+    score.add_argument('path', nargs='?')
+    args = parser.parse_args()
+
+    if args.command == 'rescore':
+        print(json.dumps(rescore_catalog(args.force, args.batch_size), indent=2))
+    else:
+        if args.path:
+            with open(args.path, encoding='utf-8') as f:
+                text = f.read()
+        else:
+            text = sys.stdin.read()
+        print(json.dumps(score_vocabulary(text), indent=2))
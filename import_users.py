@@ -0,0 +1,191 @@
+# Bulk import of user rosters and reading histories
+# Loads CSV or JSONL files in large batched transactions instead of one
+# update_user_history call per read event, then rebuilds the derived tables
+# (reading profiles, read bitmaps) and bumps the cache versions once at the end.
+#
+# Usage:
+#   python import_users.py --users roster.csv --history reads.jsonl
+
+import json
+import time
+import sqlite3
+import argparse
+import itertools
+
+import database
+from ingest_catalog import iter_records, chunked, parse_list
+
+# Rows written per transaction
+BATCH_SIZE = 5000
+
+# Ids per IN (...) query, below SQLite's bound parameter limit
+ID_BATCH = 500
+
+
+def _user_row(record, new_ids):
+    """Validate one roster record and turn it into a users row (history excluded)"""
+    name = (record.get('name') or '').strip()
+    if not name:
+        raise ValueError("name is required")
+    user_id = record.get('id')
+    user_id = next(new_ids) if user_id in (None, '') else int(user_id)
+    age = int(float(record['age']))
+    reading_level = float(record['reading_level'])
+    if not 0 < reading_level <= 5:
+        raise ValueError(f"reading_level {reading_level} is not between 0 and 5")
+    return (user_id, name, age, reading_level, json.dumps(parse_list(record.get('interests'))))
+
+
+def _max_record_id(path, fmt=None):
+    """Highest explicit integer id in a roster file, 0 when there is none"""
+    highest = 0
+    for record in iter_records(path, fmt):
+        try:
+            highest = max(highest, int(record.get('id')))
+        except (TypeError, ValueError):
+            continue
+    return highest
+
+
+def import_users(conn, path, fmt=None, batch_size=BATCH_SIZE):
+    """Insert or update users from a roster file
+
+    Existing users keep their reading history; their name, age, level and
+    interests are replaced.
+
+    Returns:
+        tuple: (set of imported user ids, number of rejected records)
+    """
+    # New ids go above the explicit ids later in the file too, or the upsert would let
+    # such a record silently replace a user created earlier in the same import
+    max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM users").fetchone()[0]
+    max_id = max(max_id, _max_record_id(path, fmt))
+    new_ids = itertools.count(max_id + 1)
+    imported, rejected = set(), 0
+
+    for chunk in chunked(enumerate(iter_records(path, fmt), 1), batch_size):
+        rows = []
+        for number, record in chunk:
+            try:
+                rows.append(_user_row(record, new_ids))
+            except (KeyError, ValueError, TypeError) as e:
+                rejected += 1
+                print(f"Skipped user record {number}: {type(e).__name__}: {e}")
+        with conn:
+            conn.executemany('''
+            INSERT INTO users (id, name, age, reading_level, interests, history)
+            VALUES (?, ?, ?, ?, ?, '[]')
+            ON CONFLICT(id) DO UPDATE SET
+                name = excluded.name,
+                age = excluded.age,
+                reading_level = excluded.reading_level,
+                interests = excluded.interests
+            ''', rows)
+        imported.update(row[0] for row in rows)
+    return imported, rejected
+
+
+def import_history(conn, path, fmt=None, batch_size=BATCH_SIZE):
+    """Append read events (user_id, content_id) to the users' histories
+
+    Events are appended in file order; ids already in a history are ignored,
+    as in update_user_history. Events naming an unknown user or content item
+    are rejected.
+
+    Returns:
+        tuple: (set of user ids whose history changed, events added, events rejected)
+    """
+    content_ids = {row[0] for row in conn.execute("SELECT id FROM content")}
+    known_users = {row[0] for row in conn.execute("SELECT id FROM users")}
+    changed, added, rejected = set(), 0, 0
+
+    for chunk in chunked(enumerate(iter_records(path, fmt), 1), batch_size):
+        events = {}
+        for number, record in chunk:
+            try:
+                user_id, content_id = int(record['user_id']), int(record['content_id'])
+            except (KeyError, ValueError, TypeError) as e:
+                rejected += 1
+                print(f"Skipped history record {number}: {type(e).__name__}: {e}")
+                continue
+            if user_id not in known_users or content_id not in content_ids:
+                rejected += 1
+                print(f"Skipped history record {number}: unknown user {user_id} or content {content_id}")
+                continue
+            events.setdefault(user_id, []).append(content_id)
+
+        if not events:
+            continue
+        user_ids = list(events)
+        with conn:
+            histories = {}
+            for start in range(0, len(user_ids), ID_BATCH):
+                batch = user_ids[start:start + ID_BATCH]
+                histories.update(conn.execute(
+                    f"SELECT id, history FROM users WHERE id IN ({','.join('?' * len(batch))})", batch
+                ).fetchall())
+
+            updates = []
+            for user_id, read_ids in events.items():
+                history = json.loads(histories[user_id]) if histories[user_id] else []
+                seen = set(history)
+                fresh = [cid for cid in dict.fromkeys(read_ids) if cid not in seen]
+                if fresh:
+                    history.extend(fresh)
+                    updates.append((json.dumps(history), user_id))
+                    changed.add(user_id)
+                    added += len(fresh)
+            conn.executemany("UPDATE users SET history = ? WHERE id = ?", updates)
+    return changed, added, rejected
+
+
+def run_import(users_path=None, history_path=None, fmt=None, batch_size=BATCH_SIZE):
+    """Import a roster and/or history file, then rebuild derived data once
+
+    Returns:
+        dict: counts and timing of the import
+    """
+    started = time.perf_counter()
+    report = {'users': 0, 'users_rejected': 0, 'events': 0, 'events_rejected': 0}
+    conn = sqlite3.connect(database.DB_PATH)
+    touched = set()
+    try:
+        database.ensure_version_table(conn)
+        if users_path:
+            imported, report['users_rejected'] = import_users(conn, users_path, fmt, batch_size)
+            report['users'] = len(imported)
+            touched |= imported
+        if history_path:
+            changed, report['events'], report['events_rejected'] = import_history(conn, history_path, fmt, batch_size)
+            touched |= changed
+
+        rebuild_started = time.perf_counter()
+        if touched:
+            # Profiles, read bitmaps and cache versions are derived once for every touched user
+            user_ids = sorted(touched)
+            with conn:
+                for start in range(0, len(user_ids), ID_BATCH):
+                    database._rebuild_profiles(conn, user_ids[start:start + ID_BATCH])
+                versions = database.bump_data_version(conn, 'users', *(f'user:{user_id}' for user_id in user_ids))
+            database.publish_data_versions(versions)
+            database.invalidate_user_cache()
+        report['rebuild_seconds'] = round(time.perf_counter() - rebuild_started, 2)
+    finally:
+        conn.close()
+
+    report['users_touched'] = len(touched)
+    report['seconds'] = round(time.perf_counter() - started, 2)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk-import users and reading histories into the Freadom database")
+    parser.add_argument('--users', help="CSV/JSONL roster: id (optional), name, age, reading_level, interests")
+    parser.add_argument('--history', help="CSV/JSONL read events: user_id, content_id")
+    parser.add_argument('--format', choices=['csv', 'jsonl'], default=None)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+    if not args.users and not args.history:
+        parser.error("Nothing to import, pass --users and/or --history")
+
+    print(json.dumps(run_import(args.users, args.history, args.format, args.batch_size), indent=2))
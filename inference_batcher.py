@@ -0,0 +1,170 @@
+# Dynamic micro-batching for embedding requests
+# Concurrent request threads hand their texts to a MicroBatcher, which waits up to
+# a few milliseconds (or until the batch is full), runs one batched forward pass
+# and gives every caller back its own rows.
+
+import os
+import queue
+import threading
+import time
+from contextlib import nullcontext
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+import numpy as np
+
+from inference_limiter import InferenceOverloaded, WAIT_TIMEOUT
+
+# Turn micro-batching on for semantic_analyzer with FREADOM_MICROBATCH=1
+ENABLED = os.environ.get('FREADOM_MICROBATCH', '0') == '1'
+
+# Maximum number of texts encoded in one forward pass
+MAX_BATCH_SIZE = int(os.environ.get('FREADOM_MICROBATCH_MAX_SIZE', '64'))
+
+# How long the first request of a batch waits for company
+MAX_WAIT_MS = float(os.environ.get('FREADOM_MICROBATCH_WAIT_MS', '5'))
+
+# Requests allowed to wait for a batch; beyond this new callers are rejected immediately
+MAX_QUEUE = int(os.environ.get('FREADOM_MICROBATCH_QUEUE', str(MAX_BATCH_SIZE)))
+
+
+class MicroBatcher:
+    """Collects concurrent encode requests and runs them as one batch
+
+    Args:
+        batch_fn (callable): takes a list of texts, returns an array with one row per text
+        max_batch_size (int): flush once this many texts are queued
+        max_wait_ms (float): flush this long after the first request arrived
+        name (str): used for the worker thread name and log lines
+        slot (callable): context manager factory held around each forward pass,
+            e.g. inference_limiter.inference_slot; its errors are raised to the callers
+        max_queue (int): requests allowed to wait, encode() sheds load beyond it
+        wait_timeout (float): seconds encode() waits for its batch to start
+    """
+
+    def __init__(self, batch_fn, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS, name="batcher", slot=None,
+                 max_queue=MAX_QUEUE, wait_timeout=WAIT_TIMEOUT):
+        self.batch_fn = batch_fn
+        self.slot = slot or nullcontext
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.wait_timeout = wait_timeout
+        self.name = name
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._worker = threading.Thread(target=self._run, name=f"microbatch-{name}", daemon=True)
+        self._worker.start()
+
+        # Counters for monitoring
+        self.stats = {'batches': 0, 'requests': 0, 'texts': 0, 'wait_ms': 0.0, 'run_ms': 0.0,
+                      'rejected_queue_full': 0, 'rejected_timeout': 0}
+
+    def submit(self, texts):
+        """Queue texts for encoding and return a Future resolving to their embeddings
+
+        Raises:
+            InferenceOverloaded: the queue is full
+        """
+        future = Future()
+        try:
+            self._queue.put_nowait((list(texts), future, time.perf_counter()))
+        except queue.Full:
+            self.stats['rejected_queue_full'] += 1
+            raise InferenceOverloaded("batch queue full")
+        return future
+
+    def encode(self, texts):
+        """Blocking helper: encode texts through the batcher
+
+        Raises:
+            InferenceOverloaded: the queue is full, or no batch picked the texts up within wait_timeout
+        """
+        future = self.submit(texts)
+        try:
+            return future.result(timeout=self.wait_timeout)
+        except FutureTimeout:
+            # A request already in a running batch finishes with it; a waiting one is withdrawn
+            if not future.cancel():
+                return future.result()
+            self.stats['rejected_timeout'] += 1
+            raise InferenceOverloaded("timed out waiting for a batch")
+
+    def _take(self, timeout=None):
+        """Next request still wanted by its caller, or None once the timeout expires"""
+        while True:
+            try:
+                request = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                return None
+            # Marks the future running, so its caller can no longer withdraw it
+            if request[1].set_running_or_notify_cancel():
+                return request
+
+    def _collect(self):
+        """Block for the first request, then gather more until the batch is full or the wait expires"""
+        batch = [self._take()]
+        size = len(batch[0][0])
+        deadline = time.perf_counter() + self.max_wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            request = self._take(timeout=remaining)
+            if request is None:
+                break
+            batch.append(request)
+            size += len(request[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            texts = [text for request_texts, _, _ in batch for text in request_texts]
+            started = time.perf_counter()
+            try:
+                with self.slot():
+                    embeddings = np.asarray(self.batch_fn(texts)) if texts else np.empty((0, 0))
+            except Exception as e:
+                print(f"Micro-batch {self.name} failed: {e}")
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            finished = time.perf_counter()
+
+            offset = 0
+            for request_texts, future, queued_at in batch:
+                future.set_result(embeddings[offset:offset + len(request_texts)])
+                offset += len(request_texts)
+                self.stats['wait_ms'] += (started - queued_at) * 1000
+
+            self.stats['batches'] += 1
+            self.stats['requests'] += len(batch)
+            self.stats['texts'] += len(texts)
+            self.stats['run_ms'] += (finished - started) * 1000
+
+    def summary(self):
+        """Stats plus derived averages"""
+        batches = max(self.stats['batches'], 1)
+        requests = max(self.stats['requests'], 1)
+        return dict(self.stats,
+                    avg_batch_texts=self.stats['texts'] / batches,
+                    avg_batch_requests=self.stats['requests'] / batches,
+                    avg_wait_ms=self.stats['wait_ms'] / requests,
+                    queued=self._queue.qsize())
+
+
+_batchers = {}
+_batchers_lock = threading.Lock()
+
+
+def get_batcher(name, batch_fn, slot=None):
+    """Return the process-wide batcher for a model, creating it on first use"""
+    with _batchers_lock:
+        batcher = _batchers.get(name)
+        if batcher is None:
+            batcher = MicroBatcher(batch_fn, name=name, slot=slot)
+            _batchers[name] = batcher
+        return batcher
+
+
+def batcher_stats():
+    """Stats of every batcher created in this process"""
+    return {name: batcher.summary() for name, batcher in _batchers.items()}
@@ -0,0 +1,127 @@
+# Admission control for model inference
+# Caps how many threads run SBERT/Qwen at once, keeps a bounded queue of
+# waiters and sheds load (InferenceOverloaded -> HTTP 503 + Retry-After, or a
+# degraded keyword answer) instead of letting torch threads oversubscribe the CPU.
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Inference calls allowed to run at the same time in this process
+MAX_CONCURRENT = int(os.environ.get('FREADOM_MAX_CONCURRENT_INFERENCE', '2'))
+
+# Callers allowed to wait for a slot; beyond this new callers are rejected immediately
+MAX_QUEUE = int(os.environ.get('FREADOM_INFERENCE_QUEUE', '8'))
+
+# Seconds a queued caller waits for a slot before giving up
+WAIT_TIMEOUT = float(os.environ.get('FREADOM_INFERENCE_WAIT_TIMEOUT', '2.0'))
+
+# Value of the Retry-After header sent with 503 responses
+RETRY_AFTER = int(os.environ.get('FREADOM_RETRY_AFTER', '1'))
+
+# What recommend_content does when inference is overloaded: 'reject' (503) or 'degrade' (keyword scores)
+OVERLOAD_POLICY = os.environ.get('FREADOM_OVERLOAD_POLICY', 'reject')
+
+
+class InferenceOverloaded(Exception):
+    """Raised when no inference slot could be obtained"""
+
+    def __init__(self, reason, retry_after=RETRY_AFTER):
+        super().__init__(f"Inference overloaded: {reason}")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class InferenceLimiter:
+    """Bounded-concurrency gate with a bounded wait queue and a wait timeout"""
+
+    def __init__(self, max_concurrent=MAX_CONCURRENT, max_queue=MAX_QUEUE, wait_timeout=WAIT_TIMEOUT):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.wait_timeout = wait_timeout
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self.stats = {
+            'active': 0,
+            'queued': 0,
+            'peak_queued': 0,
+            'admitted': 0,
+            'rejected_queue_full': 0,
+            'rejected_timeout': 0,
+            'total_wait_ms': 0.0,
+        }
+
+    @contextmanager
+    def slot(self):
+        """Hold one inference slot for the duration of the block"""
+        # Fast path: a free slot means no queueing at all
+        acquired = self._slots.acquire(blocking=False)
+        waited = 0.0
+        if not acquired:
+            with self._lock:
+                if self.stats['queued'] >= self.max_queue:
+                    self.stats['rejected_queue_full'] += 1
+                    raise InferenceOverloaded("queue full")
+                self.stats['queued'] += 1
+                self.stats['peak_queued'] = max(self.stats['peak_queued'], self.stats['queued'])
+            started = time.perf_counter()
+            try:
+                acquired = self._slots.acquire(timeout=self.wait_timeout)
+            finally:
+                waited = time.perf_counter() - started
+                with self._lock:
+                    self.stats['queued'] -= 1
+            if not acquired:
+                with self._lock:
+                    self.stats['rejected_timeout'] += 1
+                raise InferenceOverloaded("timed out waiting for a slot")
+
+        with self._lock:
+            self.stats['active'] += 1
+            self.stats['admitted'] += 1
+            self.stats['total_wait_ms'] += waited * 1000
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.stats['active'] -= 1
+            self._slots.release()
+
+    def summary(self):
+        with self._lock:
+            stats = dict(self.stats)
+        stats.update(max_concurrent=self.max_concurrent, max_queue=self.max_queue,
+                     wait_timeout_s=self.wait_timeout,
+                     avg_wait_ms=stats['total_wait_ms'] / max(stats['admitted'], 1))
+        return stats
+
+
+# Process-wide limiter used by semantic_analyzer
+limiter = InferenceLimiter()
+
+
+def inference_slot():
+    """Context manager guarding one model call with the process-wide limiter"""
+    return limiter.slot()
+
+
+def configure_torch_threads(concurrent=None):
+    """Split the CPU cores between the concurrent inference slots
+
+    Torch's intra-op pool defaults to every core, so N concurrent calls would
+    run N x cores threads. FREADOM_TORCH_THREADS overrides the computed value.
+    """
+    concurrent = concurrent or MAX_CONCURRENT
+    threads = int(os.environ.get('FREADOM_TORCH_THREADS', '0')) or max(1, (os.cpu_count() or 1) // concurrent)
+    try:
+        import torch
+    except ImportError:
+        return None
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Only allowed before any parallel work started
+        pass
+    return threads
@@ -0,0 +1,262 @@
+# Out-of-process inference service
+# Runs SBERT/Qwen in a pool of worker processes behind a Unix socket (or TCP
+# address) so model CPU work and crashes stay out of the Flask request threads.
+# semantic_analyzer talks to it transparently when FREADOM_INFERENCE_ADDRESS is set.
+#
+# Start it with:
+#   python inference_service.py --address /tmp/freadom-inference.sock --workers 2
+
+import os
+import sys
+import time
+import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.connection import Listener, Client
+
+# Address of a running service; empty means inference runs in-process
+ADDRESS = os.environ.get('FREADOM_INFERENCE_ADDRESS', '')
+
+# Shared secret for the connection handshake. Connections carry pickles, so a TCP
+# address requires an explicit key; a Unix socket is only reachable by its owner
+AUTHKEY = os.environ.get('FREADOM_INFERENCE_AUTHKEY', '').encode('utf-8')
+
+# Handshake key of Unix sockets when no key is configured
+SOCKET_AUTHKEY = b'freadom'
+
+# Number of worker processes (each loads its own copy of the model)
+DEFAULT_WORKERS = int(os.environ.get('FREADOM_INFERENCE_WORKERS', '2'))
+
+# Seconds a client waits for a reply before giving up
+REQUEST_TIMEOUT = float(os.environ.get('FREADOM_INFERENCE_TIMEOUT', '30'))
+
+
+class InferenceError(Exception):
+    """Raised when the inference service is unreachable or reports a failure"""
+
+
+def parse_address(address):
+    """'host:port' becomes a TCP tuple (':port' binds 127.0.0.1), anything else is a Unix socket path"""
+    if ':' in address and not address.startswith('/'):
+        host, port = address.rsplit(':', 1)
+        return (host or '127.0.0.1', int(port))
+    return address
+
+
+def authkey_for(address):
+    """Handshake key for a parsed address, refusing TCP without an explicit key"""
+    if AUTHKEY:
+        return AUTHKEY
+    if isinstance(address, tuple):
+        raise InferenceError("FREADOM_INFERENCE_AUTHKEY must be set to use a TCP inference address")
+    return SOCKET_AUTHKEY
+
+
+# ---------------------------------------------------------------------------
+# Worker process side
+# ---------------------------------------------------------------------------
+
+def _init_worker(model_name, workers):
+    """Load the model once per worker process"""
+    global ADDRESS
+    # Workers must never call back into the service themselves
+    ADDRESS = ''
+    import semantic_analyzer
+    from inference_limiter import configure_torch_threads
+    # Each worker runs one call at a time, so the cores are split between workers
+    configure_torch_threads(concurrent=workers)
+    semantic_analyzer.set_model(model_name)
+
+
+def _worker_embed(model_name, texts):
+    import semantic_analyzer
+    embeddings = semantic_analyzer.encode_texts(texts, model_name=model_name)
+    if embeddings is None:
+        raise RuntimeError(f"Model {model_name} is not available in the inference worker")
+    return embeddings
+
+
+def _worker_similarity(model_name, user_interests, content_items):
+    import semantic_analyzer
+    return semantic_analyzer.calculate_semantic_similarity(user_interests, content_items, model_name=model_name)
+
+
+def _worker_ping():
+    return os.getpid()
+
+
+# ---------------------------------------------------------------------------
+# Server side
+# ---------------------------------------------------------------------------
+
+class InferenceServer:
+    """Accepts client connections and dispatches their calls to a process pool"""
+
+    def __init__(self, address, workers=DEFAULT_WORKERS, model_name="sbert"):
+        self.address = address
+        self.workers = workers
+        self.model_name = model_name
+        self.started_at = time.time()
+        self.stats = {'requests': 0, 'errors': 0, 'pool_restarts': 0, 'in_flight': 0}
+        self._lock = threading.Lock()
+        self._pool = self._new_pool()
+
+    def _new_pool(self):
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                   initargs=(self.model_name, self.workers))
+
+    def _submit(self, func, *args):
+        """Run a call in the pool, replacing the pool if a worker crashed"""
+        with self._lock:
+            self.stats['in_flight'] += 1
+            pool = self._pool
+        try:
+            return pool.submit(func, *args).result(timeout=REQUEST_TIMEOUT)
+        except BrokenProcessPool:
+            with self._lock:
+                if self._pool is pool:
+                    print("Inference worker crashed, restarting the pool")
+                    self._pool = self._new_pool()
+                    self.stats['pool_restarts'] += 1
+            raise
+        finally:
+            with self._lock:
+                self.stats['in_flight'] -= 1
+
+    def health(self):
+        """Check that the pool answers and report basic stats"""
+        try:
+            pid = self._submit(_worker_ping)
+            healthy = True
+        except Exception as e:
+            pid, healthy = None, False
+            print(f"Inference health check failed: {e}")
+        return dict(self.stats, healthy=healthy, workers=self.workers, model=self.model_name,
+                    responding_worker=pid, uptime_s=time.time() - self.started_at)
+
+    def handle(self, request):
+        op = request.get('op')
+        if op == 'embed':
+            return self._submit(_worker_embed, request.get('model', self.model_name), request['texts'])
+        if op == 'similarity':
+            return self._submit(_worker_similarity, request.get('model', self.model_name),
+                                request['interests'], request['content_items'])
+        if op == 'health':
+            return self.health()
+        raise ValueError(f"Unknown operation: {op}")
+
+    def _serve_connection(self, conn):
+        with conn:
+            while True:
+                try:
+                    request = conn.recv()
+                except (EOFError, OSError):
+                    return
+                self.stats['requests'] += 1
+                try:
+                    reply = {'ok': True, 'result': self.handle(request)}
+                except Exception as e:
+                    self.stats['errors'] += 1
+                    reply = {'ok': False, 'error': f"{type(e).__name__}: {e}"}
+                try:
+                    conn.send(reply)
+                except (EOFError, OSError):
+                    return
+
+    def serve_forever(self):
+        address = parse_address(self.address)
+        authkey = authkey_for(address)
+        if isinstance(address, str) and os.path.exists(address):
+            os.remove(address)
+        # Create the socket file readable and writable by its owner only
+        previous_umask = os.umask(0o177) if isinstance(address, str) else None
+        try:
+            listener = Listener(address, authkey=authkey)
+        finally:
+            if previous_umask is not None:
+                os.umask(previous_umask)
+        with listener:
+            print(f"Inference service listening on {self.address} with {self.workers} workers")
+            while True:
+                try:
+                    conn = listener.accept()
+                except OSError as e:
+                    print(f"Rejected inference connection: {e}")
+                    continue
+                threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+
+
+# ---------------------------------------------------------------------------
+# Client side
+# ---------------------------------------------------------------------------
+
+_local = threading.local()
+
+
+def _connection():
+    """One persistent connection per request thread"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        address = parse_address(ADDRESS)
+        try:
+            conn = Client(address, authkey=authkey_for(address))
+        except OSError as e:
+            raise InferenceError(f"Cannot reach inference service at {ADDRESS}: {e}")
+        _local.conn = conn
+    return conn
+
+
+def call(request):
+    """Send one request and wait for the reply"""
+    conn = _connection()
+    try:
+        conn.send(request)
+        if not conn.poll(REQUEST_TIMEOUT):
+            raise InferenceError("Timed out waiting for the inference service")
+        reply = conn.recv()
+    except (EOFError, OSError, InferenceError) as e:
+        # Drop the connection so the next call reconnects
+        _local.conn = None
+        conn.close()
+        raise InferenceError(str(e))
+    if not reply['ok']:
+        raise InferenceError(reply['error'])
+    return reply['result']
+
+
+def is_enabled():
+    return bool(ADDRESS)
+
+
+def embed(texts, model_name):
+    """Encode texts in the service, returns an array with one row per text"""
+    embeddings = call({'op': 'embed', 'model': model_name, 'texts': list(texts)})
+    if embeddings is None:
+        raise InferenceError(f"The inference service returned no embeddings for model {model_name}")
+    return embeddings
+
+
+def similarity(user_interests, content_items, model_name):
+    """Score content items against the interests in the service"""
+    return call({'op': 'similarity', 'model': model_name,
+                 'interests': list(user_interests), 'content_items': content_items})
+
+
+def health():
+    """Health report of the running service"""
+    return call({'op': 'health'})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Freadom out-of-process inference service")
+    parser.add_argument('--address', default=ADDRESS or '/tmp/freadom-inference.sock',
+                        help="Unix socket path, or host:port (requires FREADOM_INFERENCE_AUTHKEY)")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    parser.add_argument('--model', default='sbert', choices=['sbert', 'qwen'])
+    args = parser.parse_args()
+    if sys.platform == 'win32' and not isinstance(parse_address(args.address), tuple):
+        parser.error("Unix sockets are not available on Windows, use 127.0.0.1:port")
+    if isinstance(parse_address(args.address), tuple) and not AUTHKEY:
+        parser.error("Set FREADOM_INFERENCE_AUTHKEY to a secret before listening on a TCP address")
+    InferenceServer(args.address, workers=args.workers, model_name=args.model).serve_forever()
@@ -0,0 +1,424 @@
+# Bulk catalog ingestion
+# Streams a CSV or JSONL catalog in chunks, analyses the texts (reading level,
+# topics, vocabulary difficulty and optionally embeddings) in a process pool and
+# writes the results to SQLite in one executemany transaction per chunk. Every
+# chunk commits together with a checkpoint, so an interrupted run resumes where
+# it stopped.
+#
+# Usage:
+#   python ingest_catalog.py books.jsonl --workers 8 --embed sbert
+
+import os
+import csv
+import json
+import time
+import hashlib
+import sqlite3
+import argparse
+import itertools
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import database
+import topic_model
+
+# Records analysed per worker task and written per transaction
+CHUNK_SIZE = int(os.environ.get('FREADOM_INGEST_CHUNK_SIZE', '500'))
+
+# Worker processes (defaults to one per core)
+DEFAULT_WORKERS = int(os.environ.get('FREADOM_INGEST_WORKERS', '0')) or os.cpu_count() or 1
+
+# Chunks queued per worker; bounds memory to roughly workers x this x CHUNK_SIZE records
+CHUNKS_PER_WORKER = 2
+
+# Print a progress line every this many chunks
+REPORT_EVERY = 20
+
+# Topics extracted for records that come without any
+TOPICS_PER_ITEM = 5
+
+
+def iter_records(path, fmt=None):
+    """Yield one dict per record of a CSV or JSONL file without loading it whole
+
+    Args:
+        path (str): input file
+        fmt (str): 'csv' or 'jsonl', guessed from the extension when None
+    """
+    fmt = fmt or ('csv' if path.lower().endswith('.csv') else 'jsonl')
+    with open(path, newline='', encoding='utf-8') as f:
+        if fmt == 'csv':
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+
+def chunked(records, size):
+    """Group an iterable into lists of at most `size` items"""
+    records = iter(records)
+    while True:
+        chunk = list(itertools.islice(records, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def parse_list(value):
+    """Accept a list, a JSON list or a comma/semicolon separated string"""
+    if value is None or value == '':
+        return []
+    if isinstance(value, list):
+        return [str(item).strip() for item in value if str(item).strip()]
+    value = str(value).strip()
+    if value.startswith('['):
+        return parse_list(json.loads(value))
+    return [item.strip() for item in value.replace(';', ',').split(',') if item.strip()]
+
+
+def _optional_float(value):
+    return None if value is None or value == '' else float(value)
+
+
+# ---------------------------------------------------------------------------
+# Worker process side
+# ---------------------------------------------------------------------------
+
+_embed_model = None
+
+
+def _init_worker(embed_model, workers):
+    """Import the analysers (and load the embedding model) once per worker"""
+    global _embed_model
+    _embed_model = embed_model
+    import text_analyzer
+    # NLTK is only loaded by the 'nltk' tokenizer, and lazily; do it here so the first chunk doesn't pay for it
+    if text_analyzer.TOKENIZER == 'nltk':
+        text_analyzer._load_nltk()
+    if embed_model:
+        import inference_service
+        # Ingestion workers encode locally, never through a running service
+        inference_service.ADDRESS = ''
+        import semantic_analyzer
+        from inference_limiter import configure_torch_threads
+        configure_torch_threads(concurrent=workers)
+        semantic_analyzer.set_model(embed_model)
+
+
+def _analyze_chunk(records):
+    """Analyse one chunk of records
+
+    With FREADOM_TOPIC_METHOD=tfidf, records without topics are stored with
+    none and listed as pending: the parent assigns their corpus topics once the
+    chunk's documents are counted, and embeds them afterwards.
+
+    Returns:
+        tuple: (content rows, feature rows, embedding rows, topic model documents,
+            ids pending topics, [(record number, error)])
+    """
+    from text_analyzer import analyze_text_complexity, extract_topics, get_age_recommendation, TOPIC_METHOD
+    from vocabulary_analyzer import assess_vocabulary_difficulty
+    from topic_model import document_terms
+
+    content_rows, feature_rows, topic_documents, pending_topics, errors = [], [], [], [], []
+    embed_ids, descriptions = [], []
+    for number, record in records:
+        try:
+            text = (record.get('text') or '').strip()
+            title = (record.get('title') or '').strip()
+            if not title or not text:
+                raise ValueError("title and text are required")
+
+            analysis = analyze_text_complexity(text)
+            # Values present in the catalog win over the computed ones
+            reading_level = _optional_float(record.get('reading_level'))
+            if reading_level is None:
+                reading_level = float(analysis['reading_level'])
+            topics = parse_list(record.get('topics'))
+            if not topics and TOPIC_METHOD != 'tfidf':
+                topics = extract_topics(text, n=TOPICS_PER_ITEM)
+            age_range = (record.get('age_range') or '').strip() or get_age_recommendation(reading_level)
+            popularity = int(float(record.get('popularity') or 0))
+
+            content_rows.append((int(record['id']), title, text, record.get('author') or '',
+                                 record.get('genre') or '', json.dumps(topics), reading_level,
+                                 age_range, popularity))
+            feature_rows.append((int(record['id']), assess_vocabulary_difficulty(text, age_range),
+                                 analysis['flesch_reading_ease'], analysis['flesch_kincaid_grade'],
+                                 analysis['word_count'], analysis['sentence_count'],
+                                 hashlib.sha1(text.encode('utf-8')).hexdigest()))
+            topic_documents.append((int(record['id']), *document_terms(text)))
+            if topics:
+                embed_ids.append(int(record['id']))
+                descriptions.append(f"{title}. {' '.join(topics)}")
+            else:
+                pending_topics.append(int(record['id']))
+        except Exception as e:
+            errors.append((number, f"{type(e).__name__}: {e}"))
+
+    embedding_rows = _embed_descriptions(embed_ids, descriptions)
+    return content_rows, feature_rows, embedding_rows, topic_documents, pending_topics, errors
+
+
+def _embed_descriptions(content_ids, descriptions):
+    """content_embeddings rows of item descriptions, empty without an embedding model"""
+    if not _embed_model or not descriptions:
+        return []
+    import semantic_analyzer
+    embeddings = semantic_analyzer.encode_texts(descriptions, model_name=_embed_model)
+    if embeddings is None:
+        return []
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    return [
+        (content_id, _embed_model, int(embeddings.shape[1]), embedding.tobytes())
+        for content_id, embedding in zip(content_ids, embeddings)
+    ]
+
+
+# ---------------------------------------------------------------------------
+# Parent process side
+# ---------------------------------------------------------------------------
+
+def ensure_checkpoint_table(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS ingest_checkpoints (
+        source TEXT PRIMARY KEY,
+        signature TEXT NOT NULL,
+        records_done INTEGER NOT NULL,
+        updated_at REAL NOT NULL,
+        id_base INTEGER
+    )
+    ''')
+    # id_base: generated ids are id_base + 1, + 2, ... in file order, the same on every resume
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(ingest_checkpoints)")]
+    if 'id_base' not in columns:
+        conn.execute("ALTER TABLE ingest_checkpoints ADD COLUMN id_base INTEGER")
+
+
+def _source_signature(path):
+    """Size and mtime of the input, a changed file invalidates its checkpoint"""
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def _scan_ids(records, start):
+    """Highest explicit integer id among the records (0 when there is none) and
+    the number of id-less records before `start`"""
+    highest, generated = 0, 0
+    for number, record in enumerate(records):
+        if record.get('id') in (None, ''):
+            generated += number < start
+            continue
+        try:
+            highest = max(highest, int(record.get('id')))
+        except (TypeError, ValueError):
+            continue
+    return highest, generated
+
+
+def _numbered(records, start, next_id):
+    """Number the records from `start` and give id-less ones fresh ids"""
+    for number, record in enumerate(records, start):
+        if record.get('id') in (None, ''):
+            record = dict(record, id=next(next_id))
+        yield number, record
+
+
+def _write_chunk(conn, source, records_done, result):
+    """Store one analysed chunk and advance the checkpoint in the same transaction
+
+    With records_done None the checkpoint stays put, for chunks that still
+    need their corpus topics (see _finish_chunk).
+    """
+    content_rows, feature_rows, embedding_rows, topic_documents, _, errors = result
+    versions = {}
+    with conn:
+        conn.executemany('INSERT OR REPLACE INTO content VALUES (?,?,?,?,?,?,?,?,?)', content_rows)
+        conn.executemany('INSERT OR REPLACE INTO content_features VALUES (?,?,?,?,?,?,?)', feature_rows)
+        if embedding_rows:
+            conn.executemany('INSERT OR REPLACE INTO content_embeddings VALUES (?,?,?,?)', embedding_rows)
+        # Document frequencies grow with the catalog, no corpus-wide recount needed
+        if topic_model.add_documents(conn, topic_documents):
+            versions = database.bump_data_version(conn, 'topics')
+        if records_done is not None:
+            _advance_checkpoint(conn, source, records_done)
+    database.publish_data_versions(versions)
+    for number, error in errors:
+        print(f"Skipped record {number}: {error}")
+
+
+def _advance_checkpoint(conn, source, records_done):
+    conn.execute(
+        "UPDATE ingest_checkpoints SET records_done = ?, updated_at = ? WHERE source = ?",
+        (records_done, time.time(), source)
+    )
+
+
+def _corpus_topics(result):
+    """TF-IDF topics of a written chunk's pending items, through the per-item topic cache
+
+    Returns:
+        tuple: ({content id: topics}, content ids, descriptions to embed)
+    """
+    content_rows, pending = result[0], result[4]
+    topics = topic_model.topics_for_content(pending, n=TOPICS_PER_ITEM)
+    titles = {row[0]: row[1] for row in content_rows}
+    content_ids = [content_id for content_id in pending if content_id in topics]
+    return topics, content_ids, [f"{titles[content_id]}. {' '.join(topics[content_id])}" for content_id in content_ids]
+
+
+def _finish_chunk(conn, source, records_done, topics, embedding_rows):
+    """Store a chunk's corpus topics and their embeddings and advance the checkpoint in one transaction
+
+    A run interrupted before this point redoes the whole chunk on resume.
+    """
+    with conn:
+        conn.executemany("UPDATE content SET topics = ? WHERE id = ?",
+                         [(json.dumps(item_topics), content_id) for content_id, item_topics in topics.items()])
+        if embedding_rows:
+            conn.executemany('INSERT OR REPLACE INTO content_embeddings VALUES (?,?,?,?)', embedding_rows)
+        _advance_checkpoint(conn, source, records_done)
+
+
+def ingest_catalog(path, fmt=None, workers=None, chunk_size=None, embed_model=None, restart=False):
+    """Ingest a catalog file into the content tables
+
+    Args:
+        path (str): CSV or JSONL file with at least title and text per record;
+            records without an id get one above both the current maximum
+            and every id in the file
+        fmt (str): 'csv' or 'jsonl', guessed from the extension when None
+        workers (int): analysis processes
+        chunk_size (int): records per task and per transaction
+        embed_model (str): also store embeddings computed with this model ('sbert' or 'qwen')
+        restart (bool): ignore an existing checkpoint
+
+    Returns:
+        dict: throughput report
+    """
+    workers = workers or DEFAULT_WORKERS
+    chunk_size = chunk_size or CHUNK_SIZE
+    source = os.path.abspath(path)
+    signature = _source_signature(path)
+
+    conn = sqlite3.connect(database.DB_PATH)
+    # Each chunk is its own durable transaction; a crash loses at most one chunk of work
+    conn.execute("PRAGMA synchronous = NORMAL")
+    database.ensure_content_feature_tables(conn)
+    ensure_checkpoint_table(conn)
+
+    row = conn.execute(
+        "SELECT signature, records_done, id_base FROM ingest_checkpoints WHERE source = ?", (source,)
+    ).fetchone()
+    start, id_base = 0, None
+    if row is not None and not restart:
+        if row[0] == signature:
+            start, id_base = row[1], row[2]
+            print(f"Resuming {path} after {start} records")
+        else:
+            print(f"{path} changed since the last run, starting over")
+
+    # Generated ids go above the explicit ids of the whole file as well, or INSERT OR REPLACE
+    # would let a later record silently overwrite an item that was given its id. The base is
+    # kept with the checkpoint, so records of a chunk written before an interruption get the
+    # same ids again on resume
+    max_record_id, generated = _scan_ids(iter_records(path, fmt), start)
+    if id_base is None:
+        max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM content").fetchone()[0]
+        id_base = max(max_id, max_record_id) - generated
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO ingest_checkpoints (source, signature, records_done, updated_at, id_base) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (source, signature, start, time.time(), id_base)
+        )
+
+    records = itertools.islice(iter_records(path, fmt), start, None)
+    chunks = chunked(_numbered(records, start, itertools.count(id_base + generated + 1)), chunk_size)
+
+    report = {'records': 0, 'ingested': 0, 'skipped': 0, 'embedded': 0, 'chunks': 0}
+    started = time.perf_counter()
+    records_done = start
+    max_in_flight = workers * CHUNKS_PER_WORKER
+    pending = deque()
+
+    def write_oldest():
+        # Write in submission order so the checkpoint always marks a complete prefix
+        nonlocal records_done
+        size, future = pending.popleft()
+        result = future.result()
+        records_done += size
+        embedded = len(result[2])
+        if not result[4]:
+            _write_chunk(conn, source, records_done, result)
+        else:
+            # Corpus topics need the chunk's documents counted first, so the checkpoint
+            # only moves once those topics (and embeddings of them) are stored too
+            _write_chunk(conn, source, None, result)
+            topics, content_ids, descriptions = _corpus_topics(result)
+            embedding_rows = []
+            if embed_model and descriptions:
+                embedding_rows = pool.submit(_embed_descriptions, content_ids, descriptions).result()
+            _finish_chunk(conn, source, records_done, topics, embedding_rows)
+            embedded += len(embedding_rows)
+
+        report['chunks'] += 1
+        report['records'] += size
+        report['ingested'] += len(result[0])
+        report['embedded'] += embedded
+        report['skipped'] += len(result[5])
+        if report['chunks'] % REPORT_EVERY == 0:
+            elapsed = time.perf_counter() - started
+            print(f"{records_done} records done, {report['records'] / elapsed:.0f} records/s")
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(embed_model, workers)) as pool:
+            for chunk in chunks:
+                pending.append((len(chunk), pool.submit(_analyze_chunk, chunk)))
+                # Bounded read-ahead keeps memory flat however large the file is
+                while len(pending) >= max_in_flight:
+                    write_oldest()
+            while pending:
+                write_oldest()
+    finally:
+        if report['ingested']:
+            # Readers (catalog index, response cache) pick up the new catalog in one step
+            with conn:
+                versions = database.bump_data_version(conn, 'content')
+            database.publish_data_versions(versions)
+        conn.close()
+
+    elapsed = time.perf_counter() - started
+    report.update(
+        seconds=round(elapsed, 2),
+        records_per_second=round(report['records'] / elapsed, 1) if elapsed > 0 else 0.0,
+        workers=workers,
+        chunk_size=chunk_size,
+        resumed_from=start
+    )
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk-load a CSV or JSONL catalog into the Freadom database")
+    parser.add_argument('path')
+    parser.add_argument('--format', choices=['csv', 'jsonl'], default=None)
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--embed', choices=['sbert', 'qwen'], default=None,
+                        help="also compute and store embeddings with this model")
+    parser.add_argument('--restart', action='store_true', help="ignore the checkpoint of a previous run")
+    args = parser.parse_args()
+    if not os.path.exists(args.path):
+        parser.error(f"No such file: {args.path}")
+
+    report = ingest_catalog(args.path, fmt=args.format, workers=args.workers, chunk_size=args.chunk_size,
+                            embed_model=args.embed, restart=args.restart)
+    print(json.dumps(report, indent=2))
+    if report['embedded']:
+        print("Run `python embedding_store.py publish` to share the new embeddings with the API workers")
@@ -0,0 +1,175 @@
+# On-demand request profiling
+# With FREADOM_PROFILING=1, a request carrying the header "X-Freadom-Profile: 1"
+# runs under cProfile; FREADOM_PROFILE_SAMPLE_RATE additionally profiles that
+# fraction of all requests. Each profile is written to PROFILE_DIR as a pstats
+# file named after the endpoint and user, and /api/system/profiles aggregates
+# them into the hottest functions. When both settings are off no hooks are
+# installed at all, so requests pay nothing.
+#
+# Inspect a single profile with:
+#   python -m pstats profiles/<file>.prof
+
+import os
+import re
+import time
+import random
+import pstats
+import cProfile
+import threading
+
+from flask import request, g
+
+# Honour the profiling request header
+ENABLED = os.environ.get('FREADOM_PROFILING', '0') == '1'
+
+# Fraction of all requests profiled without the header (0 disables sampling)
+SAMPLE_RATE = float(os.environ.get('FREADOM_PROFILE_SAMPLE_RATE', '0'))
+
+HEADER = 'X-Freadom-Profile'
+
+# Directory the profiles are written to
+PROFILE_DIR = os.environ.get(
+    'FREADOM_PROFILE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles')
+)
+
+# Profiles kept on disk; the oldest are deleted beyond this
+MAX_PROFILES = int(os.environ.get('FREADOM_MAX_PROFILES', '200'))
+
+# Functions always reported by the summary, matched against the function name
+WATCHED_FUNCTIONS = (
+    'recommend_content',
+    'calculate_semantic_similarity',
+    'read_sql_query',
+    'simple_tokenize',
+    'simple_sent_tokenize',
+    'word_tokenize',
+)
+
+# Only one profiler can be active per interpreter; concurrent requests are not profiled
+_active = threading.Lock()
+
+stats = {'profiled': 0, 'skipped_busy': 0}
+
+
+def is_active():
+    return ENABLED or SAMPLE_RATE > 0
+
+
+def _wanted():
+    if ENABLED and request.headers.get(HEADER, '') not in ('', '0'):
+        return True
+    return SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE
+
+
+def _start():
+    if not _wanted():
+        return
+    if not _active.acquire(blocking=False):
+        stats['skipped_busy'] += 1
+        return
+    profiler = cProfile.Profile()
+    g.profiler = profiler
+    g.profile_started = time.perf_counter()
+    profiler.enable()
+
+
+def _finish(response):
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return response
+    profiler.disable()
+    _active.release()
+    elapsed_ms = (time.perf_counter() - g.pop('profile_started')) * 1000
+
+    user_id = (request.view_args or {}).get('user_id', 'none')
+    endpoint = re.sub(r'[^A-Za-z0-9_]+', '_', request.endpoint or 'unknown')
+    name = f"{int(time.time() * 1000)}-{endpoint}-user{user_id}-{elapsed_ms:.0f}ms.prof"
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    profiler.dump_stats(os.path.join(PROFILE_DIR, name))
+    stats['profiled'] += 1
+    _prune()
+    response.headers['X-Profile-Id'] = name
+    return response
+
+
+def _abandon(error=None):
+    """Stop a profiler whose request failed before after_request ran"""
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        _active.release()
+
+
+def _prune():
+    names = sorted(name for name in os.listdir(PROFILE_DIR) if name.endswith('.prof'))
+    for name in names[:-MAX_PROFILES] if len(names) > MAX_PROFILES else []:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, name))
+        except OSError:
+            pass
+
+
+def install(app):
+    """Register the profiling hooks on a Flask app, only when profiling is configured"""
+    if not is_active():
+        return False
+    app.before_request(_start)
+    app.after_request(_finish)
+    app.teardown_request(_abandon)
+    return True
+
+
+def list_profiles(endpoint=None, user_id=None):
+    """Saved profile file names, newest first, optionally filtered by endpoint and user"""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    names = sorted((name for name in os.listdir(PROFILE_DIR) if name.endswith('.prof')), reverse=True)
+    if endpoint:
+        names = [name for name in names if f"-{endpoint}-" in name]
+    if user_id is not None:
+        names = [name for name in names if f"-user{user_id}-" in name]
+    return names
+
+
+def _function_row(key, entry, profiles):
+    filename, line, function = key
+    primitive_calls, calls, tottime, cumtime, _ = entry
+    return {
+        'function': function,
+        'file': os.path.relpath(filename) if filename.startswith(os.sep) else filename,
+        'line': line,
+        'calls': calls,
+        'tottime_ms': round(tottime * 1000 / profiles, 3),
+        'cumtime_ms': round(cumtime * 1000 / profiles, 3)
+    }
+
+
+def summarize(endpoint=None, user_id=None, limit=25, max_profiles=50, sort='cumulative'):
+    """Hottest functions across the most recent matching profiles
+
+    Times are averaged per profiled request.
+    """
+    names = list_profiles(endpoint, user_id)[:max_profiles]
+    report = {
+        'enabled': ENABLED,
+        'sample_rate': SAMPLE_RATE,
+        'profiles': len(names),
+        'recent': names[:10],
+        'counters': dict(stats),
+        'hottest': [],
+        'watched': {}
+    }
+    if not names:
+        return report
+
+    combined = pstats.Stats(*(os.path.join(PROFILE_DIR, name) for name in names))
+    sort_index = 2 if sort == 'tottime' else 3
+    entries = sorted(combined.stats.items(), key=lambda item: item[1][sort_index], reverse=True)
+    report['hottest'] = [_function_row(key, entry, len(names)) for key, entry in entries[:limit]]
+
+    for watched in WATCHED_FUNCTIONS:
+        rows = [_function_row(key, entry, len(names)) for key, entry in entries if key[2] == watched]
+        if rows:
+            report['watched'][watched] = max(rows, key=lambda row: row['cumtime_ms'])
+    return report
@@ -1,20 +1,31 @@
+import os
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 import numpy as np
 import pandas as pd
-from database import get_user_data, get_all_content
+from database import get_user_data, read_mask
+from catalog_index import get_catalog_index
+from recommendation_pipeline import generate_candidates
+from inference_limiter import InferenceOverloaded
+import inference_limiter
 from text_analyzer import analyze_text_complexity
 from vocabulary_analyzer import assess_vocabulary_difficulty
 
 # Try to use simplified analyzer first, fall back to semantic_analyzer if not available
+# The imported scorer is also the fallback tier used when embedding scoring misses its deadline
 try:
     from simple_analyzer import calculate_semantic_similarity, get_current_model
+    FALLBACK_TIER = "keyword"
     print("Using simplified analyzer for recommendations")
 except ImportError:
     try:
         from semantic_analyzer import calculate_semantic_similarity, get_current_model
+        FALLBACK_TIER = "embedding"
         print("Using semantic analyzer for recommendations")
     except ImportError:
         print("Warning: No semantic analyzer available. Using dummy similarity function.")
+        FALLBACK_TIER = "dummy"
         
         def calculate_semantic_similarity(user_interests, content_items):
             """Dummy similarity function that returns 0.5 for all items"""
@@ -25,111 +36,207 @@ except ImportError:
             """Dummy function for model name"""
             return "dummy"
 
-def recommend_content(user_id, n_recommendations=3):
-    """Generate personalized content recommendations"""
-    user = get_user_data(user_id)
+# Default latency budget for interest scoring in milliseconds, 0 waits for the model
+DEFAULT_DEADLINE_MS = float(os.environ.get('FREADOM_SCORING_DEADLINE_MS', '0'))
+
+# Threads running embedding scoring so a request can stop waiting at its deadline.
+# Anything beyond the limiter's slots plus queue would be rejected anyway.
+_scoring_pool = ThreadPoolExecutor(
+    max_workers=inference_limiter.MAX_CONCURRENT + inference_limiter.MAX_QUEUE,
+    thread_name_prefix="scoring"
+)
+
+def _fallback_scores(user_interests, content_items):
+    return np.array(calculate_semantic_similarity(user_interests, content_items)), FALLBACK_TIER
+
+def score_interests(user_interests, content_items, deadline=None, meta=None):
+    """Score content against the user's interests with the best tier the budget allows
+    
+    Args:
+        user_interests (list): the user's interest keywords
+        content_items (list): candidate records
+        deadline (float): time.perf_counter() value by which the scores are needed,
+            None waits for the embedding model however long it takes
+        meta (dict): receives 'scoring_tier' and, for fallbacks, 'fallback_reason'
+    
+    Returns:
+        tuple: (np.ndarray of scores, tier name such as 'embedding' or 'keyword')
+    """
+    meta = meta if meta is not None else {}
+    try:
+        import semantic_analyzer
+    except ImportError:
+        semantic_analyzer = None
+    if semantic_analyzer is None or not semantic_analyzer.is_model_available():
+        # Waiting for a model that can never load would report every request as 'model_loading'
+        scores, meta['scoring_tier'] = _fallback_scores(user_interests, content_items)
+        meta['fallback_reason'] = 'unavailable'
+        return scores, meta['scoring_tier']
+    
+    reason = None
+    if deadline is None:
+        try:
+            scores = np.array(semantic_analyzer.calculate_semantic_similarity(user_interests, content_items))
+            print(f"Using {semantic_analyzer.get_current_model()} model for semantic similarity")
+            meta['scoring_tier'] = 'embedding'
+            return scores, 'embedding'
+        except InferenceOverloaded:
+            if inference_limiter.OVERLOAD_POLICY != 'degrade':
+                raise
+            reason = 'overloaded'
+            meta['degraded'] = True
+    elif not semantic_analyzer.is_model_loaded():
+        # Don't make this request pay for the warm-up, later ones get the model
+        semantic_analyzer.load_model_async()
+        reason = 'model_loading'
+    else:
+        future = _scoring_pool.submit(semantic_analyzer.calculate_semantic_similarity, user_interests, content_items)
+        try:
+            scores = np.array(future.result(timeout=max(0.0, deadline - time.perf_counter())))
+            meta['scoring_tier'] = 'embedding'
+            return scores, 'embedding'
+        except FutureTimeout:
+            # The call keeps its inference slot until it finishes, only this request stops waiting
+            future.cancel()
+            reason = 'deadline'
+        except InferenceOverloaded:
+            # A latency budget means a quick keyword answer beats a 503
+            reason = 'overloaded'
+            meta['degraded'] = True
+    
+    print(f"Embedding scoring skipped ({reason}), using {FALLBACK_TIER} matching for semantic similarity")
+    scores, meta['scoring_tier'] = _fallback_scores(user_interests, content_items)
+    meta['fallback_reason'] = reason
+    return scores, meta['scoring_tier']
+
+def _format_recommendation(rec, score, interest_score, level_score, popularity_score):
+    """Build the API record for one recommendation with its match explanation"""
+    # Calculate how much each factor contributed
+    interest_contribution = 0.6 * interest_score
+    level_contribution = 0.3 * level_score
+    popularity_contribution = 0.1 * popularity_score
+    
+    # Format as percentage of total score
+    total = interest_contribution + level_contribution + popularity_contribution
+    if total > 0:
+        match_reason = {
+            'interest_match': round(interest_contribution / total * 100),
+            'reading_level_match': round(level_contribution / total * 100),
+            'popularity': round(popularity_contribution / total * 100)
+        }
+    else:
+        # Fallback with default contribution percentages if we can't calculate them
+        match_reason = {
+            'interest_match': 60,
+            'reading_level_match': 30,
+            'popularity': 10
+        }
+    
+    return {
+        'id': int(rec['id']),
+        'title': rec['title'],
+        'author': rec['author'],
+        'genre': rec['genre'],
+        'reading_level': float(rec['reading_level']),
+        'age_range': rec['age_range'],
+        'topics': rec['topics'],
+        'recommendation_score': float(score),
+        'match_reason': match_reason
+    }
+
+def recommend_content(user_id, n_recommendations=3, user=None, meta=None, pipeline_config=None,
+                      deadline_ms=None):
+    """Generate personalized content recommendations
+    
+    Callers that already loaded the user record can pass it as `user`
+    to skip the lookup. When a `meta` dict is given it is filled with the
+    per-stage candidate counts and timings of the retrieval pipeline and
+    the scoring tier that produced the answer. With `deadline_ms` the whole
+    call aims to finish within that many milliseconds, falling back to
+    keyword scoring when the embedding model can't make it.
+    """
+    started = time.perf_counter()
+    if deadline_ms is None and DEFAULT_DEADLINE_MS > 0:
+        deadline_ms = DEFAULT_DEADLINE_MS
+    deadline = started + deadline_ms / 1000.0 if deadline_ms else None
+    
+    if user is None:
+        user = get_user_data(user_id)
     
     if user is None:
         return {"error": "User not found"}
     
-    all_content = get_all_content()
+    catalog = get_catalog_index()
+    all_content = catalog.content
     
-    # Filter out already read content
-    unread_content = all_content[~all_content['id'].isin(user['history'])]
+    # Filter out already read content with one vectorised lookup into the read bitmap
+    if user.get('read_bitmap') is not None:
+        unread_mask = ~read_mask(user['read_bitmap'], catalog.ids)
+    else:
+        unread_mask = ~all_content['id'].isin(user['history']).to_numpy()
     
-    if unread_content.empty:
+    if not unread_mask.any():
         return {"message": "No new content available"}
     
-    # Convert DataFrame to list of dicts for processing
-    content_items = unread_content.to_dict('records')
-    
     # Calculate reading level appropriateness
     # Target slightly above user's current level to encourage growth (but not too much)
     target_level = min(5.0, user['reading_level'] * 1.1)
-    level_scores = 1 - (np.abs(unread_content['reading_level'] - target_level) / 5)
-      # Calculate interest match using semantic similarity with the currently selected model
-    from semantic_analyzer import calculate_semantic_similarity, get_current_model
-    interest_scores = calculate_semantic_similarity(user['interests'], content_items)
-    print(f"Using {get_current_model()} model for semantic similarity")
     
-    # Calculate popularity score (normalized)
-    popularity_scores = unread_content['popularity'] / unread_content['popularity'].max()
+    # Stage 1: cheap candidate generators, merged and capped at the re-rank budget
+    positions, stage_stats = generate_candidates(
+        catalog, user, unread_mask, target_level, n_recommendations, config=pipeline_config,
+        deadline=deadline
+    )
+    if meta is not None:
+        meta['stages'] = stage_stats
+    if len(positions) == 0:
+        return {"message": "No new content available"}
+    
+    # Stage 2: the expensive re-ranker only sees the merged candidates
+    rerank_started = time.perf_counter()
+    candidates = all_content.iloc[positions]
+    
+    # Convert DataFrame to list of dicts for processing
+    content_items = candidates.to_dict('records')
+    
+    level_scores = 1 - (np.abs(candidates['reading_level'].to_numpy() - target_level) / 5)
+    
+    # Calculate interest match with the selected model, or keyword matching if it can't meet the deadline
+    interest_scores, _ = score_interests(user['interests'], content_items, deadline=deadline, meta=meta)
+    
+    # Calculate popularity score (normalized against every unread item, not just the candidates)
+    popularity_scores = catalog.popularity[positions] / catalog.popularity[unread_mask].max()
     
     # Combine scores with weights
     # 60% interest match, 30% reading level appropriateness, 10% popularity
-    final_scores = (0.6 * np.array(interest_scores) + 
-                   0.3 * np.array(level_scores) + 
-                   0.1 * np.array(popularity_scores))
-    
-    # Add scores to DataFrame - using .loc to avoid the SettingWithCopyWarning
-    unread_content.loc[:, 'recommendation_score'] = final_scores
+    final_scores = (0.6 * interest_scores + 
+                   0.3 * level_scores + 
+                   0.1 * popularity_scores)
     
     # Get top recommendations
-    recommendations = unread_content.sort_values('recommendation_score', ascending=False).head(n_recommendations)
+    top = np.argsort(-final_scores, kind='stable')[:n_recommendations]
     
     # Format results with explanation
-    result = []
-    for i, (index, rec) in enumerate(recommendations.iterrows()):
-        try:
-            # Find the index in unread_content that corresponds to this recommendation
-            # This is the actual index in the DataFrame, not the content ID
-            content_mask = unread_content['id'] == rec['id']
-            if not any(content_mask):
-                raise ValueError(f"Content ID {rec['id']} not found in unread_content")
-                
-            # Get the index position (row number) in the unread_content DataFrame
-            content_index = content_mask.idxmax()
-            
-            # Calculate how much each factor contributed using the DataFrame index
-            interest_contribution = 0.6 * interest_scores[content_mask.tolist().index(True)]
-            level_contribution = 0.3 * level_scores[content_mask.tolist().index(True)]  
-            popularity_contribution = 0.1 * popularity_scores[content_mask.tolist().index(True)]
-            
-            # Format as percentage of total score
-            total = interest_contribution + level_contribution + popularity_contribution
-            interest_pct = round(interest_contribution / total * 100)
-            level_pct = round(level_contribution / total * 100)
-            popularity_pct = round(popularity_contribution / total * 100)
-            
-            result.append({
-                'id': int(rec['id']),
-                'title': rec['title'],
-                'author': rec['author'],
-                'genre': rec['genre'],
-                'reading_level': float(rec['reading_level']),
-                'age_range': rec['age_range'],
-                'topics': rec['topics'],
-                'recommendation_score': float(rec['recommendation_score']),
-                'match_reason': {
-                    'interest_match': interest_pct,
-                    'reading_level_match': level_pct,
-                    'popularity': popularity_pct
-                }
-            })
-        except (ValueError, IndexError, KeyError) as e:
-            # Fallback with default contribution percentages if we can't calculate them
-            print(f"Error calculating match reasons for content {rec['id']}: {e}")
-            result.append({
-                'id': int(rec['id']),
-                'title': rec['title'],
-                'author': rec['author'],
-                'genre': rec['genre'],
-                'reading_level': float(rec['reading_level']),
-                'age_range': rec['age_range'],
-                'topics': rec['topics'],
-                'recommendation_score': float(rec['recommendation_score']),
-                'match_reason': {
-                    'interest_match': 60,
-                    'reading_level_match': 30,
-                    'popularity': 10
-                }
-            })
+    result = [
+        _format_recommendation(content_items[i], final_scores[i], interest_scores[i],
+                               level_scores[i], popularity_scores[i])
+        for i in top
+    ]
     
+    if meta is not None:
+        meta['stages']['rerank'] = {
+            'candidates': len(content_items),
+            'ms': (time.perf_counter() - rerank_started) * 1000
+        }
     return result
 
-def analyze_reading_history(user_id):
-    """Analyze user's reading history and progress"""
-    user = get_user_data(user_id)
+def analyze_reading_history(user_id, user=None):
+    """Analyze user's reading history and progress
+    
+    Accepts a preloaded user record like recommend_content.
+    """
+    if user is None:
+        user = get_user_data(user_id)
     
     if user is None:
         return {"error": "User not found"}
@@ -137,36 +244,35 @@ def analyze_reading_history(user_id):
     if not user['history']:
         return {"message": "No reading history available"}
     
-    # Get all content read by user
-    from database import get_content_by_ids
-    history = get_content_by_ids(user['history'])
+    # Aggregates are maintained incrementally on every read event
+    from database import get_reading_profile
+    # Reads still buffered by write_behind are not in the stored profile yet
+    stored_history = user['history'][:len(user['history']) - (user.get('pending_reads') or 0)]
+    profile = get_reading_profile(user_id, history=stored_history)
     
-    if history.empty:
+    if profile is None or profile['average_level'] is None:
         return {"message": "No reading history available"}
     
-    # Calculate reading progress metrics
-    avg_level = history['reading_level'].mean()
-    reading_trend = []
-    
-    # Sort history by complexity to see progression
-    sorted_history = history.sort_values('reading_level')
-    
-    # Extract topics of interest based on reading history
-    all_topics = []
-    for topics in history['topics']:
-        all_topics.extend(topics)
+    avg_level = profile['average_level']
     
-    from collections import Counter
-    topic_counter = Counter(all_topics)
-    top_topics = [item[0] for item in topic_counter.most_common(5)]
+    # Vocabulary histograms stored by the last graded_lexicon rescore
+    from graded_lexicon import stored_grades
+    grades = stored_grades([item['id'] for item in profile['history']])
+    vocabulary = {}
+    for item in profile['history']:
+        if item['id'] in grades:
+            item['lexical_grade'] = grades[item['id']]['lexical_grade']
+            for grade, count in grades[item['id']]['histogram'].items():
+                vocabulary[grade] = vocabulary.get(grade, 0) + count
     
     return {
         "reading_level": float(user['reading_level']),
         "average_content_level": float(avg_level),
         "progress_trend": float(user['reading_level'] - avg_level),  # Positive if improving
         "books_read": len(user['history']),
-        "favorite_topics": top_topics,
-        "history": sorted_history[['id', 'title', 'reading_level']].to_dict('records')
+        "favorite_topics": profile['favorite_topics'],
+        "vocabulary_grades": vocabulary,
+        "history": profile['history']
     }
 
 if __name__ == "__main__":
@@ -0,0 +1,231 @@
+# Two-stage retrieval for recommendations
+# Cheap candidate generators (keyword index, reading-level window, popularity,
+# embedding neighbours) each propose a bounded number of unread items; their
+# results are merged and de-duplicated, and only the merged top-N reach the
+# expensive semantic re-ranker in recommend_content.
+
+import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+import numpy as np
+
+from catalog_index import AGE_FILTER, MIN_CANDIDATES
+from inference_limiter import InferenceOverloaded
+import inference_limiter
+
+# Per-stage configuration; 'budget' is the maximum number of candidates a stage may return,
+# 'max_ms' how long it may wait (on the model), further cut by the request's deadline
+DEFAULT_PIPELINE_CONFIG = {
+    'generators': {
+        'keyword': {'enabled': True, 'budget': 200},
+        'level_window': {'enabled': True, 'budget': 200},
+        'popularity': {'enabled': True, 'budget': 50},
+        'embedding': {'enabled': True, 'budget': 100, 'max_ms': 250},
+    },
+    # Maximum number of merged candidates handed to the re-ranker
+    'rerank_budget': 300,
+}
+
+# name -> function(context, budget) returning catalog positions, best first
+CANDIDATE_GENERATORS = {}
+
+# Threads encoding the interests for the embedding generator, so a request can stop waiting at its deadline
+_encode_pool = ThreadPoolExecutor(
+    max_workers=inference_limiter.MAX_CONCURRENT + inference_limiter.MAX_QUEUE,
+    thread_name_prefix="candidate-encode"
+)
+
+
+def register_generator(name):
+    """Decorator registering a candidate generator under the given name"""
+    def decorator(func):
+        CANDIDATE_GENERATORS[name] = func
+        return func
+    return decorator
+
+
+def load_pipeline_config():
+    """Default configuration, overridden by the JSON in FREADOM_PIPELINE_CONFIG if set"""
+    config = json.loads(json.dumps(DEFAULT_PIPELINE_CONFIG))
+    override = os.environ.get('FREADOM_PIPELINE_CONFIG')
+    if override:
+        try:
+            override = json.loads(override)
+        except ValueError as e:
+            print(f"Ignoring invalid FREADOM_PIPELINE_CONFIG: {e}")
+            return config
+        for name, settings in override.get('generators', {}).items():
+            config['generators'].setdefault(name, {}).update(settings)
+        if 'rerank_budget' in override:
+            config['rerank_budget'] = int(override['rerank_budget'])
+    return config
+
+
+PIPELINE_CONFIG = load_pipeline_config()
+
+
+@register_generator('keyword')
+def keyword_candidates(context, budget):
+    """Items whose topics or title share words with the user's interests"""
+    catalog = context['catalog']
+    positions, counts = catalog.keyword_matches(context['user']['interests'])
+    keep = context['allowed'][positions]
+    positions, counts = positions[keep], counts[keep]
+    # Most matching keywords first, popularity breaks ties
+    order = np.lexsort((-catalog.popularity[positions], -counts))
+    return positions[order][:budget]
+
+
+@register_generator('level_window')
+def level_window_candidates(context, budget):
+    """Items closest to the target reading level, using the widening level window
+
+    The window is widened until it holds MIN_CANDIDATES items (at most the budget).
+    """
+    catalog = context['catalog']
+    target_level = context['target_level']
+    positions = catalog.candidates(target_level, context['allowed'], min_candidates=min(MIN_CANDIDATES, budget))
+    distance = np.abs(catalog.content['reading_level'].to_numpy()[positions] - target_level)
+    return positions[np.argsort(distance, kind='stable')][:budget]
+
+
+@register_generator('popularity')
+def popularity_candidates(context, budget):
+    """Most popular eligible items"""
+    order = context['catalog'].popularity_order
+    return order[context['allowed'][order]][:budget]
+
+
+@register_generator('embedding')
+def embedding_candidates(context, budget):
+    """Nearest neighbours of the user's interests in the published embedding snapshot
+
+    Only used when a snapshot for the active model exists; encoding the
+    interests is a single short forward pass. Under a deadline, or with the
+    'degrade' overload policy, an encode that is overloaded or late yields no
+    candidates instead of failing the request.
+    """
+    from embedding_store import attach
+    snapshot = attach()
+    if snapshot is None or 'embeddings' not in snapshot:
+        return np.empty(0, dtype=np.int64)
+    try:
+        import semantic_analyzer
+    except ImportError:
+        return np.empty(0, dtype=np.int64)
+    if snapshot.model != semantic_analyzer.get_current_model():
+        return np.empty(0, dtype=np.int64)
+    # Under a latency budget never wait for the model to load
+    if context['deadline'] is not None and not semantic_analyzer.is_model_loaded():
+        return np.empty(0, dtype=np.int64)
+
+    catalog = context['catalog']
+    rows = snapshot.rows_for_ids(catalog.ids)
+    if rows is None:
+        return np.empty(0, dtype=np.int64)
+    interests = context['user']['interests']
+    deadline = context['deadline']
+    try:
+        if deadline is None:
+            user_embedding = semantic_analyzer.get_interest_embedding(interests)
+        else:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return np.empty(0, dtype=np.int64)
+            future = _encode_pool.submit(semantic_analyzer.get_interest_embedding, interests)
+            user_embedding = future.result(timeout=remaining)
+    except FutureTimeout:
+        future.cancel()
+        return np.empty(0, dtype=np.int64)
+    except InferenceOverloaded:
+        # Without a budget the 'reject' policy answers 503, as the scoring stage does
+        if deadline is None and inference_limiter.OVERLOAD_POLICY != 'degrade':
+            raise
+        return np.empty(0, dtype=np.int64)
+    if user_embedding is None:
+        return np.empty(0, dtype=np.int64)
+
+    # Works directly on float16 / int8 snapshots
+    scores = snapshot.cosine_scores(user_embedding)[rows]
+    eligible = np.flatnonzero(context['allowed'])
+    return eligible[np.argsort(-scores[eligible], kind='stable')][:budget]
+
+
+def merge_candidates(ranked_lists, limit):
+    """Round-robin merge of ranked position lists, dropping duplicates, up to `limit` items"""
+    merged = []
+    seen = set()
+    longest = max((len(ranked) for ranked in ranked_lists), default=0)
+    for rank in range(longest):
+        for ranked in ranked_lists:
+            if rank < len(ranked):
+                position = int(ranked[rank])
+                if position not in seen:
+                    seen.add(position)
+                    merged.append(position)
+                    if len(merged) >= limit:
+                        return np.array(merged, dtype=np.int64)
+    return np.array(merged, dtype=np.int64)
+
+
+def generate_candidates(catalog, user, unread_mask, target_level, n_recommendations, config=None,
+                        deadline=None):
+    """Run the candidate generators and merge their output
+    
+    Generators still pending when the `deadline` (a time.perf_counter() value)
+    has passed are skipped. A generator with 'max_ms' sees the earlier of the
+    deadline and its own time budget as context['deadline'].
+
+    Returns:
+        tuple: (sorted catalog positions for the re-ranker, per-stage stats dict)
+    """
+    config = config or PIPELINE_CONFIG
+    allowed = np.asarray(unread_mask, dtype=bool)
+    if AGE_FILTER:
+        allowed = allowed & catalog.age_mask(user['age'])
+
+    context = {
+        'catalog': catalog,
+        'user': user,
+        'allowed': allowed,
+        'target_level': target_level,
+        'deadline': deadline,
+    }
+
+    stats = {}
+    ranked_lists = []
+    for name, settings in config['generators'].items():
+        if not settings.get('enabled', True):
+            continue
+        generator = CANDIDATE_GENERATORS.get(name)
+        if generator is None:
+            print(f"Unknown candidate generator: {name}")
+            continue
+        if deadline is not None and time.perf_counter() >= deadline and ranked_lists:
+            stats[name] = {'candidates': 0, 'budget': 0, 'ms': 0.0, 'skipped': 'deadline'}
+            continue
+        budget = max(int(settings.get('budget', 100)), n_recommendations)
+        started = time.perf_counter()
+        context['deadline'] = deadline
+        if settings.get('max_ms') is not None:
+            stage_deadline = started + float(settings['max_ms']) / 1000.0
+            context['deadline'] = stage_deadline if deadline is None else min(deadline, stage_deadline)
+        positions = generator(context, budget)
+        stats[name] = {
+            'candidates': int(len(positions)),
+            'budget': budget,
+            'ms': (time.perf_counter() - started) * 1000
+        }
+        ranked_lists.append(positions)
+
+    started = time.perf_counter()
+    limit = max(int(config.get('rerank_budget', 300)), n_recommendations)
+    merged = merge_candidates(ranked_lists, limit)
+    stats['merge'] = {
+        'candidates': int(len(merged)),
+        'budget': limit,
+        'ms': (time.perf_counter() - started) * 1000
+    }
+    # Catalog order keeps the re-ranker's tie-breaking independent of generator order
+    return np.sort(merged), stats
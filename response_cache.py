@@ -0,0 +1,137 @@
+# Conditional GET support and a server-side cache of rendered JSON responses
+# Read endpoints declare which data scopes they depend on; the ETag and
+# Last-Modified headers are derived from those scopes' version counters, so a
+# poll that finds nothing changed is answered with 304 without touching pandas.
+
+import os
+import time
+import hashlib
+import functools
+import threading
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+
+from flask import request, Response
+
+import database
+
+# Maximum number of rendered responses kept per process
+MAX_ENTRIES = int(os.environ.get('FREADOM_RESPONSE_CACHE_SIZE', '1024'))
+
+# path -> (etag, body bytes, mimetype)
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+# Versions of process-local state (e.g. the selected model), scope -> (version, updated_at)
+# Seeded with the start time so validators issued before a restart never match
+_local_versions = {'model': (0, time.time())}
+
+# Hit/miss counters for monitoring
+stats = {'hits': 0, 'misses': 0, 'not_modified': 0}
+
+
+def bump_local_version(scope):
+    """Mark process-local state (such as the active model) as changed"""
+    version = _local_versions.get(scope, (0, 0.0))[0] + 1
+    _local_versions[scope] = (version, time.time())
+
+
+def clear():
+    """Drop every cached response"""
+    with _lock:
+        _cache.clear()
+
+
+def cache_info():
+    """Entries, body bytes and hit counters of the response cache"""
+    with _lock:
+        entries = len(_cache)
+        body_bytes = sum(len(entry[1]) for entry in _cache.values())
+    return dict(stats, entries=entries, max_entries=MAX_ENTRIES, bytes=body_bytes)
+
+
+def _scope_versions(scopes):
+    """Resolve version counters, local scopes first, then the database table"""
+    versions = {}
+    shared = []
+    for scope in scopes:
+        if scope in _local_versions:
+            versions[scope] = _local_versions[scope]
+        else:
+            shared.append(scope)
+    if shared:
+        versions.update(database.get_data_versions(shared))
+    return versions
+
+
+def _not_modified(etag, last_modified):
+    """Check the request's validators against the current ETag / Last-Modified"""
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match:
+        candidates = [tag.strip() for tag in if_none_match.split(',')]
+        return etag in candidates or '*' in candidates
+
+    if_modified_since = request.headers.get('If-Modified-Since')
+    if if_modified_since and last_modified:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        # HTTP dates have one-second resolution, never trust the current second
+        return int(last_modified) <= since and int(last_modified) < int(time.time())
+    return False
+
+
+def _finish(response, etag, last_modified):
+    response.headers['ETag'] = etag
+    if last_modified:
+        response.headers['Last-Modified'] = formatdate(last_modified, usegmt=True)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def cached_get(*scopes):
+    """Decorator for read-only JSON views
+
+    Args:
+        scopes: data scopes the response depends on; they may reference the
+            view's URL arguments, e.g. 'user:{user_id}'
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(**kwargs):
+            resolved = [scope.format(**kwargs) for scope in scopes]
+            versions = _scope_versions(resolved)
+
+            path = request.full_path
+            fingerprint = repr((path, sorted(versions.items())))
+            etag = '"' + hashlib.sha1(fingerprint.encode('utf-8')).hexdigest()[:20] + '"'
+            last_modified = max((updated_at for _, updated_at in versions.values()), default=0.0)
+
+            if _not_modified(etag, last_modified):
+                stats['not_modified'] += 1
+                return _finish(Response(status=304), etag, last_modified)
+
+            with _lock:
+                entry = _cache.get(path)
+                if entry is not None and entry[0] == etag:
+                    _cache.move_to_end(path)
+            if entry is not None and entry[0] == etag:
+                stats['hits'] += 1
+                return _finish(Response(entry[1], mimetype=entry[2]), etag, last_modified)
+
+            stats['misses'] += 1
+            response = view(**kwargs)
+            if not isinstance(response, Response) or response.status_code != 200:
+                return response
+            if 'no-store' in response.headers.get('Cache-Control', ''):
+                # The view marked this answer as provisional (e.g. a scoring fallback)
+                return response
+            with _lock:
+                _cache[path] = (etag, response.get_data(), response.mimetype)
+                _cache.move_to_end(path)
+                while len(_cache) > MAX_ENTRIES:
+                    _cache.popitem(last=False)
+            return _finish(response, etag, last_modified)
+        return wrapper
+    return decorator
@@ -1,8 +1,19 @@
 # This file contains the implementation of the semantic similarity analyzer
 # It supports both sentence-transformers and Qwen3-0.6B model for embeddings
 
+import os
+import gc
+import time
+import threading
+from contextlib import contextmanager
 import numpy as np
 import torch  # Required for Qwen model processing
+import inference_batcher
+import inference_service
+from inference_limiter import inference_slot, configure_torch_threads
+
+# Keep concurrent inference calls from oversubscribing the CPU with torch threads
+configure_torch_threads()
 
 # Define model variables
 sbert_model = None
@@ -10,10 +21,42 @@ qwen_model = None
 qwen_tokenizer = None
 current_model = "sbert"  # Default model
 
+# Background thread warming up the selected model
+_loader = None
+_loader_lock = threading.Lock()
+
+# Unload a model after this many seconds without inference (0 keeps models loaded forever)
+MODEL_IDLE_SECONDS = float(os.environ.get('FREADOM_MODEL_IDLE_SECONDS', '0'))
+
+# Per-model count of running encode calls and the time of the last one; a model
+# is only unloaded while nothing is using it
+_model_lock = threading.Lock()
+_in_use = {'sbert': 0, 'qwen': 0}
+_last_used = {'sbert': 0.0, 'qwen': 0.0}
+_reaper = None
+
+# Serialize loads so concurrent requests after an unload share one copy of the model
+_load_locks = {'sbert': threading.Lock(), 'qwen': threading.Lock()}
+
+def cosine_scores(user_embedding, content_embeddings):
+    """Cosine similarity of one vector against every row of a matrix"""
+    content_embeddings = np.asarray(content_embeddings, dtype=np.float32)
+    user_embedding = np.asarray(user_embedding, dtype=np.float32)
+    norms = np.linalg.norm(content_embeddings, axis=1) * np.linalg.norm(user_embedding)
+    return (content_embeddings @ user_embedding) / np.maximum(norms, 1e-12)
+
 try:
     from sentence_transformers import SentenceTransformer
     
     def load_sbert_model():
+        """Load the Sentence-BERT model unless it is loaded, once across concurrent callers"""
+        if sbert_model is not None:
+            return True
+        with _load_locks['sbert']:
+            # Re-checked inside: the thread that held the lock may have loaded it
+            return _load_sbert_model()
+    
+    def _load_sbert_model():
         """Load the Sentence-BERT model"""
         global sbert_model
         if sbert_model is None:
@@ -21,6 +64,7 @@ try:
                 # Using a common model that should be available
                 sbert_model = SentenceTransformer('all-MiniLM-L6-v2')
                 print("SBERT model loaded successfully!")
+                start_idle_reaper()
                 return True
             except Exception as e:
                 print(f"Error loading SBERT model: {e}")
@@ -29,6 +73,7 @@ try:
                     print("Trying fallback model...")
                     sbert_model = SentenceTransformer('distilbert-base-nli-mean-tokens')
                     print("Fallback SBERT model loaded successfully!")
+                    start_idle_reaper()
                     return True
                 except Exception as e2:
                     print(f"Error loading fallback SBERT model: {e2}")
@@ -36,6 +81,13 @@ try:
         return True
     
     def load_qwen_model():
+        """Load the Qwen3-0.6B model unless it is loaded, once across concurrent callers"""
+        if qwen_model is not None:
+            return True
+        with _load_locks['qwen']:
+            return _load_qwen_model()
+    
+    def _load_qwen_model():
         """Load the Qwen3-0.6B model"""
         global qwen_model, qwen_tokenizer
         if qwen_model is None:
@@ -52,6 +104,7 @@ try:
                     trust_remote_code=True
                 )
                 print("Qwen model loaded successfully!")
+                start_idle_reaper()
                 return True
             except Exception as e:
                 print(f"Error loading Qwen model: {e}")
@@ -66,6 +119,7 @@ try:
                         device_map="auto"
                     )
                     print("Fallback model loaded successfully!")
+                    start_idle_reaper()
                     return True
                 except Exception as e2:
                     print(f"Error loading fallback model: {e2}")
@@ -78,7 +132,129 @@ try:
             return load_qwen_model()
         else:
             return load_sbert_model()
+    
+    def is_model_available():
+        """True when embedding models can be used at all"""
+        return True
+    
+    def is_model_loaded():
+        """True when the selected model can answer without being loaded first"""
+        if inference_service.is_enabled():
+            return True
+        if current_model == "qwen":
+            return qwen_model is not None
+        return sbert_model is not None
+    
+    def load_model_async():
+        """Start loading the selected model in a background thread unless one is already running"""
+        global _loader
+        with _loader_lock:
+            if _loader is not None and _loader.is_alive():
+                return
+            _loader = threading.Thread(target=load_model, name="model-loader", daemon=True)
+            _loader.start()
+    @contextmanager
+    def _using(name):
+        """Keep a model from being unloaded while it encodes (reloading it if it was)"""
+        with _model_lock:
+            _in_use[name] += 1
+            _last_used[name] = time.time()
+        try:
+            if name == "qwen":
+                load_qwen_model()
+            else:
+                load_sbert_model()
+            yield
+        finally:
+            with _model_lock:
+                _in_use[name] -= 1
+                _last_used[name] = time.time()
+    
+    def _module_memory(module):
+        """Parameter and buffer counts/bytes of a torch module"""
+        tensors = list(module.parameters()) + list(module.buffers())
+        return {
+            'parameters': int(sum(tensor.numel() for tensor in module.parameters())),
+            'bytes': int(sum(tensor.numel() * tensor.element_size() for tensor in tensors)),
+            'dtype': str(next(module.parameters()).dtype) if tensors else None
+        }
+    
+    def model_memory():
+        """Memory held by each model in this process"""
+        now = time.time()
+        report = {}
+        for name, model in (("sbert", sbert_model), ("qwen", qwen_model)):
+            entry = {'loaded': model is not None, 'in_use': _in_use[name]}
+            if model is not None:
+                entry.update(_module_memory(model))
+            if _last_used[name]:
+                entry['idle_seconds'] = round(now - _last_used[name], 1)
+            report[name] = entry
+        return report
+    
+    def unload_model(name=None):
+        """Drop a loaded model ('sbert', 'qwen', or None for both) so its memory can be freed
+        
+        A model that is encoding right now is left alone. The next call that
+        needs it loads it again.
+        
+        Returns:
+            list: names of the models that were unloaded
+        """
+        global sbert_model, qwen_model, qwen_tokenizer
+        unloaded = []
+        with _model_lock:
+            if name in (None, "sbert") and sbert_model is not None and not _in_use["sbert"]:
+                sbert_model = None
+                unloaded.append("sbert")
+            if name in (None, "qwen") and qwen_model is not None and not _in_use["qwen"]:
+                qwen_model = None
+                qwen_tokenizer = None
+                unloaded.append("qwen")
+        if unloaded:
+            gc.collect()
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+            print(f"Unloaded models: {', '.join(unloaded)}")
+        return unloaded
+    
+    def _reap_idle_models():
+        interval = min(60.0, max(MODEL_IDLE_SECONDS / 4, 1.0))
+        while True:
+            time.sleep(interval)
+            now = time.time()
+            for name in ("sbert", "qwen"):
+                if _last_used[name] and now - _last_used[name] >= MODEL_IDLE_SECONDS:
+                    unload_model(name)
+    
+    def start_idle_reaper():
+        """Unload models idle for MODEL_IDLE_SECONDS in a background thread (no-op when 0)
+        
+        Started by the first model load.
+        """
+        global _reaper
+        if MODEL_IDLE_SECONDS <= 0:
+            return False
+        with _loader_lock:
+            if _reaper is None:
+                _reaper = threading.Thread(target=_reap_idle_models, name="model-reaper", daemon=True)
+                _reaper.start()
+        return True
+    
       # SBERT-specific functions
+    def _sbert_encode_batch(texts):
+        """Run one SBERT forward pass over a list of texts"""
+        return sbert_model.encode(texts)
+    
+    def sbert_encode(texts):
+        """Encode texts with SBERT, through the micro-batcher when it is enabled"""
+        with _using("sbert"):
+            if inference_batcher.ENABLED:
+                # The batcher holds one limiter slot per batched forward pass, not one per caller
+                return inference_batcher.get_batcher("sbert", _sbert_encode_batch, slot=inference_slot).encode(texts)
+            with inference_slot():
+                return _sbert_encode_batch(texts)
+    
     def get_sbert_content_embeddings(content_list):
         """Generate embeddings for content descriptions using SBERT"""
         if not load_sbert_model():
@@ -90,7 +266,7 @@ try:
             desc = f"{item['title']}. {topics_str}"
             descriptions.append(desc)
             
-        embeddings = sbert_model.encode(descriptions)
+        embeddings = sbert_encode(descriptions)
         return embeddings
     
     def get_sbert_interest_embedding(interests):
@@ -99,10 +275,45 @@ try:
             return None
             
         interest_text = " ".join(interests)
-        embedding = sbert_model.encode([interest_text])[0]
+        embedding = sbert_encode([interest_text])[0]
         return embedding
     
     # Qwen3-specific functions
+    # Texts per padded forward pass when encoding many descriptions
+    QWEN_BATCH_SIZE = 16
+    
+    def _qwen_encode_batch(texts):
+        """Run padded Qwen forward passes and mean-pool the last hidden state over real tokens"""
+        if qwen_tokenizer.pad_token is None:
+            qwen_tokenizer.pad_token = qwen_tokenizer.eos_token
+        # Right padding keeps the hidden states of the real tokens unchanged
+        qwen_tokenizer.padding_side = "right"
+        
+        embeddings = []
+        for start in range(0, len(texts), QWEN_BATCH_SIZE):
+            inputs = qwen_tokenizer(
+                texts[start:start + QWEN_BATCH_SIZE], return_tensors="pt", padding=True
+            ).to(qwen_model.device)
+            with torch.no_grad():
+                outputs = qwen_model(**inputs, output_hidden_states=True)
+            
+            # Use the last hidden state of the last layer as embedding
+            last_hidden_state = outputs.hidden_states[-1]
+            # Mean pooling over the attended (non-padding) positions
+            mask = inputs["attention_mask"].unsqueeze(-1).to(last_hidden_state.dtype)
+            pooled = (last_hidden_state * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+            embeddings.append(pooled.float().cpu().numpy())
+        return np.concatenate(embeddings) if embeddings else np.empty((0, 0))
+    
+    def qwen_encode(texts):
+        """Encode texts with Qwen, through the micro-batcher when it is enabled"""
+        with _using("qwen"):
+            if inference_batcher.ENABLED:
+                # The batcher holds one limiter slot per batched forward pass, not one per caller
+                return inference_batcher.get_batcher("qwen", _qwen_encode_batch, slot=inference_slot).encode(texts)
+            with inference_slot():
+                return _qwen_encode_batch(texts)
+    
     def get_qwen_content_embeddings(content_list):
         """Generate embeddings for content descriptions using Qwen3"""
         if not load_qwen_model():
@@ -114,19 +325,7 @@ try:
             desc = f"{item['title']}. {topics_str}"
             descriptions.append(desc)
             
-        embeddings = []
-        for desc in descriptions:
-            inputs = qwen_tokenizer(desc, return_tensors="pt").to(qwen_model.device)
-            with torch.no_grad():
-                outputs = qwen_model(**inputs, output_hidden_states=True)
-            
-            # Use the last hidden state of the last layer as embedding
-            last_hidden_state = outputs.hidden_states[-1]
-            # Mean pooling to get a single vector
-            embedding = last_hidden_state.mean(dim=1).squeeze().cpu().numpy()
-            embeddings.append(embedding)
-            
-        return np.array(embeddings)
+        return np.asarray(qwen_encode(descriptions))
     
     def get_qwen_interest_embedding(interests):
         """Generate embedding for user interests using Qwen3"""
@@ -134,15 +333,68 @@ try:
             return None
             
         interest_text = " ".join(interests)
-        inputs = qwen_tokenizer(interest_text, return_tensors="pt").to(qwen_model.device)
-        with torch.no_grad():
-            outputs = qwen_model(**inputs, output_hidden_states=True)
+        return np.asarray(qwen_encode([interest_text]))[0]
+    
+    def encode_texts(texts, model_name=None):
+        """Encode raw texts with the given (or currently selected) model in this process"""
+        model = model_name or current_model
+        if model == "qwen":
+            return qwen_encode(texts) if load_qwen_model() else None
+        return sbert_encode(texts) if load_sbert_model() else None
+    
+    def remote_embed(texts):
+        """Encode texts in the inference service, counted against the local limiter"""
+        with inference_slot():
+            return np.asarray(inference_service.embed(texts, current_model))
+    
+    def _content_description(item):
+        topics_str = ' '.join(item['topics']) if isinstance(item['topics'], list) else item['topics']
+        return f"{item['title']}. {topics_str}"
+    
+    def encode_content(content_items):
+        """Encode content items with the currently selected model"""
+        if inference_service.is_enabled():
+            try:
+                return remote_embed([_content_description(item) for item in content_items])
+            except inference_service.InferenceError as e:
+                print(f"Inference service unavailable ({e}), encoding in-process")
+        if current_model == "qwen":
+            return get_qwen_content_embeddings(content_items)
+        return get_sbert_content_embeddings(content_items)
+    
+    def get_interest_embedding(interests):
+        """Encode user interests with the currently selected model"""
+        if inference_service.is_enabled():
+            try:
+                return remote_embed([" ".join(interests)])[0]
+            except inference_service.InferenceError as e:
+                print(f"Inference service unavailable ({e}), encoding in-process")
+        if current_model == "qwen":
+            return get_qwen_interest_embedding(interests)
+        return get_sbert_interest_embedding(interests)
+    
+    def _snapshot_rows(content_items):
+        """(snapshot, row positions) of the items in the shared catalog snapshot
         
-        # Use the last hidden state of the last layer as embedding
-        last_hidden_state = outputs.hidden_states[-1]
-        # Mean pooling to get a single vector
-        embedding = last_hidden_state.mean(dim=1).squeeze().cpu().numpy()
-        return embedding
+        (None, None) when no snapshot is published, it was built with another
+        model, or any of the items is missing from it.
+        """
+        from embedding_store import attach
+        snapshot = attach()
+        if snapshot is None or snapshot.model != current_model or 'embeddings' not in snapshot:
+            return None, None
+        
+        rows = snapshot.rows_for_ids([item['id'] for item in content_items])
+        if rows is None:
+            return None, None
+        return snapshot, rows
+    
+    def stored_similarity(user_embedding, content_items):
+        """Cosine scores of a model embedding against the items' snapshot vectors, or None"""
+        snapshot, rows = _snapshot_rows(content_items)
+        if snapshot is None:
+            return None
+        return cosine_scores(snapshot.project(user_embedding), snapshot.embedding_rows(rows))
     
     def calculate_semantic_similarity(user_interests, content_items, model_name=None):
         """Calculate semantic similarity between user interests and content"""
@@ -155,27 +407,36 @@ try:
             else:
                 current_model = "sbert"
         
+        # With an inference service configured the models are not loaded in this process
+        if inference_service.is_enabled():
+            try:
+                user_embedding = remote_embed([" ".join(user_interests)])[0]
+                scores = stored_similarity(user_embedding, content_items)
+                if scores is None:
+                    content_embeddings = remote_embed([_content_description(item) for item in content_items])
+                    scores = cosine_scores(user_embedding, content_embeddings)
+                return [float(similarity) for similarity in scores]
+            except inference_service.InferenceError as e:
+                print(f"Inference service unavailable ({e}), running the model in-process")
+        
         # Use the appropriate model based on current_model
         if current_model == "qwen":
             if not load_qwen_model():
                 return [0.5] * len(content_items)  # Default value if model fails
                 
-            content_embeddings = get_qwen_content_embeddings(content_items)
             user_embedding = get_qwen_interest_embedding(user_interests)
         else:
             if not load_sbert_model():
                 return [0.5] * len(content_items)  # Default value if model fails
                 
-            content_embeddings = get_sbert_content_embeddings(content_items)
             user_embedding = get_sbert_interest_embedding(user_interests)
         
-        # Calculate cosine similarity
-        similarities = []
-        for content_emb in content_embeddings:
-            similarity = np.dot(user_embedding, content_emb) / (np.linalg.norm(user_embedding) * np.linalg.norm(content_emb))
-            similarities.append(float(similarity))
-        
-        return similarities
+        # Prefer the published catalog snapshot over re-encoding every item
+        scores = stored_similarity(user_embedding, content_items)
+        if scores is None:
+            # Calculate cosine similarity against all items at once
+            scores = cosine_scores(user_embedding, encode_content(content_items))
+        return [float(similarity) for similarity in scores]
 
     # Function to switch between models
     def set_model(model_name):
@@ -270,6 +531,46 @@ except ImportError:
         
         return similarities
         
+    def encode_texts(texts, model_name=None):
+        """Stub for text encoding in fallback mode"""
+        return None
+    
+    def encode_content(content_items):
+        """Stub for content encoding in fallback mode"""
+        return None
+    
+    def get_interest_embedding(interests):
+        """Stub for interest encoding in fallback mode"""
+        return None
+    
+    def stored_similarity(user_embedding, content_items):
+        """Stub for snapshot lookups in fallback mode"""
+        return None
+    
+    def is_model_available():
+        """No embedding model can be loaded in fallback mode"""
+        return False
+    
+    def is_model_loaded():
+        """Stub: no model is ever loaded in fallback mode"""
+        return False
+    
+    def load_model_async():
+        """Stub: nothing to load in fallback mode"""
+        return None
+    
+    def model_memory():
+        """Stub: no model is ever loaded in fallback mode"""
+        return {}
+    
+    def unload_model(name=None):
+        """Stub: nothing to unload in fallback mode"""
+        return []
+    
+    def start_idle_reaper():
+        """Stub: nothing to unload in fallback mode"""
+        return False
+        
     # Add stubs for the model switching functions
     def set_model(model_name):
         """Stub for model switching in fallback mode"""
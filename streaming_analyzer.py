@@ -0,0 +1,357 @@
+# Streaming text analysis for book-length texts
+# analyze_text_complexity, extract_topics and get_vocabulary_stats hold the whole
+# token list in memory. StreamingAnalyzer instead consumes text in chunks, only
+# ever tokenizes whole sentences, and keeps running counters, so memory stays
+# bounded by the chunk size and a few fixed-capacity counters whatever the
+# length of the book. Results have the same shape as the in-memory functions.
+#
+# Usage:
+#   python streaming_analyzer.py book.txt
+
+import re
+import sys
+import math
+import json
+import bisect
+import heapq
+import hashlib
+from functools import lru_cache
+
+import textstat
+
+import text_analyzer
+from vocabulary_analyzer import SIMPLE_WORDS, tokenize_text
+
+# Characters read from a file per chunk
+CHUNK_CHARS = 64 * 1024
+
+# An unterminated "sentence" longer than this is analysed anyway to bound the carry-over buffer
+MAX_CARRY_CHARS = 4 * CHUNK_CHARS
+
+# Candidate topics tracked exactly; beyond that the rarest are evicted (space-saving counter)
+TOPIC_CAPACITY = 5000
+
+# Distinct tokens counted exactly; beyond that the count is estimated with a KMV sketch
+VOCAB_EXACT_LIMIT = 50000
+VOCAB_SKETCH_SIZE = 4096
+
+# A line such as "Chapter 3", "CHAPTER IV: The Storm" starts a new chapter
+CHAPTER_RE = re.compile(r"^\s*(chapter\s+[\divxlc]+\b.*|prologue\b.*|epilogue\b.*)$", re.IGNORECASE)
+
+
+@lru_cache(maxsize=65536)
+def _syllables(word):
+    return textstat.syllable_count(word)
+
+
+class DistinctCounter:
+    """Exact distinct count up to a limit, then a k-minimum-values estimate"""
+
+    def __init__(self, exact_limit=VOCAB_EXACT_LIMIT, sketch_size=VOCAB_SKETCH_SIZE):
+        self.exact_limit = exact_limit
+        self.sketch_size = sketch_size
+        self.exact = set()
+        self.sketch = None  # sorted list of the smallest hash values seen
+
+    @staticmethod
+    def _hash(token):
+        return int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'big')
+
+    def add(self, token):
+        if self.sketch is None:
+            self.exact.add(token)
+            if len(self.exact) > self.exact_limit:
+                # Switch to the sketch and free the exact set
+                self.sketch = sorted({self._hash(t) for t in self.exact})[:self.sketch_size]
+                self.exact = None
+            return
+        value = self._hash(token)
+        if len(self.sketch) < self.sketch_size or value < self.sketch[-1]:
+            position = bisect.bisect_left(self.sketch, value)
+            if position == len(self.sketch) or self.sketch[position] != value:
+                self.sketch.insert(position, value)
+                if len(self.sketch) > self.sketch_size:
+                    self.sketch.pop()
+
+    def __len__(self):
+        if self.sketch is None:
+            return len(self.exact)
+        if len(self.sketch) < self.sketch_size:
+            return len(self.sketch)
+        # k-th smallest of uniform 64-bit hashes estimates (k - 1) / n
+        return int((self.sketch_size - 1) * (2 ** 64) / self.sketch[-1])
+
+
+class TopicCounter:
+    """Space-saving heavy-hitter counter with the tie order of Counter.most_common
+
+    Exact (and identical to collections.Counter) until more than `capacity`
+    distinct words have been seen.
+    """
+
+    def __init__(self, capacity=TOPIC_CAPACITY):
+        self.capacity = capacity
+        self.counts = {}
+        # One (count, insertion number, word) entry per word; counts may lag
+        # behind self.counts and are refreshed when the entry reaches the top
+        self._heap = []
+        self._inserted = 0
+
+    def _insert(self, word, count):
+        self.counts[word] = count
+        heapq.heappush(self._heap, (count, self._inserted, word))
+        self._inserted += 1
+
+    def _pop_rarest(self):
+        """Remove the word with the lowest count, the earliest inserted among equals"""
+        while True:
+            count, inserted, word = heapq.heappop(self._heap)
+            if self.counts[word] == count:
+                del self.counts[word]
+                return count
+            heapq.heappush(self._heap, (self.counts[word], inserted, word))
+
+    def add(self, word):
+        if word in self.counts:
+            self.counts[word] += 1
+        elif len(self.counts) < self.capacity:
+            self._insert(word, 1)
+        else:
+            # Replace the rarest word, inheriting its count as the error bound
+            self._insert(word, self._pop_rarest() + 1)
+
+    def most_common(self, n):
+        return sorted(self.counts.items(), key=lambda item: -item[1])[:n]
+
+
+class StreamingAnalyzer:
+    """Running text statistics fed one chunk at a time"""
+
+    def __init__(self):
+        self._carry = ""
+        self.sentence_count = 0
+        self.token_count = 0
+        self.word_count = 0
+        self.word_chars = 0
+        self.syllables = 0
+        self.polysyllables = 0
+        self.tokens = DistinctCounter()
+        self.topics = TopicCounter()
+        # vocabulary_analyzer statistics use its own tokenizer
+        self.vocab_words = 0
+        self.vocab_chars = 0
+        self.vocab_complex = 0
+        self.vocab_unique = DistinctCounter()
+
+    def feed(self, text):
+        """Add a chunk of text; only complete sentences are analysed now"""
+        buffer = self._carry + text
+        sentences = text_analyzer.simple_sent_tokenize(buffer)
+        if not sentences:
+            self._carry = buffer
+            return
+        # The last sentence may continue in the next chunk
+        *complete, last = sentences
+        for sentence in complete:
+            self._add_sentence(sentence)
+        if len(last) > MAX_CARRY_CHARS:
+            self._add_sentence(last)
+            last = ""
+        self._carry = last
+
+    def close(self):
+        """Analyse whatever is left in the carry-over buffer"""
+        if self._carry.strip():
+            self._add_sentence(self._carry)
+        self._carry = ""
+
+    def _add_sentence(self, sentence):
+        tokens = text_analyzer.simple_tokenize(sentence)
+        if not tokens:
+            return
+        self.sentence_count += 1
+        self.token_count += len(tokens)
+        stop_words = text_analyzer.stop_words
+        for token in tokens:
+            self.tokens.add(token)
+            if not token.isalpha():
+                continue
+            self.word_count += 1
+            self.word_chars += len(token)
+            syllables = _syllables(token)
+            self.syllables += syllables
+            if syllables >= 3:
+                self.polysyllables += 1
+            if len(token) > 3 and token not in stop_words:
+                self.topics.add(token)
+
+        for word in tokenize_text(sentence):
+            self.vocab_words += 1
+            self.vocab_chars += len(word)
+            self.vocab_unique.add(word)
+            if word not in SIMPLE_WORDS:
+                self.vocab_complex += 1
+
+    def result(self):
+        """Same keys as text_analyzer.analyze_text_complexity"""
+        if self.word_count == 0:
+            return {
+                'reading_level': 1,
+                'flesch_reading_ease': 100,
+                'flesch_kincaid_grade': 0,
+                'smog_index': 0,
+                'avg_word_length': 0,
+                'avg_sentence_length': 0,
+                'vocabulary_richness': 0,
+                'word_count': 0,
+                'sentence_count': 0
+            }
+        # textstat's formulas, applied to the running counts
+        words_per_sentence = self.word_count / max(self.sentence_count, 1)
+        syllables_per_word = self.syllables / self.word_count
+        flesch_reading_ease = round(206.835 - 1.015 * words_per_sentence - 84.6 * syllables_per_word, 2)
+        flesch_kincaid_grade = round(0.39 * words_per_sentence + 11.8 * syllables_per_word - 15.59, 1)
+        if self.sentence_count >= 3:
+            smog_index = round(1.043 * math.sqrt(self.polysyllables * 30 / self.sentence_count) + 3.1291, 1)
+        else:
+            smog_index = 0.0
+
+        return {
+            'reading_level': text_analyzer.grade_to_reading_level(flesch_kincaid_grade),
+            'flesch_reading_ease': flesch_reading_ease,
+            'flesch_kincaid_grade': flesch_kincaid_grade,
+            'smog_index': smog_index,
+            'avg_word_length': self.word_chars / self.word_count,
+            'avg_sentence_length': words_per_sentence,
+            'vocabulary_richness': len(self.tokens) / self.token_count,
+            'word_count': self.word_count,
+            'sentence_count': self.sentence_count
+        }
+
+    def top_topics(self, n=5):
+        """Same as text_analyzer.extract_topics"""
+        return [word for word, _ in self.topics.most_common(n)]
+
+    def vocabulary_stats(self):
+        """Same keys as vocabulary_analyzer.get_vocabulary_stats"""
+        if self.vocab_words == 0:
+            return {'total_words': 0, 'unique_words': 0, 'avg_word_length': 0, 'complex_word_ratio': 0}
+        return {
+            'total_words': self.vocab_words,
+            'unique_words': len(self.vocab_unique),
+            'avg_word_length': self.vocab_chars / self.vocab_words,
+            'complex_word_ratio': self.vocab_complex / self.vocab_words
+        }
+
+    def summary(self, n_topics=5):
+        return {
+            'analysis': self.result(),
+            'topics': self.top_topics(n_topics),
+            'vocabulary': self.vocabulary_stats()
+        }
+
+
+def iter_chunks(source, chunk_chars=CHUNK_CHARS):
+    """Yield text chunks from a file path, an open text file or an iterable of strings"""
+    if isinstance(source, str):
+        with open(source, encoding='utf-8') as f:
+            yield from iter_chunks(f, chunk_chars)
+        return
+    if hasattr(source, 'read'):
+        while True:
+            chunk = source.read(chunk_chars)
+            if not chunk:
+                return
+            yield chunk
+        return
+    yield from source
+
+
+def iter_lines(chunks):
+    """Re-split chunks into lines (keeping the newlines) for chapter detection"""
+    partial = ""
+    for chunk in chunks:
+        lines = (partial + chunk).splitlines(keepends=True)
+        partial = lines.pop() if lines and not lines[-1].endswith(("\n", "\r")) else ""
+        yield from lines
+        # A single enormous line is passed on in pieces rather than buffered whole
+        if len(partial) > MAX_CARRY_CHARS:
+            yield partial
+            partial = ""
+    if partial:
+        yield partial
+
+
+def iter_chapter_results(source, n_topics=5, chapter_re=CHAPTER_RE):
+    """Analyse a book and yield a partial result as each chapter finishes
+
+    Yields dicts with 'chapter' (index), 'title', 'analysis', 'topics' and
+    'vocabulary' for every chapter, then one final dict with 'chapter' None
+    holding the totals for the whole book. Text before the first heading
+    counts as chapter 0.
+    """
+    total = StreamingAnalyzer()
+    chapter = StreamingAnalyzer()
+    index, title = 0, None
+    pending = []
+    pending_chars = 0
+
+    def flush_pending():
+        nonlocal pending_chars
+        if pending:
+            text = "".join(pending)
+            chapter.feed(text)
+            total.feed(text)
+            pending.clear()
+            pending_chars = 0
+
+    for line in iter_lines(iter_chunks(source)):
+        heading = chapter_re.match(line)
+        if heading:
+            flush_pending()
+            chapter.close()
+            if chapter.sentence_count or title is not None:
+                yield dict(chapter.summary(n_topics), chapter=index, title=title)
+                index += 1
+            # Sentences never span chapters
+            total.close()
+            chapter = StreamingAnalyzer()
+            title = heading.group(1).strip()
+            continue
+        pending.append(line)
+        pending_chars += len(line)
+        if pending_chars >= CHUNK_CHARS:
+            flush_pending()
+
+    flush_pending()
+    chapter.close()
+    if chapter.sentence_count or title is not None:
+        yield dict(chapter.summary(n_topics), chapter=index, title=title)
+    total.close()
+    yield dict(total.summary(n_topics), chapter=None, title=None)
+
+
+def analyze_stream(source, n_topics=5):
+    """Analyse a book-length text with bounded memory
+
+    Returns:
+        dict: 'analysis', 'topics' and 'vocabulary' for the whole text plus
+        'chapters', the same per chapter
+    """
+    chapters = list(iter_chapter_results(source, n_topics))
+    totals = chapters.pop()
+    return {
+        'analysis': totals['analysis'],
+        'topics': totals['topics'],
+        'vocabulary': totals['vocabulary'],
+        'chapters': chapters
+    }
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python streaming_analyzer.py <book.txt>")
+        sys.exit(1)
+    # Print chapters as they complete instead of waiting for the whole book
+    for partial in iter_chapter_results(sys.argv[1]):
+        print(json.dumps(partial))
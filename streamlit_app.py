@@ -1,11 +1,11 @@
 import streamlit as st
 import pandas as pd
-import requests
 import json
 import time
 from PIL import Image, ImageDraw
 import io
 import base64
+import api_client
 
 # Set page config
 st.set_page_config(
@@ -15,7 +15,7 @@ st.set_page_config(
 )
 
 # Initialize API endpoint
-API_URL = "http://localhost:5000/api"
+API_URL = api_client.API_URL
 
 # Helper functions for UI
 def create_user_avatar(name, size=100):
@@ -74,14 +74,14 @@ def child_view():
     
     # Get user list
     try:
-        response = requests.get(f"{API_URL}/users")
-        users = response.json()
+        users = api_client.get("/users")
     except:
         st.error("Couldn't connect to the API. Is the Flask server running?")
         st.info("Run the Flask API with 'python app.py' in a separate terminal.")
         if st.button("Initialize Database"):
             try:
-                response = requests.get(f"{API_URL}/setup")
+                api_client.get("/setup", ttl=0)
+                api_client.invalidate_cache()
                 st.success("Database initialized! Please restart the app.")
             except:
                 st.error("Couldn't connect to initialize the database.")
@@ -106,9 +106,12 @@ def child_view():
         user_id = st.session_state.selected_user
         
         try:
-            # Get user progress
-            progress_response = requests.get(f"{API_URL}/user/{user_id}/progress")
-            progress = progress_response.json()
+            # Progress, recommendations and model info come back in one round trip
+            dashboard = api_client.get_dashboard(user_id)
+            if "error" in dashboard:
+                st.error(f"Error: {dashboard['error']}")
+                return
+            progress = dashboard["progress"]
             
             if "error" in progress or "message" in progress:
                 # Show recommendations anyway
@@ -123,18 +126,12 @@ def child_view():
                     for topic in progress["favorite_topics"][:3]:
                         st.write(f"- {topic}")
             
-            # Get recommendations
-            response = requests.get(f"{API_URL}/recommend/{user_id}?count=3")
-            recommendations = response.json()
+            recommendations = dashboard["recommendations"]
             
             # Check which model is being used
-            try:
-                model_response = requests.get(f"{API_URL}/settings/model")
-                current_model = model_response.json().get("current_model", "sbert")
-                if current_model == "qwen":
-                    st.caption("Using advanced AI for your recommendations! 🚀")
-            except:
-                pass  # Silently fail if can't get model info
+            current_model = dashboard["model"].get("current_model", "sbert")
+            if current_model == "qwen":
+                st.caption("Using advanced AI for your recommendations! 🚀")
             
             if isinstance(recommendations, list):
                 st.subheader("📘 Books Just For You!")
@@ -160,7 +157,7 @@ def child_view():
                         
                         if st.button(f"I want to read this!", key=f"read_{i}"):
                             # Mark as read
-                            read_response = requests.post(f"{API_URL}/user/{user_id}/read/{rec['id']}")
+                            read_response = api_client.mark_as_read(user_id, rec['id'])
                             st.balloons()
                             st.success("Great choice! Happy reading!")
                             time.sleep(1)  # Show success message briefly
@@ -178,11 +175,17 @@ def teacher_view():
     
     tab1, tab2, tab3, tab4 = st.tabs(["Student Progress", "Text Analysis", "Class Overview", "AI Model Settings"])
     
+    # The student list and the model setting don't depend on each other, fetch them together.
+    # A failed call is retried where it is used, so its error is shown in the right place
+    prefetched = api_client.fetch_all({"users": "/users", "model": "/settings/model"},
+                                      optional=("users", "model"))
+    
     with tab1:
         try:
             # Get user list
-            response = requests.get(f"{API_URL}/users")
-            users = response.json()
+            users = prefetched["users"]
+            if users is None:
+                users = api_client.get("/users")
             
             selected_user = st.selectbox(
                 "Select student:",
@@ -192,8 +195,7 @@ def teacher_view():
             
             if selected_user:
                 # Get student progress
-                progress_response = requests.get(f"{API_URL}/user/{selected_user}/progress")
-                progress = progress_response.json()
+                progress = api_client.get(f"/user/{selected_user}/progress")
                 
                 if "error" not in progress and "message" not in progress:
                     col1, col2 = st.columns(2)
@@ -255,8 +257,10 @@ def teacher_view():
         st.sidebar.subheader("Advanced Settings")
         try:
             # Get current model
-            model_response = requests.get(f"{API_URL}/settings/model")
-            current_model = model_response.json().get("current_model", "sbert")
+            model_setting = prefetched["model"]
+            if model_setting is None:
+                model_setting = api_client.get("/settings/model")
+            current_model = model_setting.get("current_model", "sbert")
             
             st.sidebar.write("**Semantic Analysis Model:**")
             selected_model = st.sidebar.radio(
@@ -272,10 +276,7 @@ def teacher_view():
                     with st.spinner(f"Switching to {selected_model.upper()} model..."):
                         try:
                             # Switch model via API
-                            switch_response = requests.post(
-                                f"{API_URL}/settings/model",
-                                json={"model": selected_model}
-                            )
+                            switch_response = api_client.set_model(selected_model)
                             
                             if switch_response.status_code == 200:
                                 st.sidebar.success(f"Now using {selected_model.upper()} model for recommendations")
@@ -290,10 +291,7 @@ def teacher_view():
             with st.spinner("Analyzing text..."):
                 try:
                     # Call API for analysis
-                    response = requests.post(
-                        f"{API_URL}/analyze",
-                        json={"text": text_input}
-                    )
+                    response = api_client.post("/analyze", json={"text": text_input})
                     
                     # Display teacher-focused results
                     result = response.json()
@@ -349,8 +347,7 @@ def teacher_view():
         
         # Get current model
         try:
-            response = requests.get(f"{API_URL}/settings/model")
-            current_model = response.json().get("current_model", "sbert")
+            current_model = api_client.get("/settings/model").get("current_model", "sbert")
         except Exception as e:
             st.error(f"Error fetching current model: {str(e)}")
             current_model = "unknown"
@@ -380,10 +377,7 @@ def teacher_view():
         
         if st.button("Apply Model Change"):
             try:
-                response = requests.post(
-                    f"{API_URL}/settings/model",
-                    json={"model": selected_model}
-                )
+                response = api_client.set_model(selected_model)
                 result = response.json()
                 if "error" in result:
                     st.error(f"Error: {result['error']}")
@@ -427,8 +421,8 @@ def teacher_view():
             if st.button("Download Models Now"):
                 with st.spinner("Downloading models..."):
                     try:
-                        result = requests.get(f"{API_URL}/setup/models")
-                        st.success(f"Model download initiated: {result.json().get('message', '')}")
+                        result = api_client.get("/setup/models", ttl=0)
+                        st.success(f"Model download initiated: {result.get('message', '')}")
                     except Exception as e:
                         st.error(f"Error initiating model download: {str(e)}")
 
@@ -438,8 +432,7 @@ def parent_view():
     
     try:
         # Get user list
-        response = requests.get(f"{API_URL}/users")
-        users = response.json()
+        users = api_client.get("/users")
         
         # Filter to show only children (in a real app, you'd link parents to children)
         st.subheader("Your Children")
@@ -451,9 +444,9 @@ def parent_view():
         )
         
         if selected_user:
-            # Get child progress
-            progress_response = requests.get(f"{API_URL}/user/{selected_user}/progress")
-            progress = progress_response.json()
+            # Get child progress together with the recommendation data shown below it
+            dashboard = api_client.get_dashboard(selected_user)
+            progress = dashboard.get("progress", dashboard)
             
             if "error" not in progress and "message" not in progress:
                 # User info
@@ -510,13 +503,11 @@ def parent_view():
                 st.subheader("Recommended Books")
                 try:
                     # Show which model is being used
-                    model_response = requests.get(f"{API_URL}/settings/model")
-                    current_model = model_response.json().get("current_model", "sbert")
+                    current_model = dashboard["model"].get("current_model", "sbert")
                     model_name = "Qwen3 (Advanced)" if current_model == "qwen" else "SBERT (Standard)" if current_model == "sbert" else "Basic"
                     st.caption(f"Using {model_name} AI model for recommendations")
                     
-                    rec_response = requests.get(f"{API_URL}/recommend/{selected_user}?count=3")
-                    recommendations = rec_response.json()
+                    recommendations = dashboard["recommendations"]
                     
                     if isinstance(recommendations, list):
                         st.write("Books your child might enjoy:")
@@ -551,8 +542,9 @@ def main():
     # Initialize database if needed
     if st.sidebar.button("Initialize Database"):
         try:
-            response = requests.get(f"{API_URL}/setup")
-            st.sidebar.success(response.json()["message"])
+            result = api_client.get("/setup", ttl=0)
+            api_client.invalidate_cache()
+            st.sidebar.success(result["message"])
         except:
             st.sidebar.error("Could not connect to API. Make sure Flask server is running.")
             st.sidebar.info("Run 'python app.py' in a terminal window first.")
@@ -600,5 +592,3 @@ def main():
 
 if __name__ == "__main__":
     main()
-</copilot-edited-file>
-```
\ No newline at end of file
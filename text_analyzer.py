@@ -1,28 +1,126 @@
-import textstat
+import os
 import re
-import nltk
-from nltk.tokenize import sent_tokenize, word_tokenize
-from nltk.corpus import stopwords
-
-# Download required NLTK resources
-try:
-    nltk.data.find('tokenizers/punkt')
-except LookupError:
-    nltk.download('punkt')
+import textstat
+
+# Tokenizer used for the text metrics: 'nltk' (punkt, the default) or 'regex'
+# (compiled patterns tuned for children's prose, no NLTK data needed)
+TOKENIZER = os.environ.get('FREADOM_TOKENIZER', 'nltk').lower()
+
+# Default extract_topics method: 'frequency' or 'tfidf' (corpus-weighted, see topic_model.py)
+TOPIC_METHOD = os.environ.get('FREADOM_TOPIC_METHOD', 'frequency').lower()
+
+# NLTK's English stopword list, built in so the regex mode never touches NLTK
+ENGLISH_STOPWORDS = frozenset("""
+i me my myself we our ours ourselves you you're you've you'll you'd your yours yourself
+yourselves he him his himself she she's her hers herself it it's its itself they them their
+theirs themselves what which who whom this that that'll these those am is are was were be
+been being have has had having do does did doing a an the and but if or because as until
+while of at by for with about against between into through during before after above below
+to from up down in out on off over under again further then once here there when where why
+how all any both each few more most other some such no nor not only own same so than too
+very s t can will just don don't should should've now d ll m o re ve y ain aren aren't
+couldn couldn't didn didn't doesn doesn't hadn hadn't hasn hasn't haven haven't isn isn't
+ma mightn mightn't mustn mustn't needn needn't shan shan't shouldn shouldn't wasn wasn't
+weren weren't won won't wouldn wouldn't
+""".split())
+
+# Word tokens in the style of NLTK's treebank tokenizer: contractions are split
+# ("can't" -> "ca", "n't"), hyphenated words stay whole, punctuation stands alone
+_WORD_RE = re.compile(r"""
+    [^\W\d_]+(?=n't\b)                  # stem of a negated contraction
+  | n't\b
+  | '(?:s|re|ve|ll|d|m)\b                # clitics
+  | [^\W\d_]+(?:-[^\W\d_]+)*             # words, hyphenated words
+  | \d+(?:[.,:]\d+)*                    # numbers, times
+  | \.\.\.|--
+  | [^\w\s]                             # any other single symbol
+""", re.VERBOSE)
+
+# Sentence boundary: terminal punctuation, optional closing quotes/brackets, whitespace,
+# then something that can start a sentence
+_SENTENCE_END_RE = re.compile(r"""(?<=[.!?])(["')\]]*)\s+(?=["'(\[]?[A-Z0-9])""")
+
+# Abbreviations that end in a period without ending the sentence. "No." only counts
+# before a number ("No. 5"), "etc." usually ends its sentence
+_ABBREVIATIONS = frozenset(["mr", "mrs", "ms", "dr", "st", "prof", "sr", "jr", "mt", "vs"])
+
+_nltk_loaded = False
+stop_words = ENGLISH_STOPWORDS
+
+def _load_nltk():
+    """Import NLTK and its data on first use, so importing this module stays cheap"""
+    global _nltk_loaded, stop_words
+    if _nltk_loaded:
+        return
+    import nltk
+    # Download required NLTK resources
+    try:
+        nltk.data.find('tokenizers/punkt')
+    except LookupError:
+        nltk.download('punkt')
+        
+    try:
+        nltk.data.find('corpora/stopwords')
+    except LookupError:
+        nltk.download('stopwords')
     
-try:
-    nltk.data.find('corpora/stopwords')
-except LookupError:
-    nltk.download('stopwords')
+    from nltk.corpus import stopwords
+    stop_words = set(stopwords.words('english'))
+    _nltk_loaded = True
+
+def regex_tokenize(text):
+    """Lower-cased word and punctuation tokens without NLTK"""
+    return _WORD_RE.findall(text.lower())
+
+def regex_sent_tokenize(text):
+    """Split text into sentences without NLTK"""
+    sentences = []
+    start = 0
+    for match in _SENTENCE_END_RE.finditer(text):
+        # Closing quotes and brackets belong to the sentence they end
+        candidate = text[start:match.end(1)].rstrip()
+        last_word = text[start:match.start()].rsplit(None, 1)[-1].rstrip('.').lower() if candidate else ''
+        if (last_word in _ABBREVIATIONS or (last_word == 'no' and text[match.end()].isdigit())
+                or (len(last_word) == 1 and last_word.isalpha() and text[match.start() - 1] == '.')):
+            # "Mr. Smith", "J. R. R." - not a sentence end
+            continue
+        sentences.append(candidate.strip())
+        start = match.end()
+    tail = text[start:].strip()
+    if tail:
+        sentences.append(tail)
+    return [sentence for sentence in sentences if sentence]
 
 # Fallback for spaCy functionality
 def simple_tokenize(text):
+    if TOKENIZER == 'regex':
+        return regex_tokenize(text)
+    _load_nltk()
+    from nltk.tokenize import word_tokenize
     return word_tokenize(text.lower())
 
 def simple_sent_tokenize(text):
+    if TOKENIZER == 'regex':
+        return regex_sent_tokenize(text)
+    _load_nltk()
+    from nltk.tokenize import sent_tokenize
     return sent_tokenize(text)
 
-stop_words = set(stopwords.words('english'))
+def grade_to_reading_level(flesch_kincaid_grade):
+    """Convert a Flesch-Kincaid grade to a single reading level score (simplified for demo)
+    
+    Scale: 1 (easiest) to 5 (hardest)
+    """
+    if flesch_kincaid_grade < 2:
+        return 1
+    elif flesch_kincaid_grade < 4:
+        return 2
+    elif flesch_kincaid_grade < 6:
+        return 3
+    elif flesch_kincaid_grade < 8:
+        return 4
+    else:
+        return 5
 
 def analyze_text_complexity(text):
     """Analyze text and return complexity metrics"""
@@ -31,18 +129,7 @@ def analyze_text_complexity(text):
     flesch_kincaid_grade = textstat.flesch_kincaid_grade(text)
     smog_index = textstat.smog_index(text)
     
-    # Convert to a single reading level score (simplified for demo)
-    # Scale: 1 (easiest) to 5 (hardest)
-    if flesch_kincaid_grade < 2:
-        reading_level = 1
-    elif flesch_kincaid_grade < 4:
-        reading_level = 2
-    elif flesch_kincaid_grade < 6:
-        reading_level = 3
-    elif flesch_kincaid_grade < 8:
-        reading_level = 4
-    else:
-        reading_level = 5
+    reading_level = grade_to_reading_level(flesch_kincaid_grade)
         
     # Calculate other metrics using simple tokenization
     words = simple_tokenize(text)
@@ -90,18 +177,37 @@ def analyze_text_complexity(text):
         'sentence_count': sentence_count
     }
 
-def extract_topics(text, n=5):
-    """Extract main topics from text using simple frequency"""
+def topic_words(text):
+    """Candidate topic words of a text, in order of appearance"""
     words = simple_tokenize(text)
     
     # Extract nouns, excluding stopwords (simplified approach)
-    content_words = [word.lower() for word in words 
-                    if word.isalpha() and word.lower() not in stop_words 
-                    and len(word) > 3]
+    # (simple_tokenize has loaded NLTK's stopwords by now in nltk mode)
+    return [word.lower() for word in words 
+            if word.isalpha() and word.lower() not in stop_words 
+            and len(word) > 3]
+
+def extract_topics(text, n=5, method=None, content_id=None):
+    """Extract main topics from text
+    
+    Args:
+        method (str): 'frequency' (most common words of the text itself) or
+            'tfidf' (words weighted by their rarity across the catalog, see
+            topic_model.py); defaults to TOPIC_METHOD
+        content_id (int): catalog item the text belongs to, its tfidf topics
+            are then served from the per-item topic cache
+    """
+    if (method or TOPIC_METHOD) == 'tfidf':
+        import topic_model
+        if content_id is not None:
+            cached = topic_model.topics_for_content([content_id], n)
+            if content_id in cached:
+                return cached[content_id]
+        return topic_model.top_terms([text], n)[0]
     
     # Count and return most common
     from collections import Counter
-    word_counts = Counter(content_words)
+    word_counts = Counter(topic_words(text))
     common_topics = [item[0] for item in word_counts.most_common(n)]
     return common_topics
 
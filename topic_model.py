@@ -0,0 +1,329 @@
+# Corpus-level TF-IDF topics
+# extract_topics ranks the words of a text by how often they occur in it. This
+# module weights them by how rare they are across the whole catalog instead.
+# Document frequencies are stored in SQLite and updated incrementally as content
+# is ingested (only new or changed texts are counted). Term counts are scikit-learn
+# sparse matrices, so a batch of texts is scored in one pass. Topics of catalog
+# items are cached per content id and only recomputed when the text changes or
+# the corpus has grown by STALE_GROWTH since they were computed. Processes reload
+# the document frequencies once the corpus has grown by RELOAD_GROWTH, not on
+# every ingested chunk.
+#
+# Usage:
+#   python topic_model.py update          # count catalog texts not counted yet
+#   python topic_model.py update --rebuild
+#   python topic_model.py show 3
+
+import json
+import math
+import hashlib
+import sqlite3
+import argparse
+import threading
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import CountVectorizer
+
+import database
+from text_analyzer import topic_words
+
+# Topics stored per cached item; requests for up to this many are served from the cache
+CACHED_TOPICS = 20
+
+# Cached topics are recomputed once the corpus has grown by this fraction
+STALE_GROWTH = 0.25
+
+# Loaded document frequencies are reloaded once the corpus has grown (or shrunk) by this fraction
+RELOAD_GROWTH = 0.1
+
+# Texts counted per transaction by the update command
+UPDATE_BATCH = 1000
+
+# Ids / terms per IN (...) query, below SQLite's bound parameter limit
+ID_BATCH = 500
+
+
+def ensure_topic_tables(conn):
+    """Create the document frequency and topic cache tables if missing"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS topic_terms (
+        id INTEGER PRIMARY KEY,
+        term TEXT UNIQUE NOT NULL,
+        df INTEGER NOT NULL
+    )
+    ''')
+    # Distinct term ids (int32 bytes) each counted document contributed
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS topic_documents (
+        content_id INTEGER PRIMARY KEY,
+        text_hash TEXT NOT NULL,
+        term_ids BLOB NOT NULL
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS content_topics (
+        content_id INTEGER PRIMARY KEY,
+        topics TEXT NOT NULL,
+        text_hash TEXT NOT NULL,
+        corpus_documents INTEGER NOT NULL
+    )
+    ''')
+
+
+def text_hash(text):
+    return hashlib.sha1((text or '').encode('utf-8')).hexdigest()
+
+
+def document_terms(text):
+    """(text hash, sorted distinct topic words) of a text, as add_documents expects"""
+    return text_hash(text), sorted(set(topic_words(text or '')))
+
+
+def _in_batches(conn, query, values):
+    """Run `query` (with one IN ({}) placeholder) over values in batches"""
+    rows = []
+    for start in range(0, len(values), ID_BATCH):
+        batch = values[start:start + ID_BATCH]
+        rows.extend(conn.execute(query.format(','.join('?' * len(batch))), batch).fetchall())
+    return rows
+
+
+def _term_ids(conn, terms):
+    """Global ids of terms, registering new ones with a document frequency of 0"""
+    ids = dict(_in_batches(conn, "SELECT term, id FROM topic_terms WHERE term IN ({})", terms))
+    missing = [term for term in terms if term not in ids]
+    if missing:
+        conn.executemany("INSERT INTO topic_terms (term, df) VALUES (?, 0)", [(term,) for term in missing])
+        ids.update(_in_batches(conn, "SELECT term, id FROM topic_terms WHERE term IN ({})", missing))
+    return ids
+
+
+def add_documents(conn, documents):
+    """Fold documents into the stored document frequencies
+
+    The caller bumps the 'topics' data version when documents were counted,
+    and commits.
+
+    Args:
+        documents (list): (content_id, text hash, distinct terms) tuples from document_terms
+
+    Re-adding an unchanged document is a no-op; a changed one replaces the
+    terms it contributed before.
+
+    Returns:
+        int: number of documents counted or recounted
+    """
+    ensure_topic_tables(conn)
+    documents = {int(content_id): (digest, terms) for content_id, digest, terms in documents}
+    counted = {
+        content_id: (digest, blob) for content_id, digest, blob in _in_batches(
+            conn, "SELECT content_id, text_hash, term_ids FROM topic_documents WHERE content_id IN ({})",
+            list(documents)
+        )
+    }
+    changed = {
+        content_id: document for content_id, document in documents.items()
+        if counted.get(content_id, (None,))[0] != document[0]
+    }
+    if not changed:
+        return 0
+
+    ids = _term_ids(conn, sorted({term for _, terms in changed.values() for term in terms}))
+    delta = {}
+    rows = []
+    for content_id, (digest, terms) in changed.items():
+        if content_id in counted:
+            for term_id in np.frombuffer(counted[content_id][1], dtype=np.int32).tolist():
+                delta[term_id] = delta.get(term_id, 0) - 1
+        term_ids = np.array(sorted(ids[term] for term in terms), dtype=np.int32)
+        for term_id in term_ids.tolist():
+            delta[term_id] = delta.get(term_id, 0) + 1
+        rows.append((content_id, digest, term_ids.tobytes()))
+
+    conn.executemany("UPDATE topic_terms SET df = df + ? WHERE id = ?",
+                     [(change, term_id) for term_id, change in delta.items() if change])
+    conn.executemany("INSERT OR REPLACE INTO topic_documents VALUES (?, ?, ?)", rows)
+    return len(rows)
+
+
+class Corpus:
+    """Document frequencies of the catalog as loaded by this process"""
+
+    def __init__(self, version):
+        self.version = version
+        conn = sqlite3.connect(database.DB_PATH)
+        try:
+            ensure_topic_tables(conn)
+            self.documents = conn.execute("SELECT COUNT(*) FROM topic_documents").fetchone()[0]
+            rows = conn.execute("SELECT id, term, df FROM topic_terms").fetchall()
+        finally:
+            conn.close()
+        self.term_ids = {term: term_id for term_id, term, _ in rows}
+        df = np.zeros(max((row[0] for row in rows), default=0) + 1, dtype=np.float64)
+        for term_id, _, count in rows:
+            df[term_id] = count
+        # Smoothed idf, as sklearn's TfidfTransformer computes it
+        self.idf = np.log((1 + self.documents) / (1 + df)) + 1
+        self.unseen_idf = math.log(1 + self.documents) + 1
+
+    def idf_of(self, terms):
+        ids = [self.term_ids.get(term) for term in terms]
+        return np.array([self.unseen_idf if term_id is None else self.idf[term_id] for term_id in ids])
+
+
+_corpus = None
+_corpus_lock = threading.Lock()
+# 'topics' version the loaded corpus was last compared against the stored one
+_checked_version = None
+
+
+def _document_count():
+    conn = sqlite3.connect(database.DB_PATH)
+    try:
+        ensure_topic_tables(conn)
+        return conn.execute("SELECT COUNT(*) FROM topic_documents").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def get_corpus():
+    """Return the corpus statistics, reloading them once the corpus changed size by RELOAD_GROWTH
+
+    Smaller changes (such as single ingested chunks) keep the loaded
+    frequencies, whose idf values they barely move.
+    """
+    global _corpus, _checked_version
+    version = database.get_data_versions(['topics'])['topics']
+    if _corpus is not None and _checked_version == version:
+        return _corpus
+    with _corpus_lock:
+        if _corpus is None:
+            _corpus = Corpus(version)
+        elif _checked_version != version:
+            documents = _document_count()
+            if abs(documents - _corpus.documents) >= max(1, _corpus.documents * RELOAD_GROWTH):
+                _corpus = Corpus(version)
+        _checked_version = version
+        return _corpus
+
+
+def count_terms(texts):
+    """Sparse term counts of a batch of texts
+
+    Returns:
+        tuple: (csr matrix of shape (len(texts), len(terms)), terms)
+    """
+    vectorizer = CountVectorizer(analyzer=topic_words)
+    try:
+        counts = vectorizer.fit_transform(texts)
+    except ValueError:
+        # Not a single topic word in the batch
+        return sp.csr_matrix((len(texts), 0), dtype=np.int64), []
+    return counts.tocsr(), vectorizer.get_feature_names_out().tolist()
+
+
+def top_terms(texts, n=5):
+    """Top n TF-IDF terms of each text, weighted by catalog document frequencies"""
+    counts, terms = count_terms(texts)
+    if not terms:
+        return [[] for _ in texts]
+    weights = (counts @ sp.diags(get_corpus().idf_of(terms))).tocsr()
+    results = []
+    for row in range(weights.shape[0]):
+        start, end = weights.indptr[row], weights.indptr[row + 1]
+        columns, values = weights.indices[start:end], weights.data[start:end]
+        # Highest weight first, ties in alphabetical order
+        order = np.lexsort((columns, -values))[:n]
+        results.append([terms[column] for column in columns[order]])
+    return results
+
+
+def topics_for_content(content_ids, n=5):
+    """TF-IDF topics of catalog items, served from the per-item cache when fresh
+
+    Returns:
+        dict: content_id -> list of topics
+    """
+    content_ids = [int(content_id) for content_id in content_ids]
+    corpus = get_corpus()
+    conn = sqlite3.connect(database.DB_PATH)
+    try:
+        ensure_topic_tables(conn)
+        texts = dict(_in_batches(conn, "SELECT id, text FROM content WHERE id IN ({})", content_ids))
+        cached = {
+            content_id: (json.loads(topics), digest, documents)
+            for content_id, topics, digest, documents in _in_batches(
+                conn, "SELECT content_id, topics, text_hash, corpus_documents FROM content_topics WHERE content_id IN ({})",
+                list(texts)
+            )
+        }
+        results, misses = {}, []
+        for content_id, text in texts.items():
+            entry = cached.get(content_id)
+            if (entry is not None and n <= CACHED_TOPICS and entry[1] == text_hash(text)
+                    and corpus.documents <= entry[2] * (1 + STALE_GROWTH)):
+                results[content_id] = entry[0][:n]
+            else:
+                misses.append(content_id)
+
+        if misses:
+            computed = top_terms([texts[content_id] for content_id in misses], max(n, CACHED_TOPICS))
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO content_topics VALUES (?, ?, ?, ?)", [
+                    (content_id, json.dumps(topics), text_hash(texts[content_id]), corpus.documents)
+                    for content_id, topics in zip(misses, computed)
+                ])
+            results.update((content_id, topics[:n]) for content_id, topics in zip(misses, computed))
+    finally:
+        conn.close()
+    return results
+
+
+def update_catalog(rebuild=False, batch_size=UPDATE_BATCH):
+    """Count catalog texts that are new or changed since the last update
+
+    Returns:
+        dict: counts of items seen and counted
+    """
+    conn = sqlite3.connect(database.DB_PATH)
+    report = {'items': 0, 'counted': 0}
+    try:
+        ensure_topic_tables(conn)
+        if rebuild:
+            with conn:
+                conn.execute("DELETE FROM topic_terms")
+                conn.execute("DELETE FROM topic_documents")
+                conn.execute("DELETE FROM content_topics")
+                database.bump_data_version(conn, 'topics')
+        cursor = conn.execute("SELECT id, text FROM content ORDER BY id")
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            report['items'] += len(rows)
+            with conn:
+                counted = add_documents(conn, [(content_id, *document_terms(text)) for content_id, text in rows])
+                if counted:
+                    database.bump_data_version(conn, 'topics')
+            report['counted'] += counted
+    finally:
+        conn.close()
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Catalog TF-IDF topic model")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    update = subparsers.add_parser('update', help="count new or changed catalog texts")
+    update.add_argument('--rebuild', action='store_true', help="drop the stored frequencies and count everything")
+    show = subparsers.add_parser('show', help="print the topics of catalog items")
+    show.add_argument('content_ids', type=int, nargs='+')
+    show.add_argument('-n', type=int, default=5)
+    args = parser.parse_args()
+
+    if args.command == 'update':
+        print(json.dumps(update_catalog(args.rebuild), indent=2))
+    else:
+        for content_id, topics in topics_for_content(args.content_ids, args.n).items():
+            print(f"{content_id}: {', '.join(topics)}")
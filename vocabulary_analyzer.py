@@ -18,6 +18,15 @@ SIMPLE_WORDS = set(['the', 'and', 'to', 'a', 'in', 'that', 'is', 'was', 'for', '
                    'any', 'these', 'give', 'day', 'most', 'us', 'are', 'not', 'has',
                    'had', 'do', 'say', 'have', 'we', 'this', 'it', 'as', 'but', 'of'])
 
+# Difficulty multiplier per age range. For young readers, even small complexity
+# feels more difficult; for older readers, the raw score is appropriate.
+AGE_DIFFICULTY_SCALE = {
+    "5-7": 2.0,
+    "6-8": 1.7,
+    "7-9": 1.4,
+    "8-10": 1.2,
+}
+
 def tokenize_text(text):
     """Simple tokenization function"""
     # Convert to lowercase and split into words
@@ -40,19 +49,7 @@ def assess_vocabulary_difficulty(text, age_range=None):
     complexity = complex_word_count / len(words)
     
     # Apply age-appropriate scaling
-    if age_range:
-        if age_range == "5-7":
-            # For young readers, even small complexity feels more difficult
-            complexity = min(1.0, complexity * 2.0)
-        elif age_range == "6-8":
-            complexity = min(1.0, complexity * 1.7)
-        elif age_range == "7-9":
-            complexity = min(1.0, complexity * 1.4)
-        elif age_range == "8-10":
-            complexity = min(1.0, complexity * 1.2)
-        # For older readers, the raw score is appropriate
-    
-    return complexity
+    return min(1.0, complexity * AGE_DIFFICULTY_SCALE.get(age_range, 1.0))
 
 def get_vocabulary_stats(text):
     """Get detailed vocabulary statistics"""
@@ -0,0 +1,284 @@
+# Write-behind buffering for read events
+# With FREADOM_WRITE_BEHIND=1, mark-as-read appends the event to an fsync'd
+# append-only log and returns immediately. A background thread applies the
+# buffered events to SQLite in group commits: every FLUSH_INTERVAL_MS, or sooner
+# once FLUSH_MAX_EVENTS are waiting. get_user_data merges a user's pending events
+# so readers in this process see their own writes before the flush.
+#
+# Applying an event twice is harmless (ids already in a history are skipped),
+# so after a crash the log is simply replayed on startup. Every process start
+# writes its own log, one segment per group commit; a segment is deleted once
+# its events are committed. On startup a process adopts the logs of dead
+# processes, including those of an earlier run that had the same pid (the API
+# is always PID 1 in Docker).
+
+import os
+import glob
+import json
+import time
+import atexit
+import threading
+
+import database
+
+# Buffer read events instead of committing each one
+ENABLED = os.environ.get('FREADOM_WRITE_BEHIND', '0') == '1'
+
+# Directory of the append-only logs of events not yet committed to the database
+LOG_DIR = os.environ.get(
+    'FREADOM_WRITE_BEHIND_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'write_behind')
+)
+
+# Group commit every this many milliseconds...
+FLUSH_INTERVAL_MS = float(os.environ.get('FREADOM_WRITE_BEHIND_INTERVAL_MS', '50'))
+
+# ...or as soon as this many events are waiting
+FLUSH_MAX_EVENTS = int(os.environ.get('FREADOM_WRITE_BEHIND_MAX_EVENTS', '256'))
+
+_lock = threading.Lock()
+_wakeup = threading.Condition(_lock)
+_flush_lock = threading.Lock()
+_start_lock = threading.Lock()
+_log = None
+_log_path = None
+_flusher = None
+# Segments closed by a group commit whose events are not committed yet
+_sealed = []
+_segment = 0
+
+# Tells this process's logs apart from those of an earlier process with the same pid
+_START_STAMP = f"{time.time_ns():x}"
+
+# Events appended to the log but not yet committed, in arrival order
+_pending = []
+# user_id -> content ids pending for that user, for read-your-writes
+_pending_by_user = {}
+
+stats = {
+    'events': 0,
+    'duplicates': 0,
+    'flushes': 0,
+    'flushed_events': 0,
+    'replayed_events': 0,
+    'ack_ms_total': 0.0,
+    'ack_ms_max': 0.0,
+    'commit_ms_total': 0.0,
+    'commit_ms_max': 0.0,
+    'errors': 0,
+}
+
+
+def _open_log():
+    """This process's current log segment (caller holds the lock)"""
+    global _log, _log_path, _segment
+    if _log is None:
+        os.makedirs(LOG_DIR, exist_ok=True)
+        _segment += 1
+        _log_path = os.path.join(LOG_DIR, f"writes-{os.getpid()}-{_START_STAMP}-{_segment:06d}.log")
+        _log = open(_log_path, 'a', encoding='utf-8')
+    return _log
+
+
+def _seal_log():
+    """Close the current segment, later events go to a new one (caller holds the lock)"""
+    global _log
+    if _log is not None:
+        _log.close()
+        _sealed.append(_log_path)
+        _log = None
+
+
+def _append(lines):
+    """Append log lines and fsync them before anyone is acknowledged (caller holds the lock)"""
+    log = _open_log()
+    log.write("".join(lines))
+    log.flush()
+    os.fsync(log.fileno())
+
+
+def _enqueue(user_id, content_id):
+    """Track an event as pending (caller holds the lock)"""
+    _pending.append((user_id, content_id))
+    _pending_by_user.setdefault(user_id, []).append(content_id)
+
+
+def record_read(user_id, content_id):
+    """Durably log a read event and queue it for the next group commit
+
+    Returns:
+        bool: False if the user does not exist, True otherwise
+    """
+    user = database.get_user_data(user_id)
+    if user is None:
+        return False
+    # get_user_data already merged the pending events of this user
+    if content_id in user['history']:
+        stats['duplicates'] += 1
+        return True
+
+    started = time.perf_counter()
+    line = json.dumps({'user_id': int(user_id), 'content_id': int(content_id), 'ts': time.time()}) + "\n"
+    start()
+    with _lock:
+        _append([line])
+        _enqueue(int(user_id), int(content_id))
+        if len(_pending) >= FLUSH_MAX_EVENTS:
+            _wakeup.notify()
+    # Cached responses in this process must not hide the pending write
+    database.bump_local_version(f'user:{user_id}')
+
+    ack_ms = (time.perf_counter() - started) * 1000
+    stats['events'] += 1
+    stats['ack_ms_total'] += ack_ms
+    stats['ack_ms_max'] = max(stats['ack_ms_max'], ack_ms)
+    return True
+
+
+def pending_reads(user_id):
+    """Content ids read by the user that are not committed yet"""
+    with _lock:
+        return list(_pending_by_user.get(int(user_id), ()))
+
+
+def flush():
+    """Commit every pending event in one transaction"""
+    with _flush_lock:
+        with _lock:
+            batch = list(_pending)
+            # Every event of the sealed segments is in this batch
+            _seal_log()
+        if not batch:
+            return 0
+        
+        started = time.perf_counter()
+        try:
+            database.apply_read_events(batch)
+        except Exception as e:
+            # Events stay pending (and their segments on disk) and are retried on the next flush
+            stats['errors'] += 1
+            print(f"Write-behind flush failed: {e}")
+            return 0
+        commit_ms = (time.perf_counter() - started) * 1000
+        
+        with _lock:
+            del _pending[:len(batch)]
+            _pending_by_user.clear()
+            for user_id, content_id in _pending:
+                _pending_by_user.setdefault(user_id, []).append(content_id)
+            committed = list(_sealed)
+            del _sealed[:]
+        for path in committed:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    
+    stats['flushes'] += 1
+    stats['flushed_events'] += len(batch)
+    stats['commit_ms_total'] += commit_ms
+    stats['commit_ms_max'] = max(stats['commit_ms_max'], commit_ms)
+    return len(batch)
+
+
+def _run():
+    interval = FLUSH_INTERVAL_MS / 1000.0
+    while True:
+        with _lock:
+            _wakeup.wait_for(lambda: len(_pending) >= FLUSH_MAX_EVENTS, timeout=interval)
+        flush()
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _orphaned(path):
+    """Whether a log file was left behind by a process that is no longer running"""
+    # writes-<pid>-<start stamp>-<segment>.log, or writes-<pid>.log from older versions
+    parts = os.path.basename(path)[len("writes-"):-len(".log")].split('-')
+    try:
+        pid = int(parts[0])
+    except ValueError:
+        return False
+    if pid == os.getpid():
+        # Our pid, so unless the file is ours its writer is gone
+        return len(parts) != 3 or parts[1] != _START_STAMP
+    return not _process_alive(pid)
+
+
+def replay():
+    """Adopt the logs left behind by processes that are no longer running
+
+    Their events are copied into this process's log before the old files are
+    removed, so they stay durable until the next group commit.
+    """
+    adopted = 0
+    for path in sorted(glob.glob(os.path.join(LOG_DIR, "writes-*.log"))):
+        if not _orphaned(path):
+            continue
+        
+        lines, events = [], []
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    # A torn final line from a crash mid-write was never acknowledged
+                    continue
+                lines.append(line if line.endswith("\n") else line + "\n")
+                events.append((int(event['user_id']), int(event['content_id'])))
+        with _lock:
+            if lines:
+                _append(lines)
+            for user_id, content_id in events:
+                _enqueue(user_id, content_id)
+        os.remove(path)
+        adopted += len(events)
+    
+    stats['replayed_events'] += adopted
+    if adopted:
+        print(f"Replaying {adopted} buffered read events from {LOG_DIR}")
+    return adopted
+
+
+def start():
+    """Replay orphaned logs and start the flusher thread (idempotent)"""
+    global _flusher
+    if _flusher is not None:
+        return
+    with _start_lock:
+        if _flusher is not None:
+            return
+        replay()
+        _flusher = threading.Thread(target=_run, name="write-behind", daemon=True)
+        _flusher.start()
+
+
+def summary():
+    """Counters plus derived averages for monitoring"""
+    with _lock:
+        pending = len(_pending)
+        segments = _sealed + ([_log_path] if _log is not None else [])
+    flushes = max(stats['flushes'], 1)
+    events = max(stats['events'], 1)
+    return dict(stats,
+                enabled=ENABLED,
+                pending=pending,
+                flush_interval_ms=FLUSH_INTERVAL_MS,
+                flush_max_events=FLUSH_MAX_EVENTS,
+                avg_batch_events=stats['flushed_events'] / flushes,
+                avg_commit_ms=stats['commit_ms_total'] / flushes,
+                avg_ack_ms=stats['ack_ms_total'] / events,
+                log_segments=len(segments),
+                log_bytes=sum(os.path.getsize(path) for path in segments if os.path.exists(path)))
+
+
+# Commit whatever is still buffered when the process exits cleanly
+atexit.register(flush)